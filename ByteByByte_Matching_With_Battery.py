@@ -1,68 +1,91 @@
 from flask import Flask, request, jsonify
+import argparse
+import multiprocessing
 import os
 import sqlite3
-import struct
+import threading
+import time
+
+import fingerprint_batcher
+import fingerprint_cache
+import fingerprint_gallery
+import fingerprint_lsh
+import fingerprint_store
+import fps_serving
 
 app = Flask(__name__)
 
-DATABASE = 'fingerprint_data.db'
+DATABASE = fingerprint_store.DATABASE
 
-# Initialize the SQLite database
+# Initialize the SQLite database (older databases are upgraded and compacted once, see fingerprint_store.migrate)
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fingerprints (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            template BLOB NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Global variable to hold the mode (Enroll or Detect)
-SERVER_MODE = None
+    stats = fingerprint_store.init_db(DATABASE)
+    if stats['removed']:
+        print(f"Database compacted: {stats['removed']} duplicate templates merged.")
+
+SERVER_MODES = ('enroll', 'detect')
+DEFAULT_THRESHOLD = 80  # Minimum similarity (%) for a valid match
+NEAR_DUPLICATE_THRESHOLD = 95  # Enrollments at least this similar to a stored template are flagged (0: off)
+
+# Mode (index into SERVER_MODES, -1 before one is chosen) and match threshold. Shared memory created
+# before gunicorn forks its workers, so a switch through /admin/mode reaches all of them at once.
+server_mode = multiprocessing.Value('i', -1)
+match_threshold = multiprocessing.Value('d', DEFAULT_THRESHOLD)
+
+# Required in the X-Admin-Token header of /admin requests; without one only local clients are allowed
+ADMIN_TOKEN = None
+
+def get_server_mode():
+    index = server_mode.value
+    return SERVER_MODES[index] if index >= 0 else None
+
+def set_server_mode(mode):
+    server_mode.value = SERVER_MODES.index(mode)
+
+# Memory-mapped snapshot of the fingerprints table (fingerprint_gallery.py), refreshed when the database changes
+gallery = None
+gallery_lock = threading.Lock()
+
+def current_gallery():
+    global gallery
+    with gallery_lock:
+        if gallery is None or gallery.generation != fingerprint_gallery.database_generation(DATABASE):
+            started = time.perf_counter()
+            gallery, action = fingerprint_gallery.sync_gallery(DATABASE)
+            print(f"Gallery {action}: {len(gallery)} templates ({(time.perf_counter() - started) * 1000:.0f} ms)")
+        return gallery
+
+# Concurrent /detect requests are scored together in one pass over the gallery.
+# A window of 0 scores every request on its own.
+DETECT_BATCH_WINDOW_MS = 2
+DETECT_BATCH_SIZE = 32
+
+# 'lsh' scores each probe only against the candidates of the LSH index (fingerprint_lsh.py),
+# 'exhaustive' against every stored template
+DETECT_SEARCH_MODES = ('exhaustive', 'lsh')
+DETECT_SEARCH = 'exhaustive'
+
+# Bytes a probe may be shifted against a stored template (packet boundaries moved); 0 compares
+# position i with position i only, as calculate_similarity does
+DETECT_MAX_OFFSET = 0
+
+def score_probes(probes):
+    gallery = current_gallery()
+    candidates = None
+    if DETECT_SEARCH == 'lsh' and len(gallery):
+        index = fingerprint_lsh.gallery_index(gallery)
+        candidates = lambda probe: index.candidates(probe, DETECT_MAX_OFFSET)
+    return gallery.best_matches(probes, candidates, DETECT_MAX_OFFSET)
+
+detect_batcher = fingerprint_batcher.DetectBatcher(score_probes, DETECT_BATCH_WINDOW_MS / 1000, DETECT_BATCH_SIZE)
+
+# Results of recent /detect bodies, so a device retry with the same payload skips extraction and scoring
+detect_cache = fingerprint_cache.DetectCache()
 
 # Extract fingerprint data from raw data (with trailing 0x00 removal)
+# (The rules live in fingerprint_store so the bulk importer stores templates the same way)
 def extract_fingerprint_data(raw_data):
-    payloads = []
-    offset = 0
-
-    while offset < len(raw_data):
-        # Check for the packet header
-        if raw_data[offset:offset + 6] == b'\xef\x01\xff\xff\xff\xff':
-            # Extract the package identifier and length
-            try:
-                package_id = raw_data[offset + 6]
-                length = struct.unpack(">H", raw_data[offset + 7:offset + 9])[0]
-            except struct.error:
-                break  # Exit if the packet structure is incomplete
-
-            # Debug: Print details about the packet
-            print(f"Packet found: Header at offset {offset}, Package ID: {package_id}, Length: {length}")
-
-            # Extract the payload (excluding header, length, and checksum)
-            start = offset + 9  # Start of payload
-            end = offset + 9 + length - 2  # Exclude 2-byte checksum
-            payload = raw_data[start:end]
-
-            # Remove trailing 0x00 padding bytes (only from the end of the payload)
-            payload = payload.rstrip(b'\x00')
-
-            # Append valid payload
-            payloads.append(payload)
-
-            # Move offset to the next packet
-            offset = offset + 9 + length
-        else:
-            # Move to the next byte if no header is found
-            offset += 1
-
-    # Join all extracted payloads into one fingerprint template
-    fingerprint_template = b''.join(payloads)
-    print(f"Extracted fingerprint template ({len(fingerprint_template)} bytes): {fingerprint_template.hex()}")
-    return fingerprint_template
+    return fingerprint_store.extract_template(raw_data, verbose=True)
 
 # Calculate byte-by-byte similarity
 
@@ -76,7 +99,44 @@ def calculate_similarity(payload1, payload2):
 
 @app.route('/get_mode', methods=['GET'])
 def get_mode():
-    return jsonify({'mode': SERVER_MODE})
+    return jsonify({'mode': get_server_mode()})
+
+def admin_allowed():
+    if ADMIN_TOKEN:
+        return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/admin/mode', methods=['GET', 'POST'])
+def admin_mode():
+    """Shows or switches the mode (and optionally the threshold) while the server and its gallery keep running."""
+    if not admin_allowed():
+        return jsonify({'status': 'fail', 'message': 'Forbidden'}), 403
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode')
+        threshold = data.get('threshold')
+        if mode is not None and mode not in SERVER_MODES:
+            return jsonify({'status': 'fail', 'message': f"mode must be one of {', '.join(SERVER_MODES)}"}), 400
+        if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float))
+                                      or not 0 <= threshold <= 100):
+            return jsonify({'status': 'fail', 'message': 'threshold must be a number from 0 to 100'}), 400
+
+        if mode is not None:
+            set_server_mode(mode)
+        if threshold is not None:
+            match_threshold.value = threshold
+        print(f"Server switched to {get_server_mode()} mode (threshold {match_threshold.value:g}%).")
+
+    return jsonify({'status': 'success', 'mode': get_server_mode(), 'threshold': match_threshold.value})
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    if not admin_allowed():
+        return jsonify({'status': 'fail', 'message': 'Forbidden'}), 403
+    gallery = current_gallery()
+    return jsonify({'status': 'success', 'gallery': {'templates': len(gallery), 'generation': gallery.generation},
+                    'detect_cache': detect_cache.stats(), 'detect_batches': detect_batcher.stats()})
 
 @app.route('/battery', methods=['POST'])
 def receive_battery():
@@ -92,6 +152,10 @@ def receive_battery():
         return jsonify({'status': 'fail', 'message': str(e)}), 500
 
 
+def already_enrolled(row_id, username):
+    print(f"Template already enrolled as #{row_id} ({username}), not stored again")
+    return jsonify({'status': 'success', 'message': f'Fingerprint already enrolled for {username}.', 'duplicate_of': row_id}), 200
+
 @app.route('/upload', methods=['POST'])
 def upload_fingerprint():
     try:
@@ -100,23 +164,51 @@ def upload_fingerprint():
 
         # Extract the full fingerprint template
         fingerprint_template = extract_fingerprint_data(request.data)
+        if not fingerprint_template:
+            return jsonify({'status': 'fail', 'message': 'No fingerprint template found in data'}), 400
         print(f"Template to save (size: {len(fingerprint_template)} bytes): {fingerprint_template.hex()}")  # Debugging
+        template_hash = fingerprint_store.template_digest(fingerprint_template)
 
-        # Save fingerprint template to database as BLOB
+        # A retried upload (same template) is answered with the existing row
         conn = sqlite3.connect(DATABASE)
         cursor = conn.cursor()
-        cursor.execute('INSERT INTO fingerprints (username, template) VALUES (?, ?)', ("", sqlite3.Binary(fingerprint_template)))
+        existing = cursor.execute('SELECT id, username FROM fingerprints WHERE template_hash = ?', (template_hash,)).fetchone()
+        if existing:
+            conn.close()
+            return already_enrolled(*existing)
+
+        # Flag templates very close to one already stored (e.g. the same finger enrolled twice)
+        near_duplicate = None
+        gallery = current_gallery()
+        if NEAR_DUPLICATE_THRESHOLD > 0 and len(gallery):
+            index, similarity = gallery.best_row(fingerprint_template)
+            if index is not None and similarity >= NEAR_DUPLICATE_THRESHOLD:
+                near_duplicate = {'id': int(gallery.ids[index]), 'username': gallery.usernames[index],
+                                  'similarity': round(similarity, 2)}
+                print(f"Near-duplicate of #{near_duplicate['id']} ({near_duplicate['username']}), similarity {similarity:.2f}%")
+
+        # Save fingerprint template to database as BLOB; the unique hash index also catches a retry racing this one
+        cursor.execute('INSERT OR IGNORE INTO fingerprints (username, template, template_hash, near_duplicate_of) VALUES (?, ?, ?, ?)',
+                       ("", sqlite3.Binary(fingerprint_template), template_hash, near_duplicate and near_duplicate['id']))
         conn.commit()
+        if not cursor.rowcount:
+            existing = cursor.execute('SELECT id, username FROM fingerprints WHERE template_hash = ?', (template_hash,)).fetchone()
+            conn.close()
+            return already_enrolled(*existing)
+        row_id = cursor.lastrowid
 
         # Prompt for username input
         username = input("Enter the person's username: ").strip()
-        cursor.execute('UPDATE fingerprints SET username = ? WHERE id = (SELECT MAX(id) FROM fingerprints)', (username,))
+        cursor.execute('UPDATE fingerprints SET username = ? WHERE id = ?', (username, row_id))
         conn.commit()
         conn.close()
 
         print(f"Fingerprint saved for {username}, template size: {len(fingerprint_template)} bytes")
 
-        return jsonify({'status': 'success', 'message': f'Fingerprint saved for {username}.'}), 200
+        response = {'status': 'success', 'message': f'Fingerprint saved for {username}.'}
+        if near_duplicate:
+            response['near_duplicate_of'] = near_duplicate
+        return jsonify(response), 200
 
     except Exception as e:
         return jsonify({'status': 'fail', 'message': str(e)}), 500
@@ -127,32 +219,26 @@ def detect_fingerprint():
         if not request.data:
             return jsonify({'status': 'fail', 'message': 'No data received'}), 400
 
-        # Extract fingerprint template from request
-        fingerprint_template = extract_fingerprint_data(request.data)
-
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT username, template FROM fingerprints')
-        rows = cursor.fetchall()
-        conn.close()
-
-        # Initialize variables for finding the best match
-        best_match = None
-        best_similarity = 0  # We want to maximize similarity percentage
-
-        for username, stored_template in rows:
-            # Compare the input template with the stored template
-            similarity = calculate_similarity(fingerprint_template, stored_template)
+        # A retry of a request already scored against this gallery generation gets the same result
+        cache_key = detect_cache.key(request.data)
+        generation = current_gallery().generation
+        cached = detect_cache.get(cache_key, generation)
+        if cached is not None:
+            best_match, best_similarity, best_offset = cached
+        else:
+            # Extract fingerprint template from request
+            fingerprint_template = extract_fingerprint_data(request.data)
 
-            # Debugging output
-            print(f"Similarity with {username}: {similarity:.2f}%")
+            # Score against every stored template at once (same result as calculate_similarity per row),
+            # together with the other probes that arrive at the same moment
+            best_match, best_similarity, best_offset = detect_batcher.submit(fingerprint_template)
+            detect_cache.put(cache_key, generation, (best_match, best_similarity, best_offset))
 
-            # Update the best match if the current one is better
-            if similarity > best_similarity:
-                best_match = username
-                best_similarity = similarity
+        # Debugging output
+        print(f"Best similarity: {best_match} {best_similarity:.2f}%"
+              f"{f' (offset {best_offset:+d})' if best_offset else ''}{' (cached)' if cached is not None else ''}")
 
-        if best_match and best_similarity > 80:  # Set a threshold for a valid match
+        if best_match and best_similarity > match_threshold.value:  # Threshold for a valid match
             return jsonify({'status': 'success', 'message': f'Match found for {best_match} (Similarity: {best_similarity:.2f}%)'}), 200
 
         return jsonify({'status': 'fail', 'message': 'No match found'}), 404
@@ -161,12 +247,63 @@ def detect_fingerprint():
         return jsonify({'status': 'fail', 'message': str(e)}), 500
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Byte-by-byte fingerprint matcher.")
+    parser.add_argument('--mode', choices=SERVER_MODES, default=os.environ.get('MATCHER_MODE'),
+                        help="Server mode (env MATCHER_MODE); asked on the console if not given.")
+    parser.add_argument('--threshold', type=float, default=os.environ.get('MATCHER_THRESHOLD', DEFAULT_THRESHOLD),
+                        help="Minimum similarity in percent for a match (env MATCHER_THRESHOLD).")
+    parser.add_argument('--admin-token', default=os.environ.get('MATCHER_ADMIN_TOKEN'),
+                        help="Token for /admin requests from other hosts (env MATCHER_ADMIN_TOKEN).")
+    parser.add_argument('--near-duplicate', type=float, default=os.environ.get('MATCHER_NEAR_DUPLICATE', NEAR_DUPLICATE_THRESHOLD),
+                        help="Flag enrollments at least this similar (%%) to a stored template, 0 to disable (env MATCHER_NEAR_DUPLICATE).")
+    parser.add_argument('--search', choices=DETECT_SEARCH_MODES, default=os.environ.get('MATCHER_SEARCH', DETECT_SEARCH),
+                        help="Score every template or only LSH candidates (env MATCHER_SEARCH).")
+    parser.add_argument('--max-offset', type=int, default=os.environ.get('MATCHER_MAX_OFFSET', DETECT_MAX_OFFSET),
+                        help="Also try the probe shifted by up to this many bytes, 0 to disable (env MATCHER_MAX_OFFSET).")
+    parser.add_argument('--batch-window-ms', type=float, default=os.environ.get('MATCHER_BATCH_WINDOW_MS', DETECT_BATCH_WINDOW_MS),
+                        help="Milliseconds a /detect waits for other probes to score with, 0 to disable batching (env MATCHER_BATCH_WINDOW_MS).")
+    parser.add_argument('--batch-size', type=int, default=os.environ.get('MATCHER_BATCH_SIZE', DETECT_BATCH_SIZE),
+                        help="Most /detect probes scored in one gallery pass (env MATCHER_BATCH_SIZE).")
+    parser.add_argument('--cache-size', type=int, default=os.environ.get('MATCHER_CACHE_SIZE', fingerprint_cache.CACHE_SIZE),
+                        help="Detect results kept for device retries, 0 to disable (env MATCHER_CACHE_SIZE).")
+    parser.add_argument('--cache-ttl', type=float, default=os.environ.get('MATCHER_CACHE_TTL', fingerprint_cache.CACHE_TTL),
+                        help="Seconds a cached detect result is valid (env MATCHER_CACHE_TTL).")
+    fps_serving.add_arguments(parser, port=5000, env_prefix='MATCHER')
+    args = parser.parse_args()
+    if args.mode not in (None,) + SERVER_MODES:
+        parser.error(f"MATCHER_MODE must be one of {', '.join(SERVER_MODES)}")
+    if args.search not in DETECT_SEARCH_MODES:
+        parser.error(f"MATCHER_SEARCH must be one of {', '.join(DETECT_SEARCH_MODES)}")
+    if args.batch_window_ms < 0 or args.batch_size < 1:
+        parser.error("--batch-window-ms must not be negative and --batch-size must be at least 1")
+    if args.max_offset < 0:
+        parser.error("--max-offset must not be negative")
+    if not 0 <= args.threshold <= 100:
+        parser.error("--threshold must be from 0 to 100")
+    match_threshold.value = args.threshold
+    ADMIN_TOKEN = args.admin_token
+    detect_cache.size = args.cache_size
+    NEAR_DUPLICATE_THRESHOLD = args.near_duplicate
+    DETECT_SEARCH = args.search
+    DETECT_MAX_OFFSET = args.max_offset
+    detect_batcher.window = args.batch_window_ms / 1000
+    detect_batcher.batch_size = args.batch_size
+    detect_cache.ttl = args.cache_ttl
+
     init_db()
-    while True:
-        SERVER_MODE = input("Select server mode (enroll/detect): ").strip().lower()
-        if SERVER_MODE in ['enroll', 'detect']:
-            break
-        print("Invalid input. Please enter 'enroll' or 'detect'.")
-
-    print(f"Server started in {SERVER_MODE} mode.")
-    app.run(host='0.0.0.0', port=5000)
+    # Loaded before the server starts, so gunicorn workers share the mapped gallery (and its LSH index)
+    startup_gallery = current_gallery()
+    if DETECT_SEARCH == 'lsh' and len(startup_gallery):
+        started = time.perf_counter()
+        fingerprint_lsh.gallery_index(startup_gallery)
+        print(f"LSH index built ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    mode = args.mode
+    while mode is None:
+        mode = input("Select server mode (enroll/detect): ").strip().lower()
+        if mode not in SERVER_MODES:
+            print("Invalid input. Please enter 'enroll' or 'detect'.")
+            mode = None
+    set_server_mode(mode)
+
+    print(f"Server started in {mode} mode, threshold {args.threshold:g}% ({fps_serving.describe(args)}).")
+    fps_serving.serve(app, args)
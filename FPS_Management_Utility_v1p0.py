@@ -1,12 +1,15 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
-import socket
 import threading
 import asyncio
 import time
 import re
 import os
 
+from fps_device_view import ListboxDeviceView
+from fps_discovery import DiscoveryService
+from fps_protocol import LINE_ERROR, LINE_SUCCESS, ResponseStream
+
 # Configuration
 BROADCAST_PORT = 5001
 TCP_PORT = 5000
@@ -14,6 +17,8 @@ TEMPLATES_FOLDER = "templates" # Define the templates folder name
 
 # Global variables for async operations and device management
 device_list = {}
+device_view = None  # Applies device_list changes to device_listbox once per frame
+discovery_service = None
 current_client = None
 loop = asyncio.new_event_loop()
 app_running = True
@@ -45,21 +50,13 @@ def send_command_to_device(command, data=None):
 
             # NOTE: For most commands (SEARCH, DELETE, EMPTY), the ESP32 sends a single line
             # starting with SUCCESS or ERROR, or an initial OK/INFO line followed by SUCCESS/ERROR.
-            # We will read until we see a SUCCESS or ERROR to terminate, or until the connection closes.
-            
-            while True:
-                line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
-                    loop=loop
-                ).result(timeout=5)
-
-                if not line:
-                    break
-                response = line.decode('utf-8').strip()
-                result_text.set(response)
-
-                if response.startswith("SUCCESS") or response.startswith("ERROR"):
-                    break
+            # The response ends at the command's terminator (fps_protocol.RESPONSE_RULES) or when the connection closes.
+            lines = asyncio.run_coroutine_threadsafe(
+                ResponseStream(reader).read_response(command),
+                loop=loop
+            ).result()
+            if lines:
+                result_text.set(lines[-1].text)
 
             writer.close()
             asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
@@ -94,18 +91,18 @@ def cmd_enroll_and_upload():
             asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
 
             # Read and display responses until success or error
+            stream = ResponseStream(reader)
             while True:
                 line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
+                    stream.read_line(timeout=60), # Increased timeout for user interaction
                     loop=loop
-                ).result(timeout=60) # Increased timeout for user interaction
+                ).result()
 
-                if not line:
+                if line is None:
                     break
-                response = line.decode('utf-8').strip()
-                result_text.set(response)
+                result_text.set(line.text)
 
-                if response.startswith("SUCCESS"):
+                if line.kind == LINE_SUCCESS:
                     print(f"Enrollment successful. Initiating template upload for ModelID {model_id}...")
                     writer.close()
                     asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
@@ -113,7 +110,7 @@ def cmd_enroll_and_upload():
                     time.sleep(1) 
                     cmd_upload_template(model_id) 
                     return
-                elif response.startswith("ERROR"):
+                elif line.kind == LINE_ERROR:
                     writer.close()
                     asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
                     return
@@ -150,23 +147,12 @@ def cmd_listtemplates():
             writer.write(full_command.encode('utf-8'))
             asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
             
-            all_responses = []
-            
-            # The ESP32 sends a multi-line response for LIST, terminating with a final OK message.
-            while True:
-                line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
-                    loop=loop
-                ).result(timeout=5)
-
-                if not line:
-                    break
-                response = line.decode('utf-8').strip()
-                all_responses.append(response)
-
-                # Wait for the final confirmation message from the ESP32
-                if response.startswith("OK: List templates command complete."):
-                    break
+            # The ESP32 sends a multi-line response for LIST, terminating with a final OK message (or an ERROR).
+            lines = asyncio.run_coroutine_threadsafe(
+                ResponseStream(reader).read_response("LIST"),
+                loop=loop
+            ).result()
+            all_responses = [line.text for line in lines]
             
             # Display the collected responses
             if all_responses:
@@ -443,40 +429,42 @@ def cmd_sync_device():
     threading.Thread(target=sync_templates).start()
 
 
-def discover_devices():
-    global app_running
-    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    listener.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    listener.settimeout(1)
-    listener.bind(('', BROADCAST_PORT))
+def on_device_discovered(device_ip, device_mac, _battery, _transport):
+    """Called by the discovery service on the asyncio loop for each broadcast."""
+    if device_list.get(device_ip) != device_mac:
+        device_list[device_ip] = device_mac
+        device_view.upsert(device_ip, (device_ip, device_mac))
+
+
+def on_device_moved(_mac, old_ip, _new_ip):
+    """A device got a new IP; drop the row of the old one."""
+    if device_list.pop(old_ip, None) is not None:
+        device_view.remove(old_ip)
 
-    while app_running:
-        try:
-            data, addr = listener.recvfrom(1024)
-            message = data.decode('utf-8').strip().split(',')
-            if len(message) == 2:
-                device_ip = message[0]
-                device_mac = message[1]
-                if device_ip not in device_list:
-                    device_list[device_ip] = device_mac
-                    root.after(0, update_device_list)
-        except socket.timeout:
-            continue
-        except Exception as e:
-            print(f"UDP Error: {e}")
 
+def log_discovery(message, _color=None):
+    print(message)
 
-def update_device_list():
-    device_listbox.delete(0, tk.END)
-    for ip, mac in device_list.items():
-        device_listbox.insert(tk.END, f"Fingerprint Sensor (IP: {ip}, MAC: {mac})")
+
+async def start_discovery():
+    """Listens for the devices' UDP broadcasts on BROADCAST_PORT on the shared loop."""
+    global discovery_service
+    try:
+        discovery_service = DiscoveryService(on_device_discovered, log_discovery, on_moved=on_device_moved,
+                                             tcp=False, broadcast_port=BROADCAST_PORT)
+        await discovery_service.start()
+    except Exception as e:
+        print(f"UDP Error: {e}")
+
+
+def format_device_row(ip, mac):
+    return f"Fingerprint Sensor (IP: {ip}, MAC: {mac})"
 
 
 def select_device(event):
     global current_client
-    selection = device_listbox.curselection()
-    if selection:
-        selected_ip = list(device_list.keys())[selection[0]]
+    selected_ip = device_view.selected_ip()
+    if selected_ip:
         current_client = selected_ip
         result_text.set(f"Selected device: {current_client}")
     else:
@@ -502,6 +490,8 @@ discovery_panel.pack(fill="x", pady=10)
 device_listbox = tk.Listbox(discovery_panel, width=35, height=10)
 device_listbox.pack(fill="x", expand=True)
 device_listbox.bind('<<ListboxSelect>>', select_device)
+device_view = ListboxDeviceView(device_listbox, format_device_row)
+device_view.start()
 
 # Control Panel
 control_panel_frame = tk.LabelFrame(left_frame, text="Control Panel", padx=10, pady=10)
@@ -564,11 +554,6 @@ result_label = tk.Label(main_commands_frame, textvariable=result_text, fg="blue"
 result_label.pack(pady=10)
 result_text.set("Ready. Looking for devices...")
 
-# Start UDP discovery
-discovery_thread = threading.Thread(target=discover_devices, daemon=True)
-discovery_thread.start()
-
-
 # Start asyncio event loop
 def start_loop():
     global loop
@@ -579,6 +564,9 @@ def start_loop():
 asyncio_thread = threading.Thread(target=start_loop, daemon=True)
 asyncio_thread.start()
 
+# Start UDP discovery on the shared loop
+asyncio.run_coroutine_threadsafe(start_discovery(), loop)
+
 
 def on_closing():
     global app_running
@@ -1,21 +1,40 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
-import socket
 import threading
 import asyncio
 import time
-import re
 import os
+import queue
+import logging
+import logging.handlers
+from collections import deque
 from datetime import datetime
 
+from fps_discovery import BROADCAST_PORT, STATUS_REPORT_PORT, DiscoveryService
+from fps_fleet import DEVICE_CACHE_FILE, ContinuousReaders, DeviceRegistry, probe_devices
+from fps_device_client import ENROLL_TIMEOUT, CommandError, send_command
+from fps_device_view import TreeviewDeviceView
+from fps_metrics import METRICS_FILE, command_metrics
+from fps_templates import (TEMPLATES_FOLDER, TEMPLATE_SIZE, TEMPLATE_NAME_RE, TEMPLATE_ACK_TIMEOUT,
+                           TEMPLATE_TRANSFER_TIMEOUT, TemplateError, folder_template_ids, pull_template, push_folder,
+                           push_template)
+from fps_template_watcher import TemplateWatcher
+from fps_template_archive import (ARCHIVE_EXTENSION, ArchiveError, backup_device, fetch_template_list,
+                                  parse_template_ids, restore_device)
+
 # Configuration
-STATUS_REPORT_PORT = 5002  # NEW: PC acts as a server on this port for device status reports
-TCP_PORT = 5000            # Device is a server on this port for commands/logs
-TEMPLATES_FOLDER = "templates"  # Define the templates folder name
+LOG_FLUSH_INTERVAL_MS = 50      # Default Mode Logs refresh period (20 frames per second)
+LOG_MAX_LINES = 2000            # Lines kept in the Default Mode Logs widget (oldest are dropped)
+LOG_FILE = "fps_continuous.log"  # Full continuous log stream, rotated by size
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+REGISTRY_SWEEP_INTERVAL_MS = 5000  # How often silent devices are checked for staleness/eviction
+REGISTRY_SAVE_INTERVAL_MS = 60000  # How often the device registry cache is written to disk
+METRICS_DUMP_INTERVAL_MS = 60000   # How often the per-device command metrics are written to METRICS_FILE
 
 # Global variables for async operations and device management
-# device_list structure: {ip: {'mac': mac, 'battery': percentage, 'tree_id': tree_id}}
-device_list = {}
+# device_registry entries: {ip: {'mac', 'battery', 'last_seen', 'state'}}; Treeview rows use the IP as item id
+device_registry = DeviceRegistry()
 current_client = None  # IP of the device currently in MANAGE mode (set ONLY by cmd_manage)
 selected_device_ip = None  # IP of the device currently highlighted in the list (set by select_device)
 loop = asyncio.new_event_loop()
@@ -25,9 +44,17 @@ upload_file_path = None
 
 # <<< GUI & LOG SETUP >>>
 continuous_log_text = None
-continuous_listener_thread = None
+pending_log_lines = deque(maxlen=LOG_MAX_LINES)  # Lines waiting for the next GUI flush
+continuous_file_log = logging.getLogger("fps.continuous")
+continuous_file_log_listener = None
+continuous_readers = None
+discovery_service = None
+template_watcher = None
+autosync_enabled = False  # Push changed templates to the device in Manage Mode (set by the Auto-sync checkbox)
+autosync_var = None
 # Widgets defined later in GUI setup
 device_listbox = None
+device_view = None  # View-model that applies device row changes to device_listbox once per frame
 manage_button = None
 mac_address_label = None
 result_text = None
@@ -37,277 +64,313 @@ enroll_id_entry = None
 delete_id_entry = None
 upload_id_entry = None
 download_file_label = None
+discovery_stats_label = None
 root = None
 
 
 def gui_log_continuous_message(message, color="black"):
-    """Safely updates the continuous log area from a background thread."""
-    global continuous_log_text, root
-
-    def update_log():
-        if continuous_log_text:
-            try:
-                # Add timestamp for clarity in continuous log
-                full_message = f"{datetime.now().strftime('[%H:%M:%S]')} {message}"
-                continuous_log_text.config(state=tk.NORMAL)
-                continuous_log_text.insert(tk.END, full_message + "\n", color)
-                continuous_log_text.see(tk.END)
-                continuous_log_text.config(state=tk.DISABLED)
-            except Exception:
-                pass # Ignore if widget is destroyed
-
-    if root:
-        root.after(0, update_log)
+    """Queues a message for the continuous log area. Safe to call from any thread."""
+    global pending_log_lines, continuous_file_log
+
+    # Add timestamp for clarity in continuous log
+    full_message = f"{datetime.now().strftime('[%H:%M:%S]')} {message}"
+    pending_log_lines.append((full_message, color))
+    # The full stream goes to the rotating log file (written by a background listener thread)
+    continuous_file_log.info(message)
+
+
+def flush_continuous_log():
+    """Runs on the Tk thread once per frame and inserts all pending log lines in one batch."""
+    global continuous_log_text, pending_log_lines, root
+
+    batch = []
+    while pending_log_lines:
+        batch.append(pending_log_lines.popleft())
+
+    if batch and continuous_log_text:
+        try:
+            # One insert call with alternating (text, tag) pairs for the whole batch
+            chunks = []
+            for full_message, color in batch:
+                chunks.extend((full_message + "\n", color))
+
+            continuous_log_text.config(state=tk.NORMAL)
+            continuous_log_text.insert(tk.END, *chunks)
+
+            # Keep the widget a ring of LOG_MAX_LINES by dropping the oldest lines
+            line_count = int(continuous_log_text.index('end-1c').split('.')[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                continuous_log_text.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
+
+            continuous_log_text.see(tk.END)
+            continuous_log_text.config(state=tk.DISABLED)
+        except tk.TclError:
+            pass  # Ignore if widget is destroyed
+
+    if app_running and root:
+        root.after(LOG_FLUSH_INTERVAL_MS, flush_continuous_log)
+
+
+def start_continuous_file_log():
+    """Attaches a rotating file to the continuous log stream. Returns the QueueListener to stop on exit."""
+    global continuous_file_log
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    continuous_file_log.addHandler(logging.handlers.QueueHandler(log_queue))
+    continuous_file_log.setLevel(logging.INFO)
+    continuous_file_log.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    return listener
 
 # =================================================================================
-# NEW: TCP STATUS LISTENER (REPLACES UDP DISCOVERY)
+# DEVICE DISCOVERY (TCP STATUS REPORTS + UDP BROADCASTS)
 # =================================================================================
 
-def update_device_list_and_gui(ip, mac, battery):
-    """Updates the global device list and the Tkinter Treeview."""
-    global device_list, device_listbox
-    
-    mac = mac.strip().upper()
-    try:
-        battery = int(battery.strip())
-    except ValueError:
-        battery = 0
+def device_row(ip, info):
+    """Treeview values for one registry entry."""
+    battery = f"{info['battery']}%" if info['battery'] is not None else "-"
+    return (ip, info['mac'], battery, info['state'].capitalize())
+
 
-    if device_listbox: # Ensure device_listbox widget exists
-        if ip not in device_list:
+def update_device_list_and_gui(ip, mac, battery, transport='tcp'):
+    """
+    Records a discovery report in the device registry and queues the row change for the
+    Treeview. Called by the discovery service on the asyncio loop; the view applies changes
+    once per frame. battery is None for UDP broadcasts (the last known level is kept).
+    """
+    global device_registry, device_view
+
+    if device_view: # Ensure the device list view exists
+        change = device_registry.report(ip, mac, battery)
+        if change is None:
+            return  # Nothing visible changed; skip the GUI update
+
+        info = device_registry.get(ip)
+        battery = info['battery'] if info['battery'] is not None else "?"
+        # Queue the row (this also clears any stale/unverified marking)
+        device_view.upsert(ip, device_row(ip, info))
+        if change == 'new':
             # New device discovered
-            tree_id = device_listbox.insert('', 'end', ip, text=f"Fingerprint Sensor", 
-                                            values=(ip, mac, f"{battery}%"))
-            device_list[ip] = {'mac': mac, 'battery': battery, 'tree_id': tree_id}
-            gui_log_continuous_message(f"DEVICE DISCOVERED (TCP): {ip} ({mac}). Battery: {battery}%", 'green')
+            gui_log_continuous_message(f"DEVICE DISCOVERED ({transport.upper()}): {ip} ({mac}). Battery: {battery}%", 'green')
+            refresh_continuous_readers()
         else:
-            # Existing device, update status
-            tree_id = device_list[ip]['tree_id']
-            # Only update if the battery has changed to minimize GUI updates
-            if device_list[ip]['battery'] != battery:
-                device_listbox.item(tree_id, values=(ip, mac, f"{battery}%"))
-                device_list[ip]['battery'] = battery
+            if change == 'verified':
+                gui_log_continuous_message(f"DEVICE CONFIRMED: {ip} ({mac}). Battery: {battery}%", 'green')
+            elif change == 'revived':
+                gui_log_continuous_message(f"DEVICE BACK ONLINE: {ip} - Battery: {battery}%", 'green')
+            else:
                 gui_log_continuous_message(f"STATUS UPDATE: {ip} - Battery: {battery}%", 'blue')
 
 
-def tcp_status_listener():
+def load_cached_devices():
+    """Shows the devices saved by the previous session as unverified and probes them in the background."""
+    global device_registry, device_view, loop
+
+    cached_ips = device_registry.load(DEVICE_CACHE_FILE)
+    for ip in cached_ips:
+        device_view.upsert(ip, device_row(ip, device_registry.get(ip)), tags=('unverified',))
+
+    if cached_ips:
+        gui_log_continuous_message(f"Loaded {len(cached_ips)} cached devices from {DEVICE_CACHE_FILE}. Verifying...", 'purple')
+        refresh_continuous_readers()
+        future = asyncio.run_coroutine_threadsafe(probe_devices(cached_ips), loop)
+        future.add_done_callback(lambda f: root.after(0, apply_probe_results, f))
+
+
+def apply_probe_results(future):
+    """Runs on the Tk thread with the result of the startup probe of cached devices."""
+    global device_registry, device_view
+
+    try:
+        results = future.result()
+    except Exception as e:
+        gui_log_continuous_message(f"Cached device probe failed: {e}", 'red')
+        return
+
+    unreachable = 0
+    for ip, reachable in results.items():
+        if not reachable:
+            unreachable += 1
+        elif device_registry.confirm(ip):
+            device_view.upsert(ip, device_row(ip, device_registry.get(ip)))
+            gui_log_continuous_message(f"DEVICE CONFIRMED: {ip} (answered probe).", 'green')
+
+    if unreachable:
+        gui_log_continuous_message(f"{unreachable} cached devices not reachable yet (kept as unverified).", 'gray')
+
+
+def save_device_registry():
+    """Periodically saves the registry so the next launch can show devices immediately."""
+    global device_registry
+    try:
+        device_registry.save(DEVICE_CACHE_FILE)
+    except OSError as e:
+        gui_log_continuous_message(f"Could not save {DEVICE_CACHE_FILE}: {e}", 'red')
+
+    if app_running:
+        root.after(REGISTRY_SAVE_INTERVAL_MS, save_device_registry)
+
+
+def dump_command_metrics():
+    """Periodically writes the per-device command latency histograms to METRICS_FILE."""
+    try:
+        command_metrics.dump(METRICS_FILE)
+    except OSError as e:
+        gui_log_continuous_message(f"Could not write {METRICS_FILE}: {e}", 'red')
+
+    slowest = command_metrics.slowest(3)
+    if slowest:
+        gui_log_continuous_message(
+            "Slowest commands (p90): " + ", ".join(f"{ip} {command} {p90:.0f} ms" for ip, command, p90 in slowest),
+            'gray')
+
+    if app_running:
+        root.after(METRICS_DUMP_INTERVAL_MS, dump_command_metrics)
+
+
+def sweep_device_registry():
+    """Runs on the Tk thread: marks silent devices as stale and removes the ones past their TTL."""
+    global device_registry, device_view, current_client
+
+    newly_stale, evicted = device_registry.sweep(keep={current_client})
+
+    for ip in newly_stale:
+        info = device_registry.get(ip)
+        if info:
+            device_view.upsert(ip, device_row(ip, info), tags=('stale',))
+            gui_log_continuous_message(f"DEVICE STALE: {ip} - no status report for {int(device_registry.stale_after)}s.", 'gray')
+
+    for ip in evicted:
+        device_view.remove(ip)
+        gui_log_continuous_message(f"DEVICE REMOVED: {ip} - no status report for {int(device_registry.evict_after)}s.", 'orange')
+
+    if evicted:
+        refresh_continuous_readers()
+
+    update_discovery_stats()
+
+    if app_running:
+        root.after(REGISTRY_SWEEP_INTERVAL_MS, sweep_device_registry)
+
+
+def on_device_moved(mac, old_ip, new_ip):
+    """Called on the asyncio loop when a MAC reports from a new IP (DHCP renewal); drops the old row."""
+    global device_registry, device_view
+
+    device_registry.remove(old_ip)
+    if device_view:
+        device_view.remove(old_ip)
+    gui_log_continuous_message(f"DEVICE MOVED: {mac} {old_ip} -> {new_ip}", 'purple')
+    refresh_continuous_readers()
+
+
+def update_discovery_stats():
+    """Shows the discovery rate, queue wait and dropped reports under the device list. Runs on the Tk thread."""
+    global discovery_service, discovery_stats_label
+    if not (discovery_service and discovery_stats_label):
+        return
+    stats = discovery_service.stats()
+    text = (f"Reports: {stats['rate']:.1f}/s (TCP {stats['tcp']}, UDP {stats['udp']}) | "
+            f"Queue wait: avg {stats['queue_wait_avg_ms']:.1f} ms, max {stats['queue_wait_max_ms']:.1f} ms")
+    if stats['dropped']:
+        text += f" | Dropped: {stats['dropped']}"
+    discovery_stats_label.config(text=text, fg="red" if stats['dropped'] else "gray")
+
+
+async def start_discovery():
     """
-    Runs in a dedicated thread as a TCP server to listen for status reports 
-    (discovery simulation) from devices on STATUS_REPORT_PORT (5002).
+    Starts the discovery service on the shared loop: TCP status reports on STATUS_REPORT_PORT (5002)
+    and UDP broadcasts on BROADCAST_PORT (5001), so v1.0 and TCP firmware can share one fleet.
     """
-    global app_running
+    global discovery_service
     try:
-        listener_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        listener_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # Use '0.0.0.0' to listen on all interfaces
-        listener_socket.bind(('0.0.0.0', STATUS_REPORT_PORT)) 
-        listener_socket.listen(5)
-        gui_log_continuous_message(f"Status Listener (TCP) started on port {STATUS_REPORT_PORT}", 'purple')
-
-        while app_running:
-            try:
-                listener_socket.settimeout(0.5) # Non-blocking check
-                conn, addr = listener_socket.accept()
-                
-                # Receive data until EOF or newline (robust read)
-                data_parts = []
-                while True:
-                    chunk = conn.recv(1024)
-                    if not chunk:
-                        break
-                    data_parts.append(chunk)
-                    if chunk.endswith(b'\n'):
-                        break
-                
-                data = b''.join(data_parts).decode('utf-8', errors='ignore').strip()
-
-                # Check 1: Handle Status Reports (STATUS|IP|MAC|Battery)
-                if data.startswith("STATUS|"):
-                    parts = data.split('|')
-                    # Check for the 4 expected parts: STATUS, IP, MAC, Battery
-                    if len(parts) == 4:
-                        _type, ip, mac, battery = parts
-                        update_device_list_and_gui(ip, mac, battery) 
-                
-                # Check 2: Handle Continuous Search Results (CONTINUOUS_SUCCESS:ID or CONTINUOUS_ERROR:...)
-                elif data.startswith("CONTINUOUS_"):
-                    # Log the continuous result to the GUI log
-                    source_ip = addr[0]
-                    gui_log_continuous_message(f"[{source_ip}] {data}", 'blue')
-                    # Provide the acknowledgement (ACK) to unblock the device
-                    ack_message = "ACK:\n"
-                    # NOTE: Assuming 'client' is the active socket object to send data back
-                    conn.sendall(ack_message.encode('utf-8'))
-
-
-                elif data == "TIME_REQUEST":
-                    # Get the current Unix timestamp (seconds since epoch)
-                    current_unix_time = int(time.time())
-                    response = f"TIME_RESPONSE:{current_unix_time}\n"
-
-                    print(f"[TIME SYNC] Responding with: {response.strip()}")
-                    conn.sendall(response.encode('utf-8'))
-                
-
-                # Optional: Log any unexpected messages for debugging
-                elif data:
-                    gui_log_continuous_message(f"Received unexpected TCP message: {data}", 'orange')
-                # --- END CRITICAL FIX ---
-                
-                # ✅ FIX: Move connection close to the end of the request handling
-                conn.close()
-                        
-            except socket.timeout:
-                continue
-            except Exception as e:
-                # Handle connection-specific or processing errors
-                gui_log_continuous_message(f"Status Listener Connection Error: {e}", 'red')
-                
+        discovery_service = DiscoveryService(update_device_list_and_gui, gui_log_continuous_message,
+                                             on_moved=on_device_moved)
+        await discovery_service.start()
     except Exception as e:
         # Handle server-startup errors
-        gui_log_continuous_message(f"FATAL: Failed to start Status Listener: {e}", 'red')
-    finally:
-        try:
-            listener_socket.close()
-        except:
-            pass
-            
-
-# <<< END NEW TCP STATUS LISTENER >>>
-# *** Note: The old discover_devices() (UDP) function is now REMOVED ***
-
-# <<< CONTINUOUS LISTENER SETUP (Unchanged, relies on existing TCP_PORT 5000) >>>
-
-def continuous_listener():
-    """A single thread to listen for continuous updates from all unmanaged devices."""
-    global app_running, device_list, current_client, loop
-
-    local_loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(local_loop)
-
-    connections = {}  # {ip: (reader, writer)}
-
-    async def manage_connections():
-        nonlocal connections
-
-        while app_running:
-            # 1. Check for new devices and close connections for selected device
-            current_ips = set(device_list.keys())
-
-            # Identify devices that need a connection
-            for ip in current_ips:
-                # If device is not selected AND we don't have a connection
-                if ip != current_client and ip not in connections:
-                    try:
-                        reader, writer = await asyncio.wait_for(
-                            asyncio.open_connection(ip, TCP_PORT), timeout=1
-                        )
-                        connections[ip] = (reader, writer)
-                        gui_log_continuous_message(f"[{ip}] Connected for Default Mode logs.", "green")
-                    except Exception:
-                        continue  # Failed to connect, try again later
-
-            # 2. Check for connections that need to be closed (device now selected for Manage Mode)
-            closed_ips = []
-            for ip in list(connections.keys()):
-                if ip == current_client:
-                    closed_ips.append(ip)
-                    gui_log_continuous_message(f"[{ip}] Disconnected (Selected for Manage Mode).", "gray")
-
-            # 3. Read messages from existing, unmanaged connections
-            for ip, (reader, writer) in connections.items():
-                if ip == current_client:
-                    continue  # Skip if it was just selected
-
-                try:
-                    line = await asyncio.wait_for(reader.readline(),
-                                                  timeout=0.1)
-
-                    if line:
-                        response = line.decode('utf-8').strip()
-                        if response.startswith("CONTINUOUS"):
-                            # NOTE: This block is for continuous results sent on PORT 5000 
-                            # (the command port), typically by older code versions.
-                            # Devices are now sending these results on PORT 5002,
-                            # which is handled by tcp_status_listener().
-                            gui_log_continuous_message(f"[{ip}] (Legacy 5000 Log) {response}", "blue")
-                    elif line == b'':
-                        # Connection closed by server
-                        closed_ips.append(ip)
-                        gui_log_continuous_message(f"[{ip}] Disconnected (Server closed). Retrying...", "orange")
-
-                except asyncio.TimeoutError:
-                    continue
-                except ConnectionResetError:
-                    closed_ips.append(ip)
-                    gui_log_continuous_message(f"[{ip}] Connection Reset. Retrying...", "red")
-                except Exception:
-                    closed_ips.append(ip)
-
-            # 4. Clean up closed connections
-            for ip in closed_ips:
-                if ip in connections:
-                    reader, writer = connections.pop(ip)
-                    if not writer.is_closing():
-                        writer.close()
-
-            await asyncio.sleep(0.5)
-
-    local_loop.run_until_complete(manage_connections())
+        gui_log_continuous_message(f"FATAL: Failed to start Discovery: {e}", 'red')
+
+
+# <<< END DEVICE DISCOVERY >>>
+
+# <<< CONTINUOUS LISTENER SETUP (relies on existing TCP_PORT 5000) >>>
+
+def refresh_continuous_readers():
+    """Reconciles the per-device log reader tasks with the device registry and the device in Manage Mode."""
+    global continuous_readers, device_registry, current_client
+    if continuous_readers:
+        continuous_readers.sync_threadsafe(device_registry.keys(), current_client)
 
 
 # <<< END CONTINUOUS LISTENER SETUP >>>
 
-def send_command_to_device(command, data=None):
-    """Sends a command to the currently selected device and handles response."""
-    global current_client, result_text, loop
+# <<< TEMPLATE AUTO-SYNC >>>
 
-    if not current_client:
-        result_text.set("ERROR: No device selected and in Manage Mode.")
-        return
+def toggle_autosync():
+    global autosync_enabled, autosync_var
+    autosync_enabled = bool(autosync_var.get())
+    state = "ON" if autosync_enabled else "OFF"
+    gui_log_continuous_message(f"Template auto-sync {state} for the device in Manage Mode.", 'purple')
 
-    def communicate():
-        try:
-            reader, writer = asyncio.run_coroutine_threadsafe(
-                asyncio.open_connection(current_client, TCP_PORT),
-                loop=loop
-            ).result(timeout=5)
 
-            if data is not None:
-                full_command = f"{command},{data}\n"
-            else:
-                full_command = f"{command}\n"
+def on_templates_changed(changed, removed):
+    """Watcher batch (on the asyncio loop): pushes only the changed IDs to the device in Manage Mode."""
+    global current_client, manage_mode_active, autosync_enabled, loop
+
+    ip = current_client
+    if not (autosync_enabled and manage_mode_active and ip and changed):
+        return
 
-            writer.write(full_command.encode('utf-8'))
-            asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
+    gui_log_continuous_message(f"Auto-sync: sending templates {changed} to {ip}...", 'purple')
+
+    def report(task):
+        try:
+            sent, errors = task.result()
+        except Exception as e:
+            gui_log_continuous_message(f"Auto-sync to {ip} failed: {e}", 'red')
+            return
+        message = f"Auto-sync: {sent} templates sent to {ip}."
+        if errors:
+            message += " Failed IDs: " + ", ".join(f"{i} ({e})" for i, e in sorted(errors.items()))
+        gui_log_continuous_message(message, 'orange' if errors else 'green')
 
-            all_responses = []
+    loop.create_task(push_folder(ip, TEMPLATES_FOLDER, changed)).add_done_callback(report)
 
-            while True:
-                line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
-                    loop=loop
-                ).result(timeout=5)
 
-                if not line:
-                    break
+async def start_template_watcher():
+    global template_watcher
+    template_watcher = TemplateWatcher(on_templates_changed, gui_log_continuous_message)
+    await template_watcher.start()
 
-                response = line.decode('utf-8').strip()
-                all_responses.append(response)
+# <<< END TEMPLATE AUTO-SYNC >>>
 
-                # Check for termination keywords
-                if response.startswith("SUCCESS") or response.startswith("ERROR"):
-                    break
+def send_command_to_device(command, data=None):
+    """Sends a command to the currently selected device and handles response."""
+    global current_client, result_text, loop
 
-            final_output = "\n".join(all_responses)
-            if final_output:
-                result_text.set(final_output)
-            else:
-                result_text.set(f"Command '{command}' sent. No response received.")
+    if not current_client:
+        result_text.set("ERROR: No device selected and in Manage Mode.")
+        return
 
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
+    def communicate():
+        try:
+            # The whole exchange runs as one metered session on the loop
+            all_responses = asyncio.run_coroutine_threadsafe(
+                send_command(current_client, command, data),
+                loop=loop
+            ).result()
+            result_text.set("\n".join(all_responses))
 
+        except CommandError as e:
+            result_text.set("\n".join(e.responses) or str(e))
         except ConnectionRefusedError:
             result_text.set("ERROR: Connection refused. Device may be offline or unreachable.")
         except asyncio.TimeoutError:
@@ -330,47 +393,19 @@ def cmd_enroll_and_upload():
             model_id = int(enroll_id_entry.get())
             result_text.set(f"Attempting ENROLL for ModelID {model_id}...")
 
-            reader, writer = asyncio.run_coroutine_threadsafe(
-                asyncio.open_connection(current_client, TCP_PORT),
+            all_responses = asyncio.run_coroutine_threadsafe(
+                send_command(current_client, "ENROLL", model_id, timeout=ENROLL_TIMEOUT),
                 loop=loop
-            ).result(timeout=5)
-
-            full_command = f"ENROLL,{model_id}\n"
-            writer.write(full_command.encode('utf-8'))
-            asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
-
-            all_responses = []
-            is_success = False
-
-            while True:
-                line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
-                    loop=loop
-                ).result(timeout=60)
-
-                if not line:
-                    break
-
-                response = line.decode('utf-8').strip()
-                all_responses.append(response)
+            ).result()
+            result_text.set("\n".join(all_responses))
 
-                if response.startswith("SUCCESS"):
-                    is_success = True
-                    break
-                elif response.startswith("ERROR"):
-                    break
-
-            final_output = "\n".join(all_responses)
-            result_text.set(final_output)
-
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
-
-            if is_success:
+            if all_responses[-1].startswith("SUCCESS"):
                 print(f"Enrollment successful. Initiating template upload for ModelID {model_id}...")
                 time.sleep(1)
                 cmd_upload_template(model_id)
 
+        except CommandError as e:
+            result_text.set("\n".join(e.responses) or str(e))
         except asyncio.TimeoutError:
             result_text.set(f"Communication ERROR: Timeout while waiting for enrollment response.")
         except Exception as e:
@@ -392,40 +427,19 @@ def cmd_listtemplates():
 
     def communicate():
         try:
-            reader, writer = asyncio.run_coroutine_threadsafe(
-                asyncio.open_connection(current_client, TCP_PORT),
+            all_responses = asyncio.run_coroutine_threadsafe(
+                fetch_template_list(current_client),
                 loop=loop
-            ).result(timeout=5)
-
-            full_command = f"LIST\n"
-            writer.write(full_command.encode('utf-8'))
-            asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
-
-            all_responses = []
-
-            while True:
-                line = asyncio.run_coroutine_threadsafe(
-                    reader.readline(),
-                    loop=loop
-                ).result(timeout=5)
-
-                if not line:
-                    break
-                response = line.decode('utf-8').strip()
-                all_responses.append(response)
-
-                if response.startswith("OK: List templates command complete.") or response.startswith("ERROR"):
-                    break
+            ).result()
 
             if all_responses:
-                final_output = "\n".join(all_responses)
-                result_text.set(final_output)
+                result_text.set("\n".join(all_responses))
+                device_registry.set_template_count(current_client, len(parse_template_ids(all_responses)))
             else:
                 result_text.set("ERROR: No response received from device.")
 
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
-
+        except TemplateError as e:
+            result_text.set(str(e))
         except asyncio.TimeoutError:
             result_text.set(f"Communication ERROR: Timeout while waiting for list response.")
         except Exception as e:
@@ -456,11 +470,10 @@ def cmd_deletechar():
     global result_text, delete_id_entry
     try:
         model_id = int(delete_id_entry.get())
-        send_command_to_device("DELETE", model_id)
     except ValueError:
         result_text.set("Invalid ModelID. Please enter a number.")
-    except TypeError:
-        result_text.set("ERROR: No device in Manage Mode.")
+        return
+    send_command_to_device("DELETE", model_id)
 
 
 def cmd_upload_template(model_id=None):
@@ -480,49 +493,22 @@ def cmd_upload_template(model_id=None):
 
     def upload():
         try:
-            if not os.path.exists(TEMPLATES_FOLDER):
-                os.makedirs(TEMPLATES_FOLDER)
-
-            filename = os.path.join(TEMPLATES_FOLDER, f"template_{model_id}.mb")
-
             result_text.set(f"Attempting to upload template ID {model_id}...")
 
-            reader, writer = asyncio.run_coroutine_threadsafe(
-                asyncio.open_connection(current_client, TCP_PORT),
+            # The whole transfer (command, ack, readexactly, validation) runs as one coroutine on the loop
+            filename = asyncio.run_coroutine_threadsafe(
+                pull_template(current_client, model_id, TEMPLATES_FOLDER),
                 loop=loop
-            ).result(timeout=5)
-
-            full_command = f"UPLOAD_TEMPLATE,{model_id}\n"
-            writer.write(full_command.encode('utf-8'))
-            asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
-
-            ack = asyncio.run_coroutine_threadsafe(reader.readline(), loop=loop).result(timeout=15)
-            ack_msg = ack.decode('utf-8').strip()
-            result_text.set(ack_msg)
-            if not ack_msg.startswith("OK"):
-                writer.close()
-                asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
-                return
-
-            template_data = b''
-            expected_size = 1668
-            while len(template_data) < expected_size:
-                chunk = asyncio.run_coroutine_threadsafe(reader.read(expected_size - len(template_data)),
-                                                         loop=loop).result(timeout=60)
-                if not chunk:
-                    break
-                template_data += chunk
-
-            with open(filename, 'wb') as f:
-                f.write(template_data)
+            ).result(timeout=TEMPLATE_ACK_TIMEOUT + TEMPLATE_TRANSFER_TIMEOUT + 10)
 
             result_text.set(
-                f"SUCCESS: Template saved to {filename} ({len(template_data)} bytes received)"
+                f"SUCCESS: Template saved to {filename} ({TEMPLATE_SIZE} bytes received)"
             )
 
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
-
+        except TemplateError as e:
+            result_text.set(f"ERROR (ID {model_id}): {e}")
+        except asyncio.TimeoutError:
+            result_text.set(f"Communication ERROR: Timeout during template upload (ID {model_id}).")
         except Exception as e:
             result_text.set(f"Communication ERROR: {e}")
 
@@ -552,59 +538,23 @@ def _download_template_sequence(model_id, file_path):
     try:
         result_text.set(f"Downloading template ID {model_id} from PC to device...")
 
-        reader, writer = asyncio.run_coroutine_threadsafe(
-            asyncio.open_connection(current_client, TCP_PORT),
-            loop=loop
-        ).result(timeout=5)
-
-        full_command = f"DOWNLOAD_TEMPLATE,{model_id}\n"
-        writer.write(full_command.encode('utf-8'))
-        asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
-
-        ack = asyncio.run_coroutine_threadsafe(reader.readline(), loop=loop).result(timeout=15)
-        ack_msg = ack.decode('utf-8').strip()
-        result_text.set(f"Download (ID {model_id}): {ack_msg}")
-
-        if not ack_msg.startswith("OK"):
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
-            return False
-
         with open(file_path, 'rb') as f:
             template_data = f.read()
 
-        if len(template_data) != 1668:
+        if len(template_data) != TEMPLATE_SIZE:
             result_text.set(f"ERROR (ID {model_id}): Invalid file size ({len(template_data)} bytes). Skipping.")
-            writer.close()
-            asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
             return False
 
-        writer.write(template_data)
-        asyncio.run_coroutine_threadsafe(writer.drain(), loop=loop).result(timeout=5)
-
-        all_responses = []
-        while True:
-            final_response = asyncio.run_coroutine_threadsafe(reader.readline(), loop=loop).result(timeout=15)
-            if not final_response:
-                break
-            final_msg = final_response.decode('utf-8').strip()
-            all_responses.append(final_msg)
-
-            if final_msg.startswith("SUCCESS") or final_msg.startswith("ERROR"):
-                break
-
-        final_output = "\n".join(all_responses)
-
-        if final_output.startswith("SUCCESS"):
-            result_text.set(f"SUCCESS (ID {model_id}): Template successfully downloaded to device.")
-            status = True
-        else:
-            result_text.set(f"ERROR (ID {model_id}): {final_output}")
-            status = False
-
-        writer.close()
-        asyncio.run_coroutine_threadsafe(writer.wait_closed(), loop=loop).result(timeout=5)
+        asyncio.run_coroutine_threadsafe(
+            push_template(current_client, model_id, template_data),
+            loop=loop
+        ).result()
+        result_text.set(f"SUCCESS (ID {model_id}): Template successfully downloaded to device.")
+        status = True
 
+    except TemplateError as e:
+        result_text.set(f"ERROR (ID {model_id}): {e}")
+        status = False
     except asyncio.TimeoutError:
         result_text.set(f"Communication ERROR: Timeout during template download (ID {model_id}).")
         status = False
@@ -627,7 +577,7 @@ def cmd_download_template():
         result_text.set("ERROR: No template file selected.")
         return
 
-    match = re.search(r"template_(\d+)\.mb", download_file_path)
+    match = TEMPLATE_NAME_RE.search(download_file_path)
     if not match:
         try:
             model_id = int(upload_id_entry.get())
@@ -644,7 +594,7 @@ def cmd_download_template():
 
 def cmd_sync_device():
     """Initiates device sync by downloading all templates from the local folder."""
-    global current_client, result_text
+    global current_client, result_text, loop
 
     if not current_client:
         result_text.set("ERROR: No device in Manage Mode.")
@@ -657,39 +607,126 @@ def cmd_sync_device():
         result_text.set("Device sync cancelled by user.")
         return
 
+    ip = current_client
+
     def sync_templates():
         if not os.path.exists(TEMPLATES_FOLDER):
             result_text.set(f"ERROR: Templates folder '{TEMPLATES_FOLDER}' not found.")
             return
 
-        template_files = [f for f in os.listdir(TEMPLATES_FOLDER) if f.endswith('.mb')]
+        template_files = folder_template_ids(TEMPLATES_FOLDER)
         if not template_files:
             result_text.set(f"INFO: No template files found in '{TEMPLATES_FOLDER}'. Sync complete.")
             return
 
         result_text.set(f"Starting sync of {len(template_files)} templates...")
 
-        success_count = 0
-        total_count = len(template_files)
+        # One session for the whole folder, with the same validation and acknowledgements as the daemon
+        try:
+            sent, errors = asyncio.run_coroutine_threadsafe(
+                push_folder(ip, TEMPLATES_FOLDER, sorted(template_files)), loop=loop
+            ).result()
+        except (asyncio.TimeoutError, TimeoutError):
+            result_text.set("Communication ERROR: Timeout during device sync.")
+            return
+        except Exception as e:
+            result_text.set(f"Communication ERROR during sync: {e}")
+            return
+
+        message = f"SYNC COMPLETE: {sent} of {len(template_files)} templates successfully downloaded to device."
+        if errors:
+            message += " Failed IDs: " + ", ".join(f"{i} ({e})" for i, e in sorted(errors.items()))
+        result_text.set(message)
+
+    threading.Thread(target=sync_templates).start()
+
 
-        for filename in template_files:
-            file_path = os.path.join(TEMPLATES_FOLDER, filename)
-            match = re.search(r"template_(\d+)\.mb", filename)
+def cmd_backup_device():
+    """Pulls every template from the device over one session into a single indexed archive."""
+    global current_client, result_text, loop
 
-            if not match:
-                result_text.set(f"Skipping file: {filename} (Invalid filename format).")
-                continue
+    if not current_client:
+        result_text.set("ERROR: No device in Manage Mode.")
+        return
 
-            model_id = int(match.group(1))
+    mac = device_registry.get(current_client, {}).get('mac', current_client)
+    archive_path = filedialog.asksaveasfilename(
+        defaultextension=ARCHIVE_EXTENSION,
+        initialfile=f"backup_{mac.replace(':', '')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ARCHIVE_EXTENSION}",
+        filetypes=[("Template archives", f"*{ARCHIVE_EXTENSION}")]
+    )
+    if not archive_path:
+        result_text.set("Device backup cancelled by user.")
+        return
 
-            if _download_template_sequence(model_id, file_path):
-                success_count += 1
+    def backup():
+        try:
+            result_text.set(f"Backing up all templates from {current_client}...")
+            saved, errors = asyncio.run_coroutine_threadsafe(
+                backup_device(current_client, archive_path, source=mac),
+                loop=loop
+            ).result()
 
-            time.sleep(0.5)
+            device_registry.set_template_count(current_client, saved + len(errors))
+            message = f"BACKUP COMPLETE: {saved} templates saved to {os.path.basename(archive_path)}."
+            if errors:
+                message += "\nFailed IDs: " + ", ".join(f"{i} ({e})" for i, e in sorted(errors.items()))
+            result_text.set(message)
 
-        result_text.set(f"SYNC COMPLETE: {success_count} of {total_count} templates successfully downloaded to device.")
+        except TemplateError as e:
+            result_text.set(f"ERROR: Backup failed: {e}")
+        except asyncio.TimeoutError:
+            result_text.set("Communication ERROR: Timeout during backup.")
+        except Exception as e:
+            result_text.set(f"Communication ERROR during backup: {e}")
 
-    threading.Thread(target=sync_templates).start()
+    threading.Thread(target=backup).start()
+
+
+def cmd_restore_device():
+    """Streams all templates of a backup archive to the device over one session."""
+    global current_client, result_text, loop
+
+    if not current_client:
+        result_text.set("ERROR: No device in Manage Mode.")
+        return
+
+    archive_path = filedialog.askopenfilename(
+        defaultextension=ARCHIVE_EXTENSION,
+        filetypes=[("Template archives", f"*{ARCHIVE_EXTENSION}")]
+    )
+    if not archive_path:
+        result_text.set("Device restore cancelled by user.")
+        return
+
+    if not messagebox.askyesno(
+            "Confirm Device Restore",
+            f"Are you sure you want to restore ALL templates from '{os.path.basename(archive_path)}' to the device at {current_client}? This will overwrite existing templates on the sensor."
+    ):
+        result_text.set("Device restore cancelled by user.")
+        return
+
+    def restore():
+        try:
+            result_text.set(f"Restoring templates to {current_client}...")
+            restored, errors = asyncio.run_coroutine_threadsafe(
+                restore_device(current_client, archive_path),
+                loop=loop
+            ).result()
+
+            message = f"RESTORE COMPLETE: {restored} templates downloaded to device."
+            if errors:
+                message += "\nFailed IDs: " + ", ".join(f"{i} ({e})" for i, e in sorted(errors.items()))
+            result_text.set(message)
+
+        except ArchiveError as e:
+            result_text.set(f"ERROR: {e}")
+        except asyncio.TimeoutError:
+            result_text.set("Communication ERROR: Timeout during restore.")
+        except Exception as e:
+            result_text.set(f"Communication ERROR during restore: {e}")
+
+    threading.Thread(target=restore).start()
 
 
 # --- START: MANAGE BUTTON IMPLEMENTATION (TOGGLE) ---
@@ -698,37 +735,29 @@ def cmd_manage():
     """Toggles Manage Mode (ON/OFF) and sends the command to the device."""
     global current_client, manage_mode_active, selected_device_ip, manage_button, mac_address_label, device_listbox, result_text
 
-    if not selected_device_ip and not manage_mode_active:
-        result_text.set("ERROR: Select a device from the list first.")
-        return
-
     if not manage_mode_active:
         # --- TURN ON MANAGE MODE (only occurs when button is pressed and mode is OFF) ---
-        try:
-            # 1. PROMOTE THE SELECTED IP TO THE ACTIVE CLIENT
-            current_client = selected_device_ip
-
-            # Get MAC address for display
-            selected_item = device_listbox.selection()[0]
-            # Use the IP key to get the MAC from the global device_list, as tree index might be fragile
-            mac_address = device_list[current_client]['mac']
-
-            # 2. Send MANAGE command
-            send_command_to_device("MANAGE")
-
-            # 3. Update GUI state
-            manage_button.config(bg="red", text="Manage (ON)")
-            mac_address_label.config(text=f"MAC: {mac_address}")
-            set_command_buttons_state(tk.NORMAL)
-            manage_mode_active = True
-            result_text.set(f"Device {current_client} set to Manage Mode. Control buttons ENABLED.")
-
-        except IndexError:
-            # Should not happen, but clean up if it does
+        selected_device_ip = device_view.selected_ip()
+        # Use the IP key to get the MAC from the device registry; None if the device was removed meanwhile
+        info = device_registry.get(selected_device_ip) if selected_device_ip else None
+        if info is None:
             result_text.set("ERROR: Select a device from the list first.")
-            current_client = None
             return
 
+        # 1. PROMOTE THE SELECTED IP TO THE ACTIVE CLIENT
+        current_client = selected_device_ip
+
+        # 2. Release the device from the continuous listener, then send MANAGE command
+        refresh_continuous_readers()
+        send_command_to_device("MANAGE")
+
+        # 3. Update GUI state
+        manage_button.config(bg="red", text="Manage (ON)")
+        mac_address_label.config(text=f"MAC: {info['mac']}")
+        set_command_buttons_state(tk.NORMAL)
+        manage_mode_active = True
+        result_text.set(f"Device {current_client} set to Manage Mode. Control buttons ENABLED.")
+
     else:
         # --- TURN OFF MANAGE MODE ---
         # 1. Send NORMAL command
@@ -745,6 +774,7 @@ def cmd_manage():
         ip_to_release = current_client
         current_client = None  # Release the client for the continuous listener
         selected_device_ip = None  # Clear the selected target
+        refresh_continuous_readers()
 
         # Clear selection visually
         try:
@@ -768,11 +798,8 @@ def select_device(event):
     """
     global current_client, manage_mode_active, selected_device_ip, device_listbox, result_text, manage_button, mac_address_label
 
-    selection = device_listbox.selection()
-    if selection:
-        # The key (IP) is stored as the first value in the Treeview item
-        selected_ip = device_listbox.item(selection[0], 'values')[0]
-
+    selected_ip = device_view.selected_ip()
+    if selected_ip:
         # 1. Store the selected IP in the temporary variable.
         selected_device_ip = selected_ip
 
@@ -783,16 +810,22 @@ def select_device(event):
         manage_mode_active = False
 
         # Look up the device info in the dictionary
-        info = device_list.get(selected_device_ip, {})
-        battery_status = info.get('battery', 'N/A')
+        info = device_registry.get(selected_device_ip, {})
+        battery_status = info.get('battery')
+        if battery_status is None:
+            battery_status = 'N/A'
+
+        template_count = info.get('template_count')
+        templates_status = f", Templates: {template_count}" if template_count is not None else ""
 
         result_text.set(
-            f"Target selected: {selected_device_ip} (Battery: {battery_status}%) - Press 'Manage' to take control.")
+            f"Target selected: {selected_device_ip} (Battery: {battery_status}%{templates_status}) - Press 'Manage' to take control.")
 
     else:
         # Clear all state if selection is removed
         current_client = None
         selected_device_ip = None
+        refresh_continuous_readers()
         result_text.set("No device selected.")
         set_command_buttons_state(tk.DISABLED)
 
@@ -809,23 +842,31 @@ left_frame.pack(side="left", fill="y", expand=False)
 right_frame.pack(side="right", fill="both", expand=True)
 
 # Device Discovery Panel
-discovery_panel = tk.LabelFrame(left_frame, text=f"Discovered Devices (Listening on TCP Port {STATUS_REPORT_PORT})", padx=10, pady=10)
+discovery_panel = tk.LabelFrame(left_frame, text=f"Discovered Devices (Listening on TCP Port {STATUS_REPORT_PORT}, UDP Port {BROADCAST_PORT})", padx=10, pady=10)
 discovery_panel.pack(fill="x", pady=10)
 
 # === Treeview ===
-columns = ('ip', 'mac', 'battery')
+columns = ('ip', 'mac', 'battery', 'status')
 device_listbox = ttk.Treeview(discovery_panel, columns=columns, show='headings', selectmode='browse')
 
 device_listbox.heading('ip', text='IP Address', anchor='center')
 device_listbox.heading('mac', text='MAC Address', anchor='center')
 device_listbox.heading('battery', text='Battery %', anchor='center')
+device_listbox.heading('status', text='Status', anchor='center')
 
 device_listbox.column('ip', width=110, stretch=tk.NO, anchor='center')
 device_listbox.column('mac', width=140, stretch=tk.NO, anchor='center')
 device_listbox.column('battery', width=80, stretch=tk.NO, anchor='center')
+device_listbox.column('status', width=70, stretch=tk.NO, anchor='center')
+device_listbox.tag_configure('stale', foreground='gray')
+device_listbox.tag_configure('unverified', foreground='gray')
 
 device_listbox.pack(fill="x", expand=True)
 device_listbox.bind('<<TreeviewSelect>>', select_device)
+device_view = TreeviewDeviceView(device_listbox)
+device_view.start()
+discovery_stats_label = tk.Label(discovery_panel, text="", fg="gray", font=("Arial", 8))
+discovery_stats_label.pack(anchor="w")
 # =======================================================
 
 
@@ -870,6 +911,21 @@ control_panel_command_buttons.append(btn_empty)
 btn_sync = tk.Button(control_panel_frame, text="Sync Device", width=15, height=2, command=cmd_sync_device)
 btn_sync.pack(pady=15)
 control_panel_command_buttons.append(btn_sync)
+autosync_var = tk.IntVar(value=0)
+chk_autosync = tk.Checkbutton(control_panel_frame, text="Auto-sync template changes", variable=autosync_var,
+                              command=toggle_autosync)
+chk_autosync.pack()
+control_panel_command_buttons.append(chk_autosync)
+
+# Backup / Restore (whole device <-> single archive)
+backup_frame = tk.Frame(control_panel_frame)
+backup_frame.pack(pady=5)
+btn_backup = tk.Button(backup_frame, text="Backup Device", width=15, height=2, command=cmd_backup_device)
+btn_backup.pack(side="left", padx=5)
+control_panel_command_buttons.append(btn_backup)
+btn_restore = tk.Button(backup_frame, text="Restore Device", width=15, height=2, command=cmd_restore_device)
+btn_restore.pack(side="left", padx=5)
+control_panel_command_buttons.append(btn_restore)
 
 # DeleteChar
 delete_frame = tk.Frame(control_panel_frame)
@@ -942,10 +998,14 @@ continuous_log_text.tag_config('green', foreground='green')
 continuous_log_text.tag_config('purple', foreground='purple')
 continuous_log_text.tag_config('orange', foreground='orange')
 continuous_log_text.tag_config('gray', foreground='gray')
+continuous_log_text.tag_config('black', foreground='black')
 
-# 🚨 START NEW TCP STATUS LISTENER (Replaces UDP discovery)
-status_thread = threading.Thread(target=tcp_status_listener, daemon=True)
-status_thread.start()
+# Start the coalesced log sink: rotating file + one widget update per frame
+continuous_file_log_listener = start_continuous_file_log()
+root.after(LOG_FLUSH_INTERVAL_MS, flush_continuous_log)
+root.after(REGISTRY_SWEEP_INTERVAL_MS, sweep_device_registry)
+root.after(REGISTRY_SAVE_INTERVAL_MS, save_device_registry)
+root.after(METRICS_DUMP_INTERVAL_MS, dump_command_metrics)
 
 # Start asyncio event loop
 def start_loop():
@@ -956,15 +1016,28 @@ def start_loop():
 asyncio_thread = threading.Thread(target=start_loop, daemon=True)
 asyncio_thread.start()
 
-# Start continuous listener thread (relies on asyncio loop)
-continuous_listener_thread = threading.Thread(target=continuous_listener, daemon=True)
-continuous_listener_thread.start()
+# 🚨 START DISCOVERY (TCP status reports + UDP broadcasts) on the shared loop
+asyncio.run_coroutine_threadsafe(start_discovery(), loop)
+
+# Watch the templates folder; changes reach the managed device when Auto-sync is ticked
+asyncio.run_coroutine_threadsafe(start_template_watcher(), loop)
+
+# Start continuous listener (one reader task per device on the shared asyncio loop)
+continuous_readers = ContinuousReaders(loop, gui_log_continuous_message)
+refresh_continuous_readers()
+
+# Show the devices from the previous session right away (as unverified) and confirm them in the background
+load_cached_devices()
 
 
 def on_closing():
     global app_running
     app_running = False
     loop.call_soon_threadsafe(loop.stop)
+    save_device_registry()
+    dump_command_metrics()
+    if continuous_file_log_listener:
+        continuous_file_log_listener.stop()
     root.destroy()
 
 
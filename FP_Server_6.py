@@ -6,6 +6,7 @@ from tkinter import messagebox
 from skimage.morphology import skeletonize
 from skimage import util
 from flask import Flask, request, Response
+import argparse
 import threading
 from datetime import datetime
 from PIL import Image, ImageTk
@@ -13,6 +14,8 @@ import struct
 import io
 import json
 
+import fps_serving
+
 # --- Flask Server Setup ---
 app = Flask(__name__)
 
@@ -388,11 +391,17 @@ def battery_status():
         return Response(f"Error: {e}", status=500)
 
 # --- Start Flask in a separate thread ---
-def run_flask():
-    app.run(host='0.0.0.0', port=8080)
+# (worker threads only: the routes update the GUI of this process, so there are no worker processes)
+def run_flask(args):
+    fps_serving.serve(app, args)
 
 if __name__ == '__main__':
-    flask_thread = threading.Thread(target=run_flask)
+    parser = argparse.ArgumentParser(description="Fingerprint image capture and enhancement server.")
+    fps_serving.add_arguments(parser, port=8080, env_prefix='FP_SERVER', servers=('development', 'waitress'))
+    args = parser.parse_args()
+    print(f"Serving on {fps_serving.describe(args)}.")
+
+    flask_thread = threading.Thread(target=run_flask, args=(args,))
     flask_thread.daemon = True
     flask_thread.start()
     
@@ -0,0 +1,103 @@
+import copy
+import queue
+import threading
+import time
+
+BATCH_WINDOW = 0.002   # Seconds to wait for more probes after the first one of a batch
+BATCH_SIZE = 32        # Most probes scored in one pass
+
+
+class _Pending:
+    __slots__ = ('probe', 'result', 'done')
+
+    def __init__(self, probe):
+        self.probe = probe
+        self.result = None
+        self.done = threading.Event()
+
+
+class DetectBatcher:
+    """
+    Micro-batching in front of the gallery scan.
+
+    Request threads hand their probe to submit() and wait. One scoring thread takes the first
+    waiting probe, collects whatever else arrives within `window` seconds (up to `batch_size`),
+    and calls score_batch(probes) once for all of them; it must return one result per probe,
+    or an exception instance for a probe that failed, which submit() raises (a copy of) in its caller.
+    Probes that arrive while a batch is being scored wait for the next one, so under load
+    batches fill up without any added delay; a lone request only waits `window`.
+    """
+
+    def __init__(self, score_batch, window=BATCH_WINDOW, batch_size=BATCH_SIZE):
+        self.score_batch = score_batch
+        self.window = window
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.probes = 0
+        self.largest = 0
+
+    def submit(self, probe):
+        """Scores probe with the next batch and returns its result."""
+        if self.window <= 0 or self.batch_size <= 1:
+            return self._unwrap(self.score_batch([probe])[0])
+
+        pending = _Pending(probe)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="detect-batcher", daemon=True)
+                self._thread.start()
+        self._queue.put(pending)
+        pending.done.wait()
+        return self._unwrap(pending.result)
+
+    @staticmethod
+    def _unwrap(result):
+        if isinstance(result, BaseException):
+            # A failed batch hands one exception to every waiting thread; each raises its own copy, so
+            # their tracebacks stay separate, chained to the original from the scoring thread
+            raise _copy_exception(result) from result
+        return result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Probes queued during the previous batch are taken even after the window closed
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.score_batch([pending.probe for pending in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+
+            with self._lock:
+                self.batches += 1
+                self.probes += len(batch)
+                self.largest = max(self.largest, len(batch))
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {'batches': self.batches, 'probes': self.probes, 'largest': self.largest,
+                    'average': round(self.probes / self.batches, 2) if self.batches else 0}
+
+
+def _copy_exception(e):
+    """A fresh instance of e without its traceback; e itself if its class cannot be copied."""
+    try:
+        return copy.copy(e)
+    except Exception:
+        return e
@@ -0,0 +1,141 @@
+"""
+Bulk import of device templates into the matcher database (fingerprint_data.db).
+
+Sources can be a folder of template_<id>.mb files (searched recursively), a .zip of such
+files, or a .fpsarc device backup from the management utility. Every template goes
+through the matcher's extraction rules (fingerprint_store.extract_template), templates
+whose content is already in the database are skipped (template_hash, the same unique
+index /upload uses), and rows are written with executemany in large transactions.
+
+    python fingerprint_bulk_import.py templates
+    python fingerprint_bulk_import.py backups/backup_024650530000.fpsarc --names users.csv
+
+users.csv maps model IDs to usernames ("12,alice" per line); templates without an entry
+are stored under their file name (e.g. template_12).
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import time
+import zipfile
+
+from fingerprint_store import DATABASE, extract_template, init_db, template_digest
+from fps_template_archive import ARCHIVE_EXTENSION, ArchiveError, TemplateArchive
+from fps_templates import TEMPLATE_NAME_RE
+
+IMPORT_BATCH_SIZE = 5000  # Rows per executemany/transaction
+
+
+def iter_folder(path):
+    """Yields (name, model_id, raw bytes) for the template files below path."""
+    for folder, _dirs, files in os.walk(path):
+        for filename in sorted(files):
+            match = TEMPLATE_NAME_RE.fullmatch(filename)
+            if match:
+                with open(os.path.join(folder, filename), 'rb') as f:
+                    yield filename[:-3], int(match.group(1)), f.read()
+
+
+def iter_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            match = TEMPLATE_NAME_RE.fullmatch(os.path.basename(info.filename))
+            if match and not info.is_dir():
+                yield os.path.basename(info.filename)[:-3], int(match.group(1)), archive.read(info)
+
+
+def iter_backup(path):
+    with TemplateArchive(path) as archive:
+        for model_id in archive.ids():
+            yield f"template_{model_id}", model_id, bytes(archive.get(model_id))
+
+
+def iter_source(path):
+    if os.path.isdir(path):
+        return iter_folder(path)
+    if path.endswith(ARCHIVE_EXTENSION):
+        return iter_backup(path)
+    if zipfile.is_zipfile(path):
+        return iter_zip(path)
+    raise ValueError(f"{path}: not a folder, .zip or {ARCHIVE_EXTENSION} archive.")
+
+
+def load_names(path):
+    """Reads 'model_id,username' lines (a header line is ignored). Returns {model_id: username}."""
+    names = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[0].strip().isdigit():
+                names[int(row[0])] = row[1].strip()
+    return names
+
+
+def import_templates(sources, database=DATABASE, names=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports every template of the sources. Returns counters:
+    read, imported, duplicates (content already stored or seen earlier), invalid (no packets found).
+    """
+    names = names or {}
+    stats = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0}
+
+    init_db(database)
+    conn = sqlite3.connect(database)
+    try:
+        seen = {digest for (digest,) in conn.execute('SELECT template_hash FROM fingerprints')}
+        batch = []
+        for source in sources:
+            for name, model_id, raw_data in iter_source(source):
+                stats['read'] += 1
+                template = extract_template(raw_data)
+                if not template:
+                    stats['invalid'] += 1
+                    continue
+                digest = template_digest(template)
+                if digest in seen:
+                    stats['duplicates'] += 1
+                    continue
+                seen.add(digest)
+                batch.append((names.get(model_id, name), sqlite3.Binary(template), digest))
+
+                if len(batch) >= batch_size:
+                    stats['imported'] += write_batch(conn, batch)
+                    batch = []
+        if batch:
+            stats['imported'] += write_batch(conn, batch)
+    finally:
+        conn.close()
+    return stats
+
+
+def write_batch(conn, rows):
+    """One transaction per batch."""
+    with conn:
+        # OR IGNORE: rows another writer stored since the import started
+        cursor = conn.executemany('INSERT OR IGNORE INTO fingerprints (username, template, template_hash) VALUES (?, ?, ?)', rows)
+    return cursor.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import .mb templates and template archives into the matcher database.")
+    parser.add_argument('sources', nargs='+', help=f"Template folders, .zip files or {ARCHIVE_EXTENSION} backups.")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--names', help="CSV file with 'model_id,username' lines.")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    names = load_names(args.names) if args.names else {}
+    started = time.perf_counter()
+    try:
+        stats = import_templates(args.sources, args.database, names, args.batch_size)
+    except (OSError, ValueError, ArchiveError, zipfile.BadZipFile, sqlite3.Error) as e:
+        print(f"Import failed: {e}")
+        return 1
+
+    print(f"Read {stats['read']} templates in {time.perf_counter() - started:.2f}s: {stats['imported']} imported, "
+          f"{stats['duplicates']} duplicates skipped, {stats['invalid']} without template data.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,77 @@
+import collections
+import hashlib
+import multiprocessing
+import threading
+import time
+
+CACHE_SIZE = 1024   # Entries kept per process; 0 disables the cache
+CACHE_TTL = 30.0    # Seconds an entry is valid
+
+
+class DetectCache:
+    """
+    LRU/TTL cache of /detect results, for sensors that resend the same payload after a Wi-Fi hiccup.
+
+    Entries are keyed by the SHA-256 of the raw request body and only valid for the gallery
+    generation they were computed at; the first lookup with a newer generation drops them all.
+    What is cached is the scoring result (best username, similarity), so a threshold change
+    applies to cached requests too. Entries are per process; the hit/miss counters live in
+    shared memory and add up over all gunicorn workers.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # {body hash: (result, expires)}
+        self._generation = None
+        self._lock = threading.Lock()
+        self._hits = multiprocessing.Value('q', 0)
+        self._misses = multiprocessing.Value('q', 0)
+
+    @staticmethod
+    def key(body):
+        return hashlib.sha256(body).digest()
+
+    def _count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        """Returns the cached result for key at generation, or None."""
+        if self.size <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                result = entry[0]
+            else:
+                if entry is not None:
+                    del self._entries[key]
+                result = None
+        self._count(self._hits if result is not None else self._misses)
+        return result
+
+    def put(self, key, generation, result):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (result, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        hits, misses = self._hits.value, self._misses.value
+        with self._lock:
+            entries = len(self._entries)
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0,
+                'entries': entries, 'size': self.size, 'ttl': self.ttl}
@@ -0,0 +1,245 @@
+"""
+Threshold calibration for the matcher: all-pairs similarity matrix of a labelled gallery.
+
+Every stored template is scored against every other one with the matcher's similarity
+(calculate_similarity semantics, see fingerprint_gallery.batch_similarity_scores). Pairs with
+the same label (username) are genuine, the others impostor pairs. From the two score
+distributions the tool writes FAR/FRR curves and recommends a threshold for --threshold /
+MATCHER_THRESHOLD: the lowest one whose false accept rate is at most --far.
+
+The N x N matrix is computed in blocks of CALIBRATE_BLOCK_ROWS x CALIBRATE_BLOCK_ROWS pairs; within
+a block every chunk of the column templates stays in cache while all row templates are compared
+with it (batch_similarity_scores). Only blocks on and above the diagonal are computed (the
+similarity is symmetric) and written to both halves. Tasks run in worker processes that open
+the gallery snapshot and the result matrix as memory maps, so neither passes through a pipe
+or has to fit in memory: the matrix needs N * N * 4 bytes on disk.
+
+    python fingerprint_calibrate.py
+    python fingerprint_calibrate.py --database fingerprint_data.db --label-pattern "(.*)_\\d+$" --far 0.0001
+
+Output folder (fingerprint_calibration/):
+    scores.npy          float32 similarity matrix in gallery order (np.load(..., mmap_mode='r'))
+    ids.npy             fingerprints.id of each row
+    curves.csv          threshold, FAR, FRR
+    calibration.json    pair counts, equal error rate, recommended threshold
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from fingerprint_gallery import (GALLERY_FOLDER, Gallery, GalleryError, batch_similarity_scores, read_meta,
+                                 sync_gallery)
+from fingerprint_store import DATABASE, init_db
+
+CALIBRATION_FOLDER = "fingerprint_calibration"
+CALIBRATE_BLOCK_ROWS = 512   # Templates per block (768 KiB at 1536 bytes); the columns are compared in cache-sized chunks
+THRESHOLD_STEP = 0.1         # Spacing of the thresholds in curves.csv, in percent
+TARGET_FAR = 0.001           # Default false accept rate the recommended threshold must not exceed
+
+# Per worker process, set by _open_worker
+_worker = {}
+
+
+def thresholds():
+    return np.round(np.arange(0, 100 + THRESHOLD_STEP / 2, THRESHOLD_STEP), 6)
+
+
+def label_ids(usernames, pattern=None):
+    """
+    One int per row: rows whose label (username, or the first group of pattern matched against it)
+    is equal get the same id; rows without a username or not matching pattern get -1 and are left out.
+    """
+    regex = re.compile(pattern) if pattern else None
+    known = {}
+    ids = np.full(len(usernames), -1, dtype=np.int64)
+    for row, username in enumerate(usernames):
+        if not username:
+            continue
+        if regex is not None:
+            match = regex.fullmatch(username)
+            if match is None:
+                continue
+            username = match.group(1) if regex.groups else match.group(0)
+        ids[row] = known.setdefault(username, len(known))
+    return ids
+
+
+def gallery_labels(gallery, pattern=None):
+    """label_ids() of the gallery's usernames; empty stored templates (legacy rows) are left out as well."""
+    labels = label_ids(gallery.usernames, pattern)
+    labels[np.asarray(gallery.lengths) == 0] = -1
+    return labels
+
+
+def block_tasks(count, block_rows):
+    """(row start, column start) of the blocks on and above the diagonal."""
+    starts = range(0, count, block_rows)
+    return [(row, column) for row in starts for column in starts if column >= row]
+
+
+def _open_worker(gallery_folder, meta, matrix_path, labels, block_rows):
+    _worker['gallery'] = Gallery(gallery_folder, meta)
+    _worker['matrix'] = np.load(matrix_path, mmap_mode='r+')
+    _worker['labels'] = labels
+    _worker['block_rows'] = block_rows
+    _worker['thresholds'] = thresholds()
+
+
+def _score_block(task):
+    """
+    Scores one block, writes it (and its transpose) to the matrix and returns histograms of the
+    genuine and impostor pairs in it: bin k counts the scores above exactly k thresholds.
+    """
+    row, column = task
+    gallery, matrix, labels, block_rows = _worker['gallery'], _worker['matrix'], _worker['labels'], _worker['block_rows']
+    rows = slice(row, min(row + block_rows, len(gallery)))
+    columns = slice(column, min(column + block_rows, len(gallery)))
+
+    probes = [gallery.template(index) for index in range(rows.start, rows.stop)]
+    # float64 like the matcher for the histograms; the matrix stores float32. Empty stored templates
+    # (legacy rows) cannot be probes; they score 0 against everything and have no label (gallery_labels)
+    block = np.zeros((len(probes), columns.stop - columns.start))
+    scored = [index for index, probe in enumerate(probes) if probe]
+    if scored:
+        block[scored] = batch_similarity_scores(gallery.templates[columns], gallery.lengths[columns],
+                                                [probes[index] for index in scored])
+    matrix[rows, columns] = block
+    if row != column:
+        matrix[columns, rows] = block.T
+
+    # Each unordered pair once: the diagonal block only contributes its upper triangle
+    pairs = np.triu(np.ones(block.shape, dtype=np.bool_), k=1) if row == column else np.ones(block.shape, dtype=np.bool_)
+    row_labels, column_labels = labels[rows, np.newaxis], labels[np.newaxis, columns]
+    pairs &= (row_labels >= 0) & (column_labels >= 0)
+    genuine = pairs & (row_labels == column_labels)
+    impostor = pairs & ~genuine
+
+    # The matcher accepts a score above the threshold; searchsorted(side='left') counts the thresholds below it
+    bins = len(_worker['thresholds']) + 1
+    above = np.searchsorted(_worker['thresholds'], block, side='left')
+    return (np.bincount(above[genuine], minlength=bins), np.bincount(above[impostor], minlength=bins))
+
+
+def rates(genuine_histogram, impostor_histogram):
+    """(FAR, FRR) at every threshold from the score histograms of _score_block."""
+    genuine_total, impostor_total = genuine_histogram.sum(), impostor_histogram.sum()
+    # Scores above threshold j are the bins after j
+    genuine_above = genuine_histogram[::-1].cumsum()[::-1][1:]
+    impostor_above = impostor_histogram[::-1].cumsum()[::-1][1:]
+    far = impostor_above / impostor_total if impostor_total else np.zeros(len(impostor_above))
+    frr = 1 - genuine_above / genuine_total if genuine_total else np.zeros(len(genuine_above))
+    return far, frr
+
+
+def recommend(levels, far, frr, target_far):
+    """
+    The lowest threshold with FAR <= target_far (rejecting as few genuine attempts as that allows),
+    and the equal error rate point; thresholds as floats, or None if no threshold reaches target_far.
+    """
+    allowed = np.flatnonzero(far <= target_far)
+    recommended = float(levels[allowed[0]]) if len(allowed) else None
+    equal = int(np.argmin(np.abs(far - frr)))
+    return recommended, float(levels[equal]), float((far[equal] + frr[equal]) / 2)
+
+
+def calibrate(gallery_folder, output, label_pattern=None, target_far=TARGET_FAR, workers=None,
+              block_rows=CALIBRATE_BLOCK_ROWS):
+    """Computes the matrix and curves for the snapshot in gallery_folder; returns the summary written to calibration.json."""
+    meta = read_meta(gallery_folder)
+    gallery = Gallery(gallery_folder, meta)
+    count = len(gallery)
+    labels = gallery_labels(gallery, label_pattern)
+
+    os.makedirs(output, exist_ok=True)
+    matrix_path = os.path.join(output, "scores.npy")
+    np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(count, count)).flush()
+    np.save(os.path.join(output, "ids.npy"), np.asarray(gallery.ids))
+
+    tasks = block_tasks(count, block_rows)
+    bins = len(thresholds()) + 1
+    genuine_histogram = np.zeros(bins, dtype=np.int64)
+    impostor_histogram = np.zeros(bins, dtype=np.int64)
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_open_worker,
+                              initargs=(gallery_folder, meta, matrix_path, labels, block_rows)) as pool:
+        for done, (genuine, impostor) in enumerate(pool.imap_unordered(_score_block, tasks), 1):
+            genuine_histogram += genuine
+            impostor_histogram += impostor
+            if done % 100 == 0 or done == len(tasks):
+                print(f"  {done}/{len(tasks)} blocks ({time.perf_counter() - started:.1f}s)")
+    seconds = time.perf_counter() - started
+
+    levels = thresholds()
+    far, frr = rates(genuine_histogram, impostor_histogram)
+    with open(os.path.join(output, "curves.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['threshold', 'far', 'frr'])
+        writer.writerows((f"{level:g}", f"{far_value:.8f}", f"{frr_value:.8f}")
+                         for level, far_value, frr_value in zip(levels, far, frr))
+
+    recommended, eer_threshold, eer = recommend(levels, far, frr, target_far)
+    summary = {
+        'database': meta.get('database'), 'generation': gallery.generation, 'templates': count,
+        'labelled': int((labels >= 0).sum()), 'identities': len(np.unique(labels[labels >= 0])),
+        'genuine_pairs': int(genuine_histogram.sum()), 'impostor_pairs': int(impostor_histogram.sum()),
+        'target_far': target_far, 'recommended_threshold': recommended,
+        'far_at_recommended': float(far[levels == recommended][0]) if recommended is not None else None,
+        'frr_at_recommended': float(frr[levels == recommended][0]) if recommended is not None else None,
+        'eer': eer, 'eer_threshold': eer_threshold,
+        'block_rows': block_rows, 'blocks': len(tasks), 'seconds': round(seconds, 2),
+    }
+    with open(os.path.join(output, "calibration.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the match threshold from all template pairs of a labelled gallery.")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--gallery', default=GALLERY_FOLDER, help="Gallery snapshot folder (refreshed from --database).")
+    parser.add_argument('--output', default=CALIBRATION_FOLDER)
+    parser.add_argument('--label-pattern', help="Regular expression for usernames; its first group is the finger label "
+                                                "(e.g. \"(.*)_\\d+$\" for alice_1, alice_2). Default: the whole username.")
+    parser.add_argument('--far', type=float, default=TARGET_FAR, help="Highest false accept rate for the recommended threshold.")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU).")
+    parser.add_argument('--block-rows', type=int, default=CALIBRATE_BLOCK_ROWS)
+    args = parser.parse_args()
+
+    try:
+        init_db(args.database)
+        gallery, _action = sync_gallery(args.database, args.gallery)
+    except (OSError, sqlite3.Error, GalleryError) as e:
+        print(f"Gallery snapshot failed: {e}")
+        return 1
+    count = len(gallery)
+    if count < 2:
+        print("Calibration needs at least two templates.")
+        return 1
+    print(f"Calibrating on {count} templates: {count * (count - 1) // 2} pairs, "
+          f"score matrix {count * count * 4 / 2 ** 20:.1f} MiB in '{args.output}'.")
+
+    summary = calibrate(args.gallery, args.output, args.label_pattern, args.far, args.workers, args.block_rows)
+    print(f"{summary['labelled']} labelled templates of {summary['identities']} fingers: "
+          f"{summary['genuine_pairs']} genuine, {summary['impostor_pairs']} impostor pairs ({summary['seconds']}s).")
+    if not summary['genuine_pairs'] or not summary['impostor_pairs']:
+        print("Both genuine and impostor pairs are needed for the curves; check the usernames or --label-pattern.")
+        return 1
+    print(f"Equal error rate {summary['eer']:.4%} at {summary['eer_threshold']:g}%.")
+    if summary['recommended_threshold'] is None:
+        print(f"No threshold keeps the FAR at or below {args.far:g}.")
+        return 1
+    print(f"Recommended threshold: {summary['recommended_threshold']:g}% "
+          f"(FAR {summary['far_at_recommended']:.4%}, FRR {summary['frr_at_recommended']:.4%}); "
+          f"start the matcher with --threshold {summary['recommended_threshold']:g}.")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
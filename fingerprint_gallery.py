@@ -0,0 +1,573 @@
+"""
+On-disk snapshot of the matcher gallery (the fingerprints table of fingerprint_data.db).
+
+The snapshot folder holds one build of four files plus gallery.json:
+
+    templates-<build>.u8    count x stride uint8 matrix, each template zero-padded to stride
+    lengths-<build>.i32     template lengths (int32)
+    ids-<build>.i64         fingerprints.id of each row (int64), ascending
+    usernames-<build>.json  username of each row
+
+The matrix and arrays are opened with np.memmap, so a restart costs a few page mappings
+instead of one bytes object per row. gallery.json records the database generation the
+snapshot was taken at (gallery_state, maintained by triggers, see fingerprint_store).
+Rows added since then are appended to the current build; deletes and template rewrites
+produce a new build. gallery.json is replaced last, so a reader never sees a partial build.
+
+similarity_scores() scores a probe against the whole matrix with the matcher's
+calculate_similarity() semantics (matching bytes over the shorter length, in percent);
+batch_similarity_scores() scores several probes in one pass over the matrix;
+aligned_similarity_scores() also tries the probe shifted by a few bytes.
+
+    python fingerprint_gallery.py              (refresh the snapshot of fingerprint_data.db)
+    python fingerprint_gallery.py --rebuild
+"""
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import fcntl
+except ImportError:  # Windows: the servers there run a single process (waitress, development)
+    fcntl = None
+
+from fingerprint_store import DATABASE, gallery_state, init_db
+
+GALLERY_FOLDER = "fingerprint_gallery"
+GALLERY_META = "gallery.json"
+GALLERY_LOCK = ".lock"
+GALLERY_FORMAT = 1
+MIN_STRIDE = 1536         # 12 packets x 128 payload bytes, the longest template the sensor sends
+WRITE_CHUNK_ROWS = 4096   # Rows padded and written per chunk while building
+SCORE_CHUNK_BYTES = 1 << 18  # Gallery bytes compared per step; keeps the temporary match matrix in cache
+ALIGN_SAMPLE_STEP = 16       # Every n-th column is used to pick the offset of a row (aligned_similarity_scores)
+
+# name: (file extension, dtype)
+GALLERY_FILES = {
+    'templates': ('u8', np.uint8),
+    'lengths': ('i32', np.int32),
+    'ids': ('i64', np.int64),
+}
+
+
+class GalleryError(Exception):
+    """Raised when a snapshot cannot be read."""
+
+
+class _Rebuild(Exception):
+    """An append cannot follow the database (longer template, rows missing); a new build is needed."""
+
+
+def gallery_path(folder, name, build):
+    if name == 'usernames':
+        return os.path.join(folder, f"usernames-{build}.json")
+    return os.path.join(folder, f"{name}-{build}.{GALLERY_FILES[name][0]}")
+
+
+class Gallery:
+    """A loaded snapshot: templates/lengths/ids are read-only memmaps, usernames a list."""
+
+    def __init__(self, folder, meta):
+        self.folder = folder
+        self.meta = meta
+        self.generation = meta['generation']
+        self.stride = meta['stride']
+        count = meta['count']
+
+        try:
+            with open(gallery_path(folder, 'usernames', meta['build']), encoding='utf-8') as f:
+                self.usernames = json.load(f)
+            if count:
+                self.templates = self._map('templates', (count, self.stride))
+                self.lengths = self._map('lengths', (count,))
+                self.ids = self._map('ids', (count,))
+            else:
+                self.templates = np.zeros((0, self.stride), dtype=np.uint8)
+                self.lengths = np.zeros(0, dtype=np.int32)
+                self.ids = np.zeros(0, dtype=np.int64)
+        except (OSError, ValueError) as e:
+            raise GalleryError(f"Gallery snapshot in '{folder}' is unreadable: {e}")
+        if len(self.usernames) != count:
+            raise GalleryError(f"Gallery snapshot in '{folder}' has {len(self.usernames)} usernames for {count} rows.")
+
+    def _map(self, name, shape):
+        return np.memmap(gallery_path(self.folder, name, self.meta['build']), dtype=GALLERY_FILES[name][1],
+                         mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def template(self, index):
+        """The stored template of row index, without padding."""
+        return self.templates[index, :self.lengths[index]].tobytes()
+
+    def rows(self):
+        """Yields (username, template) in database order."""
+        for index, username in enumerate(self.usernames):
+            yield username, self.template(index)
+
+    def scores(self, probe):
+        """Similarity of probe to every row, see similarity_scores()."""
+        return similarity_scores(self.templates, self.lengths, probe)
+
+    def best_match(self, probe):
+        """
+        Returns (username, similarity) of the best scoring row, the first one on ties, as the matcher's
+        loop picks it; (None, 0) if nothing scores above 0.
+        """
+        return self._best(self.scores(probe))[:2]
+
+    def best_row(self, probe):
+        """
+        Like best_match(), but returns (row index, similarity); (None, 0) if nothing scores above 0.
+        """
+        scores = self.scores(probe)
+        best = _best_index(scores)
+        if best is None:
+            return None, 0
+        return best, float(scores[best])
+
+    def best_matches(self, probes, candidates=None, max_offset=0):
+        """
+        (username, similarity, offset) of the best row for several probes, scored in one pass over
+        the gallery. A probe that cannot be scored gets its ZeroDivisionError in place of the result
+        instead of failing the others. With candidates (probe -> ascending row indices, e.g.
+        LshIndex.candidates) each probe is only scored against its candidate rows. With max_offset
+        the probes are scored one by one with aligned_similarity_scores(); offset is 0 otherwise.
+        """
+        results = [None] * len(probes)
+        scorable = []
+        for index, probe in enumerate(probes):
+            if len(self) and not len(probe):
+                results[index] = ZeroDivisionError("division by zero")
+            else:
+                scorable.append(index)
+        if candidates is not None or max_offset:
+            for index in scorable:
+                rows = candidates(probes[index]) if candidates is not None else None
+                templates, lengths = (self.templates, self.lengths) if rows is None else (self.templates[rows], self.lengths[rows])
+                if max_offset:
+                    scores, offsets = aligned_similarity_scores(templates, lengths, probes[index], max_offset)
+                else:
+                    scores, offsets = similarity_scores(templates, lengths, probes[index]), None
+                results[index] = self._best(scores, rows, offsets)
+            return results
+
+        scores = batch_similarity_scores(self.templates, self.lengths, [probes[index] for index in scorable])
+        for index, probe_scores in zip(scorable, scores):
+            results[index] = self._best(probe_scores)
+        return results
+
+    def _best(self, scores, rows=None, offsets=None):
+        best = _best_index(scores)
+        if best is None:
+            return None, 0, 0
+        return (self.usernames[best if rows is None else int(rows[best])], float(scores[best]),
+                0 if offsets is None else int(offsets[best]))
+
+
+def _best_index(scores):
+    """First index of the highest score, or None if no score is above 0."""
+    if not len(scores):
+        return None
+    best = int(np.argmax(scores))
+    return best if scores[best] > 0 else None
+
+
+def pack_templates(templates, stride=None):
+    """
+    Packs a list of templates (bytes) into the snapshot layout: a zero-padded (count x stride) uint8
+    matrix and an int32 length vector, e.g. for scoring templates that are not in the database.
+    """
+    lengths = np.fromiter((len(template) for template in templates), dtype=np.int32, count=len(templates))
+    stride = stride or max(MIN_STRIDE, int(lengths.max()) if len(lengths) else 0)
+    matrix = np.zeros((len(templates), stride), dtype=np.uint8)
+    for index, template in enumerate(templates):
+        matrix[index, :len(template)] = np.frombuffer(template, dtype=np.uint8)
+    return matrix, lengths
+
+
+def similarity_scores(templates, lengths, probe):
+    """
+    Scores probe against every row of a packed (templates, lengths) gallery. Returns float64 percentages,
+    bit-identical to calculate_similarity(probe, template): matching bytes of the shorter template over
+    its length, times 100. Raises ZeroDivisionError like it when probe is empty. An empty stored
+    template (a row enrolled before /upload rejected them) scores 0 instead, so it never matches
+    and does not fail every probe.
+
+    Rows are compared over the first min(len(probe), stride) columns in one operation. The zero
+    padding after a shorter row matches the probe's zero bytes there, so those are subtracted
+    again from a prefix count of the probe's zeros instead of masking every row.
+    """
+    return batch_similarity_scores(templates, lengths, [probe])[0]
+
+
+def batch_similarity_scores(templates, lengths, probes):
+    """
+    similarity_scores() for several probes in one pass: each chunk of the gallery is read once and
+    compared with every probe while it is in cache. Returns one score array per probe.
+    """
+    count = len(lengths)
+    if not count:
+        return [np.zeros(0) for _probe in probes]
+    stride = templates.shape[1]
+    widths = [min(len(probe), stride) for probe in probes]
+    if probes and not min(widths):
+        raise ZeroDivisionError("division by zero")
+
+    queries = [np.frombuffer(probe, dtype=np.uint8, count=width) for probe, width in zip(probes, widths)]
+    # Row sums of the bool matrix as bytes; uint16 holds any count up to 65535 columns and is much
+    # faster than count_nonzero along an axis
+    matches = [np.empty(count, dtype=np.uint16 if width <= 0xFFFF else np.int64) for width in widths]
+    step = max(1, SCORE_CHUNK_BYTES // max(widths, default=1))
+    buffer = np.empty(min(step, count) * max(widths, default=1), dtype=np.bool_)
+    for start in range(0, count, step):
+        block = templates[start:start + step]
+        rows = len(block)
+        for query, width, probe_matches in zip(queries, widths, matches):
+            # A contiguous (rows x width) view of the buffer for this probe
+            equal = buffer[:rows * width].reshape(rows, width)
+            np.equal(block[:, :width], query, out=equal)
+            equal.view(np.uint8).sum(axis=1, dtype=probe_matches.dtype, out=probe_matches[start:start + step])
+
+    scores = []
+    for probe, query, width, probe_matches in zip(probes, queries, widths, matches):
+        zeros_before = np.concatenate(([0], np.cumsum(query == 0)))
+        probe_matches = probe_matches.astype(np.int64) - (zeros_before[width] - zeros_before[np.minimum(lengths, width)])
+        scores.append(_percent(probe_matches, np.minimum(lengths, len(probe))))
+    return scores
+
+
+def _percent(matches, shorter):
+    """matches / shorter * 100 like calculate_similarity; 0 where the stored template is empty (shorter is 0)."""
+    return np.divide(matches, shorter, out=np.zeros(np.shape(matches)), where=shorter > 0) * 100
+
+
+def aligned_similarity_scores(templates, lengths, probe, max_offset, sample_step=ALIGN_SAMPLE_STEP):
+    """
+    similarity_scores() that also tries the probe shifted by up to max_offset bytes either way, for
+    probes whose packet boundaries moved. At offset d, byte i of a stored template is compared with
+    byte i + d of the probe (d > 0: the probe has d extra bytes in front, d < 0: it lacks -d bytes)
+    where both exist, and the matches are divided by the same shorter length as at offset 0, so
+    offset 0 scores exactly like similarity_scores() and a shift pays for the bytes it drops.
+    Returns (scores, offsets): the best score of each row and its offset, the smallest shift on ties.
+
+    All offsets are compared in one operation per gallery chunk, against a strided (offsets x
+    columns) sliding-window view of the zero-padded probe. Searching every column costs about one
+    gallery pass per offset, so by default the offset of each row is picked on every sample_step-th
+    column only, and the row is then scored exactly at offset 0 and at that offset: about two
+    passes plus (2 * max_offset + 1) / sample_step. A row is never scored below its offset 0 score;
+    sample_step=1 searches all offsets exactly.
+    """
+    count = len(lengths)
+    if not count:
+        return np.zeros(0), np.zeros(0, dtype=np.int64)
+    if not len(probe):
+        raise ZeroDivisionError("division by zero")
+    offsets = np.array(sorted(range(-max_offset, max_offset + 1), key=abs))  # 0, -1, 1, -2, 2, ...
+    # Template columns that some offset compares with a probe byte
+    width = min(templates.shape[1], len(probe) + max_offset)
+
+    # padded[max_offset + j] is probe byte j, so the window of offset d starts at max_offset + d
+    padded = np.zeros(width + 2 * max_offset, dtype=np.uint8)
+    used = min(len(probe), width + max_offset)
+    padded[max_offset:max_offset + used] = np.frombuffer(probe, dtype=np.uint8, count=used)
+    windows = sliding_window_view(padded, width)[offsets + max_offset]
+    # Columns whose probe byte exists at each offset
+    columns = np.arange(width)
+    inside = (columns + offsets[:, np.newaxis] >= 0) & (columns + offsets[:, np.newaxis] < len(probe))
+    shorter = np.minimum(lengths, len(probe))
+
+    if sample_step <= 1 or len(offsets) == 1:
+        scores = _percent(_offset_matches(templates, lengths, windows, inside, max_offset, len(probe), 1), shorter[:, np.newaxis])
+        best = np.argmax(scores, axis=1)
+        return scores[np.arange(count), best], offsets[best]
+
+    sampled = _offset_matches(templates, lengths, windows[:, ::sample_step], inside[:, ::sample_step],
+                              max_offset, len(probe), sample_step)
+    picked = np.argmax(sampled, axis=1)
+    scores = _percent(_offset_matches(templates, lengths, windows[:1], inside[:1], max_offset, len(probe), 1)[:, 0], shorter)
+    shifted = _percent(_picked_matches(templates, lengths, windows, inside, picked, max_offset, len(probe)), shorter)
+    # Offset 0 wins ties, as in the exhaustive search
+    best = np.where(shifted > scores, picked, 0)
+    return np.maximum(scores, shifted), offsets[best]
+
+
+def _offset_matches(templates, lengths, windows, inside, max_offset, probe_length, step):
+    """
+    Matching bytes of every row at every offset (count x offsets), on every step-th template column;
+    windows/inside are the probe windows and their valid columns, already taken at those columns.
+    """
+    count = len(lengths)
+    width = windows.shape[1]
+    # Only the first and last max_offset columns can lie outside the probe at some offset
+    head = min(-(-max_offset // step), width)
+    tail = min(max(-(-(probe_length - max_offset) // step), head), width)
+
+    windows = np.ascontiguousarray(windows)
+    matches = np.empty((len(windows), count), dtype=np.uint16 if width <= 0xFFFF else np.int64)
+    rows_per_step = max(1, SCORE_CHUNK_BYTES // width)
+    buffer = np.empty(min(rows_per_step, count) * width, dtype=np.bool_)
+    for start in range(0, count, rows_per_step):
+        block = templates[start:start + rows_per_step, :width * step:step]
+        if step > 1:
+            block = np.ascontiguousarray(block)
+        rows = len(block)
+        equal = buffer[:rows * width].reshape(rows, width)
+        # The chunk stays in cache while it is compared with the window of every offset
+        for window, valid, offset_matches in zip(windows, inside, matches):
+            np.equal(block, window, out=equal)
+            equal[:, :head] &= valid[:head]
+            equal[:, tail:] &= valid[tail:]
+            equal.view(np.uint8).sum(axis=1, dtype=matches.dtype, out=offset_matches[start:start + rows_per_step])
+
+    # As in batch_similarity_scores(), remove the matches of the zero padding after shorter rows
+    zeros_before = np.concatenate((np.zeros((len(windows), 1), dtype=np.int64),
+                                   np.cumsum((windows == 0) & inside, axis=1)), axis=1)
+    covered = -(-np.minimum(lengths, width * step) // step)  # Sampled columns inside each row
+    return (matches.astype(np.int64) - (zeros_before[:, width:] - zeros_before[:, covered])).T
+
+
+def _picked_matches(templates, lengths, windows, inside, picked, max_offset, probe_length):
+    """Matching bytes of every row at its own offset, windows[picked[row]], in one pass over the gallery."""
+    count = len(lengths)
+    width = windows.shape[1]
+    head = min(max_offset, width)
+    tail = min(max(probe_length - max_offset, head), width)
+
+    windows = np.ascontiguousarray(windows)
+    matches = np.empty(count, dtype=np.uint16 if width <= 0xFFFF else np.int64)
+    rows_per_step = max(1, SCORE_CHUNK_BYTES // width)
+    probe_rows = np.empty((min(rows_per_step, count), width), dtype=np.uint8)
+    equal = np.empty((min(rows_per_step, count), width), dtype=np.bool_)
+    for start in range(0, count, rows_per_step):
+        block = templates[start:start + rows_per_step, :width]
+        rows = len(block)
+        chosen = picked[start:start + rows_per_step]
+        np.take(windows, chosen, axis=0, out=probe_rows[:rows])
+        np.equal(block, probe_rows[:rows], out=equal[:rows])
+        equal[:rows, :head] &= inside[chosen, :head]
+        equal[:rows, tail:] &= inside[chosen, tail:]
+        equal[:rows].view(np.uint8).sum(axis=1, dtype=matches.dtype, out=matches[start:start + rows_per_step])
+
+    zeros_before = np.concatenate((np.zeros((len(windows), 1), dtype=np.int64),
+                                   np.cumsum((windows == 0) & inside, axis=1)), axis=1)
+    return matches.astype(np.int64) - (zeros_before[picked, width] - zeros_before[picked, np.minimum(lengths, width)])
+
+
+
+def read_meta(folder=GALLERY_FOLDER):
+    """Returns the snapshot description from gallery.json, or None if there is no usable one."""
+    try:
+        with open(os.path.join(folder, GALLERY_META), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if isinstance(meta, dict) and meta.get('format') == GALLERY_FORMAT else None
+
+
+def write_meta(folder, meta):
+    _write_json(os.path.join(folder, GALLERY_META), meta)
+
+
+def _write_json(path, value):
+    """Writes value as JSON atomically (temp file + rename)."""
+    fd, temp_path = tempfile.mkstemp(prefix=".gallery.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _append_rows(folder, build, stride, count, rows):
+    """
+    Appends (id, template) rows to the files of build, after cutting them back to count rows
+    (left over from an interrupted append). Returns (rows written, last id).
+    """
+    files = {}
+    try:
+        for name, (_ext, dtype) in GALLERY_FILES.items():
+            row_size = stride if name == 'templates' else np.dtype(dtype).itemsize
+            f = files[name] = open(gallery_path(folder, name, build), 'a+b')
+            f.truncate(count * row_size)
+
+        written = 0
+        last_id = None
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= WRITE_CHUNK_ROWS:
+                written += _write_chunk(files, stride, chunk)
+                last_id = chunk[-1][0]
+                chunk = []
+        if chunk:
+            written += _write_chunk(files, stride, chunk)
+            last_id = chunk[-1][0]
+    finally:
+        for f in files.values():
+            f.close()
+    return written, last_id
+
+
+def _write_chunk(files, stride, chunk):
+    matrix = np.zeros((len(chunk), stride), dtype=np.uint8)
+    lengths = np.empty(len(chunk), dtype=np.int32)
+    ids = np.empty(len(chunk), dtype=np.int64)
+    for index, (row_id, template) in enumerate(chunk):
+        if len(template) > stride:
+            raise _Rebuild(f"template {row_id} is longer than the stride ({len(template)} > {stride})")
+        matrix[index, :len(template)] = np.frombuffer(template, dtype=np.uint8)
+        lengths[index] = len(template)
+        ids[index] = row_id
+    files['templates'].write(matrix.tobytes())
+    files['lengths'].write(lengths.tobytes())
+    files['ids'].write(ids.tobytes())
+    return len(chunk)
+
+
+def _read_usernames(conn):
+    return [username for (username,) in conn.execute('SELECT username FROM fingerprints ORDER BY id')]
+
+
+def _remove_other_builds(folder, build):
+    """Deletes the files of older builds. A build still mapped elsewhere (Windows) is left for the next time."""
+    suffixes = {f"-{build}.{ext}" for ext, _dtype in GALLERY_FILES.values()} | {f"-{build}.json"}
+    prefixes = tuple(f"{name}-" for name in list(GALLERY_FILES) + ['usernames'])
+    for filename in os.listdir(folder):
+        if filename.startswith(prefixes) and not any(filename.endswith(suffix) for suffix in suffixes):
+            try:
+                os.remove(os.path.join(folder, filename))
+            except OSError:
+                pass
+
+
+def rebuild_gallery(conn, folder, state, build):
+    """Writes a complete new build from the database. Returns its meta."""
+    longest, = conn.execute('SELECT MAX(LENGTH(template)) FROM fingerprints').fetchone()
+    stride = max(MIN_STRIDE, longest or 0)
+    count, last_id = _append_rows(folder, build, stride, 0,
+                                  ((row_id, bytes(template)) for row_id, template
+                                   in conn.execute('SELECT id, template FROM fingerprints ORDER BY id')))
+    _write_json(gallery_path(folder, 'usernames', build), _read_usernames(conn))
+    return {'format': GALLERY_FORMAT, 'database': os.path.abspath(conn_database(conn)), 'build': build,
+            'generation': state[0], 'rewrites': state[1], 'count': count, 'stride': stride, 'max_id': last_id or 0}
+
+
+def append_gallery(conn, folder, meta, state):
+    """Appends the rows added since meta was written. Returns the new meta; raises _Rebuild if that is not enough."""
+    new_rows = conn.execute('SELECT id, template FROM fingerprints WHERE id > ? ORDER BY id', (meta['max_id'],))
+    added, last_id = _append_rows(folder, meta['build'], meta['stride'], meta['count'],
+                                  ((row_id, bytes(template)) for row_id, template in new_rows))
+    usernames = _read_usernames(conn)
+    if len(usernames) != meta['count'] + added:
+        raise _Rebuild("rows were removed")
+    _write_json(gallery_path(folder, 'usernames', meta['build']), usernames)
+    return dict(meta, generation=state[0], count=meta['count'] + added, max_id=last_id or meta['max_id'])
+
+
+@contextlib.contextmanager
+def _locked(folder):
+    """Serialises snapshot updates between processes sharing the folder (gunicorn workers)."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(folder, GALLERY_LOCK), 'a+b') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def conn_database(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+
+def database_generation(database=DATABASE):
+    """The current generation of the database (one cheap query), to check a loaded Gallery against."""
+    conn = sqlite3.connect(database)
+    try:
+        return gallery_state(conn)[0]
+    finally:
+        conn.close()
+
+
+def sync_gallery(database=DATABASE, folder=GALLERY_FOLDER, rebuild=False):
+    """
+    Brings the snapshot in folder up to date with database and loads it.
+    Returns (Gallery, action) with action 'loaded' (snapshot was current), 'appended' or 'rebuilt'.
+    Processes sharing folder take turns; the first one updates the snapshot, the others load it.
+    """
+    os.makedirs(folder, exist_ok=True)
+    with _locked(folder):
+        return _sync(database, folder, rebuild)
+
+
+def _sync(database, folder, rebuild):
+    meta = read_meta(folder)
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        # One read transaction, so the state and the rows belong together
+        conn.execute('BEGIN')
+        state = gallery_state(conn)
+        max_id, = conn.execute('SELECT COALESCE(MAX(id), 0) FROM fingerprints').fetchone()
+
+        action = None
+        usable = (not rebuild and meta is not None and meta['database'] == os.path.abspath(conn_database(conn))
+                  and meta['max_id'] <= max_id)
+        if usable and (meta['generation'], meta['rewrites']) == state:
+            action = 'loaded'
+        elif usable and meta['rewrites'] == state[1]:
+            try:
+                meta = append_gallery(conn, folder, meta, state)
+                action = 'appended'
+            except _Rebuild:
+                pass
+        if action is None:
+            meta = rebuild_gallery(conn, folder, state, (meta['build'] + 1) if meta else 1)
+            action = 'rebuilt'
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    if action != 'loaded':
+        write_meta(folder, meta)
+        if action == 'rebuilt':
+            _remove_other_builds(folder, meta['build'])
+    return Gallery(folder, meta), action
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the memory-mapped gallery snapshot of the matcher database.")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--folder', default=GALLERY_FOLDER)
+    parser.add_argument('--rebuild', action='store_true', help="Write a new build even if the snapshot could be appended to.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        init_db(args.database)
+        gallery, action = sync_gallery(args.database, args.folder, args.rebuild)
+    except (OSError, sqlite3.Error, GalleryError) as e:
+        print(f"Gallery snapshot failed: {e}")
+        return 1
+    print(f"Gallery {action}: {len(gallery)} templates, stride {gallery.stride}, generation {gallery.generation} "
+          f"({time.perf_counter() - started:.2f}s).")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
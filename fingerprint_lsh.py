@@ -0,0 +1,261 @@
+"""
+Locality-sensitive candidate index for /detect (banded byte sampling).
+
+The similarity of two templates is the fraction of equal bytes at the same positions, so two
+templates agree on a random position with probability equal to their similarity s. A band
+samples LSH_ROWS positions and uses the bytes there as one uint64 key; a stored template
+becomes a candidate if it shares the key of at least one of LSH_BANDS bands with the probe,
+which happens with probability 1 - (1 - s**rows)**bands. With 8 x 32 that is 99.7% at s = 0.8
+and 12% at s = 0.5. Only the candidates are scored exactly (similarity_scores).
+
+Positions are drawn (with a fixed seed) from the columns where the gallery's bytes actually
+vary; constant columns (headers, padding) would put every template in the same bucket. The
+index is built from a gallery snapshot on first use and follows the fingerprints table through
+the snapshot like the gallery itself: rows appended to the snapshot build are merge-inserted
+with the same positions, a username change reuses the index as it is, and only a new build
+(deleted or rewritten rows) builds it again.
+
+    python fingerprint_lsh.py                  (recall/latency report on a synthetic gallery)
+    python fingerprint_lsh.py --database fingerprint_data.db
+"""
+import argparse
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+
+from fingerprint_gallery import pack_templates, similarity_scores
+
+LSH_BANDS = 32
+LSH_ROWS = 8                # Bytes per band key (at most 8: a key is one uint64)
+LSH_SEED = 1                # Same positions in every process
+LSH_SAMPLE_ROWS = 10000     # Gallery rows looked at to find the varying columns
+LSH_MAX_MODE_SHARE = 0.5    # Columns where one byte value covers more rows than this are not sampled
+LSH_KEY_CHUNK_ROWS = 65536  # Rows whose keys are gathered per step while building
+
+_gallery_indexes = {}  # {snapshot folder: (build, LshIndex)}
+_gallery_indexes_lock = threading.Lock()
+
+
+class LshIndex:
+    """Band keys of a packed gallery, sorted per band for binary-search lookup."""
+
+    def __init__(self, templates, lengths, bands=LSH_BANDS, rows=LSH_ROWS, seed=LSH_SEED):
+        if not 1 <= rows <= 8:
+            raise ValueError("LSH band keys are one uint64: rows must be 1 to 8.")
+        self.bands = bands
+        self.rows = rows
+        self.stride = templates.shape[1]
+        self.positions = choose_positions(templates, lengths, bands, rows, seed)
+        self.count = len(lengths)
+
+        keys = self._row_keys(templates, 0, self.count)
+        self.order = np.argsort(keys, axis=0, kind='stable').T.copy()             # (bands, count) row indices
+        self.sorted_keys = np.take_along_axis(keys, self.order.T, axis=0).T.copy()  # (bands, count)
+
+    def _row_keys(self, templates, start, stop):
+        """(stop - start, bands) keys of gallery rows start..stop."""
+        keys = np.empty((stop - start, self.bands), dtype=np.uint64)
+        for chunk in range(start, stop, LSH_KEY_CHUNK_ROWS):
+            block = templates[chunk:min(chunk + LSH_KEY_CHUNK_ROWS, stop)]
+            keys[chunk - start:chunk - start + len(block)] = self._keys(block[:, self.positions.ravel()])
+        return keys
+
+    def extended(self, templates, lengths):
+        """
+        A new index that also covers the rows appended to templates since this one was built, with the
+        same positions. Their keys are merge-inserted into the sorted bands instead of sorting all rows
+        again; this index is left as it is for readers still using it.
+        """
+        count = len(lengths)
+        if count == self.count:
+            return self
+        if templates.shape[1] != self.stride or count < self.count:
+            raise ValueError("Only rows appended to the same gallery layout can be added to an LSH index.")
+
+        new_keys = self._row_keys(templates, self.count, count)
+        new_order = np.argsort(new_keys, axis=0, kind='stable').T  # (bands, new rows)
+        sorted_keys = np.empty((self.bands, count), dtype=np.uint64)
+        order = np.empty((self.bands, count), dtype=self.order.dtype)
+        for band in range(self.bands):
+            band_keys = new_keys[new_order[band], band]
+            # side='right' keeps equal keys in row order, as the stable sort of a full build does
+            at = np.searchsorted(self.sorted_keys[band], band_keys, side='right')
+            sorted_keys[band] = np.insert(self.sorted_keys[band], at, band_keys)
+            order[band] = np.insert(self.order[band], at, new_order[band] + self.count)
+
+        index = copy.copy(self)
+        index.count, index.sorted_keys, index.order = count, sorted_keys, order
+        return index
+
+    def _keys(self, sampled):
+        """(n, bands * rows) sampled bytes -> (n, bands) uint64 keys."""
+        packed = np.zeros((len(sampled), self.bands, 8), dtype=np.uint8)
+        packed[:, :, :self.rows] = sampled.reshape(len(sampled), self.bands, self.rows)
+        return packed.view(np.uint64).reshape(len(sampled), self.bands)
+
+    def probe_keys(self, probe, max_offset=0):
+        """(2 * max_offset + 1, bands) keys of probe shifted by -max_offset..max_offset bytes."""
+        padded = np.zeros(self.stride + 2 * max_offset, dtype=np.uint8)
+        width = min(len(probe), self.stride + max_offset)
+        padded[max_offset:max_offset + width] = np.frombuffer(probe, dtype=np.uint8, count=width)
+        # Row d of shifts holds the probe bytes that template byte i meets at offset d (see aligned_similarity_scores)
+        shifts = self.positions.ravel() + np.arange(2 * max_offset + 1)[:, np.newaxis]
+        return self._keys(padded[shifts])
+
+    def candidates(self, probe, max_offset=0):
+        """Row indices (ascending) sharing at least one band key with probe at some offset up to max_offset."""
+        keys = self.probe_keys(probe, max_offset)
+        found = []
+        for band in range(self.bands):
+            band_keys = self.sorted_keys[band]
+            lows = np.searchsorted(band_keys, keys[:, band], side='left')
+            highs = np.searchsorted(band_keys, keys[:, band], side='right')
+            found.extend(self.order[band, low:high] for low, high in zip(lows, highs) if high > low)
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+
+def gallery_index(gallery):
+    """
+    The LshIndex of a loaded Gallery. The index of an earlier Gallery of the same snapshot build is
+    reused (username changes) or extended with the appended rows; a new build gets a new index.
+    """
+    folder = os.path.abspath(gallery.folder)
+    build = gallery.meta['build']
+    with _gallery_indexes_lock:
+        index_build, index = _gallery_indexes.get(folder, (None, None))
+        if index is None or index_build != build or index.count > len(gallery):
+            index = LshIndex(gallery.templates, gallery.lengths)
+        else:
+            index = index.extended(gallery.templates, gallery.lengths)
+        _gallery_indexes[folder] = (build, index)
+        return index
+
+
+def choose_positions(templates, lengths, bands, rows, seed):
+    """(bands x rows) byte positions, drawn from the columns that vary across the gallery."""
+    rng = np.random.RandomState(seed)
+    count = len(lengths)
+    # Columns all templates cover (5th percentile length), so the keys do not depend on padding
+    span = max(rows, min(templates.shape[1], int(np.percentile(lengths, 5)) if count else templates.shape[1]))
+    sample = templates[rng.choice(count, min(count, LSH_SAMPLE_ROWS), replace=False)] if count else templates[:0]
+
+    columns = np.arange(span)
+    if len(sample):
+        mode_share = np.array([np.bincount(sample[:, column], minlength=256).max() for column in columns]) / len(sample)
+        varying = columns[mode_share <= LSH_MAX_MODE_SHARE]
+        if len(varying) >= rows:
+            columns = varying
+    return np.stack([rng.choice(columns, rows, replace=False) for _band in range(bands)])
+
+
+def best_candidate(templates, lengths, index, probe):
+    """(row index, similarity) of the best candidate of probe, first one on ties; (None, 0) if none scores above 0."""
+    candidates = index.candidates(probe)
+    if not len(candidates):
+        return None, 0
+    scores = similarity_scores(templates[candidates], lengths[candidates], probe)
+    best = int(np.argmax(scores))
+    if scores[best] <= 0:
+        return None, 0
+    return int(candidates[best]), float(scores[best])
+
+
+def synthetic_gallery(count, length=1536, shared=0.4, seed=7):
+    """
+    Random templates with a fixed header that also agree with a common base on a `shared` share
+    of their bytes, so unrelated templates score around shared * 100 % like structured sensor data.
+    """
+    rng = np.random.RandomState(seed)
+    base = rng.randint(0, 256, size=length, dtype=np.uint8)
+    matrix = rng.randint(0, 256, size=(count, length), dtype=np.uint8)
+    common = rng.rand(count, length) < shared
+    matrix[common] = np.broadcast_to(base, matrix.shape)[common]
+    matrix[:, :16] = 3
+    return [bytes(row) for row in matrix]
+
+
+def perturb(template, similarity, rng):
+    """A copy of template with a (1 - similarity) share of its bytes replaced (a genuine probe)."""
+    data = np.frombuffer(template, dtype=np.uint8).copy()
+    changed = rng.rand(len(data)) > similarity
+    data[changed] = (data[changed] + rng.randint(1, 256, size=int(changed.sum()))).astype(np.uint8)
+    return data.tobytes()
+
+
+def report(templates, probe_count, similarities, threshold, configs):
+    """
+    Prints recall (the LSH best match equals the exhaustive one, among probes the exhaustive scan
+    matches above threshold), the average candidate share and the latency per probe.
+    """
+    matrix, lengths = pack_templates(templates)
+    rng = np.random.RandomState(3)
+    print(f"Gallery: {len(templates)} templates, {probe_count} probes per similarity, threshold {threshold}%")
+
+    indexes = []
+    for bands, rows in configs:
+        started = time.perf_counter()
+        indexes.append((bands, rows, LshIndex(matrix, lengths, bands, rows), (time.perf_counter() - started) * 1000))
+
+    for similarity in similarities:
+        picks = rng.choice(len(templates), probe_count, replace=len(templates) < probe_count)
+        probes = [perturb(templates[pick], similarity, rng) for pick in picks]
+
+        started = time.perf_counter()
+        exact = []
+        for probe in probes:
+            scores = similarity_scores(matrix, lengths, probe)
+            best = int(np.argmax(scores))
+            exact.append((best, scores[best]))
+        exhaustive_ms = (time.perf_counter() - started) * 1000 / len(probes)
+        print(f"\nGenuine similarity {similarity:.2f}: exhaustive {exhaustive_ms:.2f} ms/probe")
+
+        for bands, rows, index, build_ms in indexes:
+            found = relevant = candidates = 0
+            started = time.perf_counter()
+            for probe, (best, score) in zip(probes, exact):
+                candidates += len(index.candidates(probe))
+                row, _similarity = best_candidate(matrix, lengths, index, probe)
+                if score > threshold:
+                    relevant += 1
+                    found += row == best
+            lsh_ms = (time.perf_counter() - started) * 1000 / len(probes)
+            recall = f"{found / relevant:.3f}" if relevant else "n/a"
+            print(f"  {bands:3d} bands x {rows}: recall {recall} ({relevant} matches), "
+                  f"candidates {candidates / len(probes) / len(templates):.2%}, {lsh_ms:.2f} ms/probe, "
+                  f"build {build_ms:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency report of the LSH candidate index.")
+    parser.add_argument('--database', help="Use the templates of this matcher database instead of a synthetic gallery.")
+    parser.add_argument('--size', type=int, default=100000, help="Synthetic gallery size.")
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--similarities', default="0.95,0.9,0.85,0.8", help="Genuine probe similarities to test.")
+    parser.add_argument('--threshold', type=float, default=80)
+    parser.add_argument('--bands', default="16,32,64", help="Band counts to compare.")
+    parser.add_argument('--rows', default="6,8", help="Bytes per band to compare (1-8).")
+    args = parser.parse_args()
+
+    if args.database:
+        import sqlite3
+        conn = sqlite3.connect(args.database)
+        templates = [bytes(template) for (template,) in conn.execute('SELECT template FROM fingerprints ORDER BY id')]
+        conn.close()
+    else:
+        templates = synthetic_gallery(args.size)
+    if not templates:
+        print("No templates.")
+        return 1
+
+    report(templates, args.probes, [float(value) for value in args.similarities.split(',')], args.threshold,
+           [(int(bands), int(rows)) for rows in args.rows.split(',') for bands in args.bands.split(',')])
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
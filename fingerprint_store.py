@@ -0,0 +1,146 @@
+import hashlib
+import sqlite3
+import struct
+
+DATABASE = 'fingerprint_data.db'
+PACKET_HEADER = b'\xef\x01\xff\xff\xff\xff'  # Start code + default module address
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL,
+        template BLOB NOT NULL,
+        template_hash TEXT,             -- template_digest(template); unique, see migrate()
+        near_duplicate_of INTEGER       -- Most similar earlier row when enrolled above the near-duplicate threshold
+    );
+
+    -- Change counters for the gallery snapshot (fingerprint_gallery.py): generation counts every
+    -- change of fingerprints, rewrites only those an append-only refresh cannot follow.
+    CREATE TABLE IF NOT EXISTS gallery_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL,
+        rewrites INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO gallery_state (id, generation, rewrites) VALUES (1, 0, 0);
+
+    CREATE TRIGGER IF NOT EXISTS fingerprints_inserted AFTER INSERT ON fingerprints BEGIN
+        UPDATE gallery_state SET generation = generation + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS fingerprints_renamed AFTER UPDATE OF username ON fingerprints BEGIN
+        UPDATE gallery_state SET generation = generation + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS fingerprints_rewritten AFTER UPDATE OF id, template ON fingerprints BEGIN
+        UPDATE gallery_state SET generation = generation + 1, rewrites = rewrites + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS fingerprints_deleted AFTER DELETE ON fingerprints BEGIN
+        UPDATE gallery_state SET generation = generation + 1, rewrites = rewrites + 1 WHERE id = 1;
+    END;
+'''
+
+
+# Columns added after the first version of the table; older databases get them in migrate()
+ADDED_COLUMNS = (('template_hash', 'TEXT'), ('near_duplicate_of', 'INTEGER'))
+HASH_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS fingerprints_template_hash ON fingerprints (template_hash)'
+
+
+def init_db(path=DATABASE):
+    """Creates or upgrades the database. Returns the migrate() counters."""
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            stats = migrate(conn)
+    finally:
+        conn.close()
+    return stats
+
+
+def migrate(conn):
+    """
+    Brings an older table up to SCHEMA: adds missing columns, hashes rows stored without
+    template_hash, merges exact duplicates (compact_duplicates) and creates the unique hash index.
+    Only costs a query once every row is hashed. Returns {'hashed': rows, 'removed': duplicates}.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(fingerprints)')}
+    for name, kind in ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute(f'ALTER TABLE fingerprints ADD COLUMN {name} {kind}')
+
+    unhashed = [(template_digest(bytes(template)), row_id) for row_id, template
+                in conn.execute('SELECT id, template FROM fingerprints WHERE template_hash IS NULL')]
+    removed = 0
+    if unhashed:
+        conn.execute('DROP INDEX IF EXISTS fingerprints_template_hash')
+        conn.executemany('UPDATE fingerprints SET template_hash = ? WHERE id = ?', unhashed)
+        removed = compact_duplicates(conn)
+    conn.execute(HASH_INDEX)
+    return {'hashed': len(unhashed), 'removed': removed}
+
+
+def compact_duplicates(conn):
+    """
+    Merges rows with the same template_hash into the earliest one; it takes the first non-empty
+    username of the group if its own is empty. Returns the number of rows deleted.
+    """
+    keep = {}  # {hash: [id, username]}
+    renames = {}
+    duplicates = []
+    for row_id, username, digest in conn.execute('SELECT id, username, template_hash FROM fingerprints ORDER BY id'):
+        kept = keep.get(digest)
+        if kept is None:
+            keep[digest] = [row_id, username]
+        else:
+            duplicates.append((row_id,))
+            if not kept[1] and username:
+                kept[1] = renames[kept[0]] = username
+    conn.executemany('UPDATE fingerprints SET username = ? WHERE id = ?', [(name, row_id) for row_id, name in renames.items()])
+    conn.executemany('DELETE FROM fingerprints WHERE id = ?', duplicates)
+    return len(duplicates)
+
+
+def gallery_state(conn):
+    """Returns (generation, rewrites) of the fingerprints table (see SCHEMA)."""
+    row = conn.execute('SELECT generation, rewrites FROM gallery_state WHERE id = 1').fetchone()
+    return tuple(row) if row else (0, 0)
+
+
+def extract_template(raw_data, verbose=False):
+    """
+    Joins the payloads of the sensor packets in raw_data into one template, the way the
+    matcher stores it: header/length/checksum dropped, trailing 0x00 padding stripped per packet.
+    """
+    payloads = []
+    offset = 0
+
+    while offset < len(raw_data):
+        # Check for the packet header
+        if raw_data[offset:offset + 6] == PACKET_HEADER:
+            # Extract the package identifier and length
+            try:
+                package_id = raw_data[offset + 6]
+                length = struct.unpack(">H", raw_data[offset + 7:offset + 9])[0]
+            except (IndexError, struct.error):
+                break  # Exit if the packet structure is incomplete
+
+            if verbose:
+                print(f"Packet found: Header at offset {offset}, Package ID: {package_id}, Length: {length}")
+
+            # Payload without header, length and the 2-byte checksum; trailing padding removed
+            payload = raw_data[offset + 9:offset + 9 + length - 2]
+            payloads.append(payload.rstrip(b'\x00'))
+
+            # Move offset to the next packet
+            offset = offset + 9 + length
+        else:
+            # Move to the next byte if no header is found
+            offset += 1
+
+    fingerprint_template = b''.join(payloads)
+    if verbose:
+        print(f"Extracted fingerprint template ({len(fingerprint_template)} bytes): {fingerprint_template.hex()}")
+    return fingerprint_template
+
+
+def template_digest(template):
+    """Content hash used to recognise the same template stored twice."""
+    return hashlib.sha256(template).hexdigest()
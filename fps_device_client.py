@@ -0,0 +1,72 @@
+import asyncio
+import contextlib
+import logging
+
+from fps_fleet import TCP_PORT
+from fps_metrics import command_metrics
+from fps_protocol import LINE_ERROR, ResponseStream
+from fps_templates import TEMPLATES_FOLDER, pull_template
+
+COMMAND_TIMEOUT = 5   # Seconds to wait for each response line of a command
+ENROLL_TIMEOUT = 60   # Enrollment waits for the user to place the finger twice
+
+log = logging.getLogger("fps.client")
+
+
+class CommandError(Exception):
+    """Raised when a device answers a command with ERROR (or not at all). responses holds all lines received."""
+
+    def __init__(self, message, responses=()):
+        super().__init__(message)
+        self.responses = list(responses)
+
+
+async def send_command(ip, command, argument=None, timeout=COMMAND_TIMEOUT, port=TCP_PORT):
+    """
+    Sends one command on its own session and collects the response lines until the command's
+    terminator (fps_protocol.RESPONSE_RULES). Returns the lines as text; raises CommandError if
+    the last one is an ERROR or no answer came.
+    """
+    async with command_metrics.session(ip, command, port) as (reader, writer):
+        full_command = f"{command},{argument}\n" if argument is not None else f"{command}\n"
+        writer.write(full_command.encode('utf-8'))
+        await writer.drain()
+
+        lines = await ResponseStream(reader).read_response(command, timeout)
+        responses = [line.text for line in lines]
+
+        if not lines:
+            raise CommandError(f"Command '{command}' sent. No response received.")
+        if lines[-1].kind == LINE_ERROR:
+            raise CommandError(lines[-1].text, responses)
+    return responses
+
+
+@contextlib.asynccontextmanager
+async def managed(ip, port=TCP_PORT):
+    """
+    Puts a device into MANAGE mode for the duration of the block and back to NORMAL afterwards.
+    If the block failed, that error is raised even when NORMAL fails too (which is only logged).
+    """
+    await send_command(ip, "MANAGE", port=port)
+    try:
+        yield
+    except BaseException:
+        try:
+            await send_command(ip, "NORMAL", port=port)
+        except Exception as e:
+            log.warning(f"[{ip}] NORMAL after a failed command failed too: {str(e) or e.__class__.__name__}")
+        raise
+    await send_command(ip, "NORMAL", port=port)
+
+
+async def enroll_template(ip, model_id, folder=TEMPLATES_FOLDER, port=TCP_PORT):
+    """
+    Enrolls a finger under model_id and pulls the new template into folder, like the Enroll button.
+    Returns (response lines, saved file name).
+    """
+    responses = await send_command(ip, "ENROLL", model_id, timeout=ENROLL_TIMEOUT, port=port)
+    # Give the sensor a moment to store the template before reading it back
+    await asyncio.sleep(1)
+    filename = await pull_template(ip, model_id, folder, port)
+    return responses, filename
@@ -0,0 +1,131 @@
+import abc
+import threading
+import tkinter as tk
+
+VIEW_FLUSH_INTERVAL_MS = 50  # Device list refresh period (20 frames per second)
+
+
+class DeviceListView(abc.ABC):
+    """
+    View-model between the device registry and a Tk list widget.
+
+    Producers (any thread) record row changes with upsert()/remove(); changes to
+    the same IP coalesce, and flush() applies one diff to the widget per UI frame
+    on the Tk thread. Subclasses adapt the diff to a Treeview or a Listbox.
+    """
+
+    def __init__(self, widget, interval_ms=VIEW_FLUSH_INTERVAL_MS):
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self._lock = threading.Lock()
+        self._pending = {}  # {ip: (values, tags)} or {ip: None} for removal; latest change wins
+        self._running = False
+
+    def upsert(self, ip, values, tags=()):
+        with self._lock:
+            self._pending[ip] = (tuple(values), tuple(tags))
+
+    def remove(self, ip):
+        with self._lock:
+            self._pending[ip] = None
+
+    def start(self):
+        """Starts the per-frame flush timer. Call from the Tk thread."""
+        self._running = True
+        self.widget.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        self._running = False
+
+    def _tick(self):
+        self.flush()
+        if self._running:
+            self.widget.after(self.interval_ms, self._tick)
+
+    def flush(self):
+        """Applies all pending changes to the widget. Runs on the Tk thread."""
+        with self._lock:
+            changes, self._pending = self._pending, {}
+
+        for ip, change in changes.items():
+            try:
+                if change is None:
+                    self._delete(ip)
+                else:
+                    self._upsert(ip, *change)
+            except tk.TclError:
+                pass  # Ignore if widget is destroyed
+
+    @abc.abstractmethod
+    def selected_ip(self):
+        """IP of the selected row, or None. Runs on the Tk thread."""
+
+    @abc.abstractmethod
+    def _upsert(self, ip, values, tags):
+        """Inserts or updates the row of ip."""
+
+    @abc.abstractmethod
+    def _delete(self, ip):
+        """Removes the row of ip if it is shown."""
+
+
+class TreeviewDeviceView(DeviceListView):
+    """Treeview rows use the IP as item id, so the IP -> row lookup is Tk's own O(1) hash."""
+
+    def selected_ip(self):
+        selection = self.widget.selection()
+        return selection[0] if selection else None
+
+    def _upsert(self, ip, values, tags):
+        if self.widget.exists(ip):
+            self.widget.item(ip, values=values, tags=tags)
+        else:
+            self.widget.insert('', 'end', ip, text="Fingerprint Sensor", values=values, tags=tags)
+
+    def _delete(self, ip):
+        if self.widget.exists(ip):
+            self.widget.delete(ip)
+
+
+class ListboxDeviceView(DeviceListView):
+    """
+    Listbox rows are positional, so the view keeps the row order and an IP -> row
+    index. Updates rewrite a single row in place instead of rebuilding the list.
+    """
+
+    def __init__(self, widget, format_row, interval_ms=VIEW_FLUSH_INTERVAL_MS):
+        super().__init__(widget, interval_ms)
+        self.format_row = format_row
+        self.rows = []   # IPs in display order
+        self.index = {}  # {ip: row}
+
+    def ip_at(self, row):
+        return self.rows[row] if 0 <= row < len(self.rows) else None
+
+    def selected_ip(self):
+        selection = self.widget.curselection()
+        return self.ip_at(selection[0]) if selection else None
+
+    def _upsert(self, ip, values, tags):
+        text = self.format_row(*values)
+        row = self.index.get(ip)
+        if row is None:
+            self.index[ip] = len(self.rows)
+            self.rows.append(ip)
+            self.widget.insert('end', text)
+            return
+
+        selected = row in self.widget.curselection()
+        self.widget.delete(row)
+        self.widget.insert(row, text)
+        if selected:
+            self.widget.selection_set(row)
+
+    def _delete(self, ip):
+        row = self.index.pop(ip, None)
+        if row is None:
+            return
+        self.widget.delete(row)
+        del self.rows[row]
+        for moved_row in range(row, len(self.rows)):
+            self.index[self.rows[moved_row]] = moved_row
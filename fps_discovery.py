@@ -0,0 +1,302 @@
+import asyncio
+import collections
+import time
+
+# Configuration
+STATUS_REPORT_PORT = 5002      # PC acts as a server on this port for device status reports
+STATUS_READ_TIMEOUT = 5.0      # Seconds a device gets to deliver its report line (and drain our reply)
+STATUS_MAX_CONNECTIONS = 256   # Concurrent report connections; extra ones are shed immediately
+STATUS_MAX_LINE = 1024         # Bytes; a report longer than this is rejected
+STATUS_BACKLOG = 512           # Kernel accept backlog, sized for bursts from the whole fleet
+BROADCAST_PORT = 5001          # UDP "ip,mac" broadcasts from v1.0 firmware
+DISCOVERY_BATCH_SIZE = 512     # Reports processed per drain pass
+DISCOVERY_MAX_PENDING = 8192   # Reports waiting for the drain task; the oldest are dropped beyond this
+DISCOVERY_STATS_WINDOW = 10.0  # Seconds of processed batches behind the rate and max queue wait of stats()
+
+
+def handle_status_message(data, source_ip, on_status, on_log):
+    """
+    Interprets one report line received on STATUS_REPORT_PORT.
+    Returns the reply to send back to the device, or None.
+    """
+    # Check 1: Handle Status Reports (STATUS|IP|MAC|Battery)
+    if data.startswith("STATUS|"):
+        parts = data.split('|')
+        # Check for the 4 expected parts: STATUS, IP, MAC, Battery
+        if len(parts) == 4:
+            _type, ip, mac, battery = parts
+            on_status(ip, mac, battery)
+        return None
+
+    # Check 2: Handle Continuous Search Results (CONTINUOUS_SUCCESS:ID or CONTINUOUS_ERROR:...)
+    if data.startswith("CONTINUOUS_"):
+        on_log(f"[{source_ip}] {data}", 'blue')
+        # Provide the acknowledgement (ACK) to unblock the device
+        return "ACK:\n"
+
+    if data == "TIME_REQUEST":
+        # Current Unix timestamp (seconds since epoch)
+        response = f"TIME_RESPONSE:{int(time.time())}\n"
+        print(f"[TIME SYNC] Responding with: {response.strip()}")
+        return response
+
+    # Log any unexpected messages for debugging
+    if data:
+        on_log(f"Received unexpected TCP message: {data}", 'orange')
+    return None
+
+
+class StatusServer:
+    """
+    asyncio TCP server for device status reports on STATUS_REPORT_PORT.
+
+    Every connection is handled concurrently on the event loop, gets a read
+    deadline, and is bounded in size, so one stalled device can no longer hold
+    up STATUS|, CONTINUOUS_ and TIME_REQUEST traffic from the rest of the fleet.
+    Callbacks are invoked on the event loop thread.
+    """
+
+    def __init__(self, on_status, on_log, host='0.0.0.0', port=STATUS_REPORT_PORT,
+                 read_timeout=STATUS_READ_TIMEOUT, max_connections=STATUS_MAX_CONNECTIONS,
+                 max_line=STATUS_MAX_LINE, backlog=STATUS_BACKLOG):
+        self.on_status = on_status
+        self.on_log = on_log
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_line = max_line
+        self.backlog = backlog
+        self.server = None
+        self.active_connections = 0
+        # Counters, read by benchmarks and the daemon
+        self.stats = {'connections': 0, 'messages': 0, 'shed': 0, 'timeouts': 0, 'errors': 0}
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port,
+            reuse_address=True, backlog=self.backlog, limit=self.max_line
+        )
+        self.on_log(f"Status Listener (TCP) started on port {self.port}", 'purple')
+        return self.server
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_report(self, reader):
+        """Reads until newline or EOF, whichever comes first (a bare report without newline is accepted)."""
+        try:
+            line = await asyncio.wait_for(reader.readuntil(b'\n'), timeout=self.read_timeout)
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        return line.decode('utf-8', errors='ignore').strip()
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        source_ip = peer[0] if peer else "unknown"
+        self.stats['connections'] += 1
+
+        # Backpressure: shed instead of queueing once the fleet exceeds our budget
+        if self.active_connections >= self.max_connections:
+            self.stats['shed'] += 1
+            writer.close()
+            return
+
+        self.active_connections += 1
+        try:
+            data = await self._read_report(reader)
+            self.stats['messages'] += 1
+            reply = handle_status_message(data, source_ip, self.on_status, self.on_log)
+            if reply:
+                writer.write(reply.encode('utf-8'))
+                await asyncio.wait_for(writer.drain(), timeout=self.read_timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+        except asyncio.LimitOverrunError:
+            self.stats['errors'] += 1
+            self.on_log(f"[{source_ip}] Status report exceeds {self.max_line} bytes. Dropped.", 'orange')
+        except Exception as e:
+            self.stats['errors'] += 1
+            self.on_log(f"Status Listener Connection Error: {e}", 'red')
+        finally:
+            self.active_connections -= 1
+            writer.close()
+
+
+class _BroadcastProtocol(asyncio.DatagramProtocol):
+    """Receives v1.0 discovery broadcasts ("ip,mac") and queues them without parsing."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        self.service.enqueue('udp', data, addr[0])
+
+    def error_received(self, exc):
+        self.service.on_log(f"UDP Error: {exc}", 'red')
+
+
+class DiscoveryService:
+    """
+    One discovery subsystem for mixed-firmware fleets, running on the asyncio loop.
+
+    It listens for UDP broadcasts on BROADCAST_PORT (v1.0 firmware) and TCP STATUS|
+    reports on STATUS_REPORT_PORT. Both transports only append to one pending queue.
+    A drain task processes the queue in batches, keeps only the latest report per MAC
+    in each batch, and calls on_device(ip, mac, battery, transport) for it; battery is
+    None for UDP reports. When a MAC shows up at a new IP, on_moved(mac, old_ip, new_ip)
+    is called first. stats() reports discovery rate and queue wait.
+    """
+
+    def __init__(self, on_device, on_log, on_moved=None, tcp=True, udp=True, host='0.0.0.0',
+                 status_port=STATUS_REPORT_PORT, broadcast_port=BROADCAST_PORT):
+        self.on_device = on_device
+        self.on_log = on_log
+        self.on_moved = on_moved
+        self.tcp = tcp
+        self.udp = udp
+        self.host = host
+        self.broadcast_port = broadcast_port
+        self.status_server = StatusServer(self._on_status, on_log, host=host, port=status_port) if tcp else None
+        self.udp_transport = None
+        self.known_macs = {}  # {mac: ip}
+        self._pending = collections.deque(maxlen=DISCOVERY_MAX_PENDING)  # (received_at, transport, payload, source_ip)
+        self._wakeup = None
+        self._drain_task = None
+        self._counters = {'tcp': 0, 'udp': 0, 'malformed': 0, 'duplicates': 0, 'devices': 0, 'dropped': 0}
+        self._dropping = False  # Queue overflowing since the last drain; logged once per overflow
+        self._wait_total = 0.0
+        self._processed = 0
+        self._started = time.monotonic()
+        # (processed at, reports, longest queue wait) per batch of the last DISCOVERY_STATS_WINDOW seconds
+        self._recent = collections.deque()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._drain_task = loop.create_task(self._drain())
+
+        if self.tcp:
+            await self.status_server.start()
+        if self.udp:
+            self.udp_transport, _protocol = await loop.create_datagram_endpoint(
+                lambda: _BroadcastProtocol(self), local_addr=(self.host, self.broadcast_port),
+                allow_broadcast=True
+            )
+            self.on_log(f"Discovery (UDP) listening on port {self.broadcast_port}", 'purple')
+
+    async def close(self):
+        if self.udp_transport:
+            self.udp_transport.close()
+        if self.status_server:
+            await self.status_server.close()
+        if self._drain_task:
+            self._drain_task.cancel()
+
+    def enqueue(self, transport, payload, source_ip):
+        """Called by the transports on the loop thread; only queues the raw report."""
+        if len(self._pending) == self._pending.maxlen:
+            # The deque drops the oldest report on append; count it so a flood is visible in stats()
+            self._counters['dropped'] += 1
+            if not self._dropping:
+                self._dropping = True
+                self.on_log(f"Discovery queue full ({self._pending.maxlen} reports); dropping the oldest.", 'orange')
+        self._pending.append((time.monotonic(), transport, payload, source_ip))
+        self._wakeup.set()
+
+    def _on_status(self, ip, mac, battery):
+        self.enqueue('tcp', (ip, mac, battery), ip)
+
+    @staticmethod
+    def _parse(transport, payload):
+        """Returns (ip, mac, battery) or None for a malformed report."""
+        if transport == 'tcp':
+            ip, mac, battery = payload
+            try:
+                battery = int(battery.strip())
+            except ValueError:
+                battery = 0
+        else:
+            message = payload.decode('utf-8', errors='ignore').strip().split(',')
+            if len(message) != 2:
+                return None
+            ip, mac = message
+            battery = None
+        return ip.strip(), mac.strip().upper(), battery
+
+    async def _drain(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._pending:
+                batch_size = min(len(self._pending), DISCOVERY_BATCH_SIZE)
+                batch = [self._pending.popleft() for _ in range(batch_size)]
+                self._process(batch)
+                self._dropping = False
+                # Let the transports run between large batches
+                await asyncio.sleep(0)
+
+    def _process(self, batch):
+        now = time.monotonic()
+        latest = {}  # {mac: (ip, battery, transport)}; later reports in the batch win
+        wait_max = 0.0
+        for received_at, transport, payload, _source_ip in batch:
+            self._counters[transport] += 1
+            wait = now - received_at
+            self._wait_total += wait
+            wait_max = max(wait_max, wait)
+            self._processed += 1
+
+            report = self._parse(transport, payload)
+            if report is None:
+                self._counters['malformed'] += 1
+                continue
+            ip, mac, battery = report
+            if mac in latest:
+                self._counters['duplicates'] += 1
+                # A TCP report carries the battery level; don't let a later UDP one erase it
+                if battery is None:
+                    battery = latest[mac][1]
+            latest[mac] = (ip, battery, transport)
+
+        self._recent.append((now, len(batch), wait_max))
+        while self._recent[0][0] < now - DISCOVERY_STATS_WINDOW:
+            self._recent.popleft()
+
+        for mac, (ip, battery, transport) in latest.items():
+            previous_ip = self.known_macs.get(mac)
+            if previous_ip is None:
+                self._counters['devices'] += 1
+            elif previous_ip != ip and self.on_moved:
+                self.on_moved(mac, previous_ip, ip)
+            self.known_macs[mac] = ip
+            try:
+                self.on_device(ip, mac, battery, transport)
+            except Exception as e:
+                self.on_log(f"Discovery callback error for {ip}: {e}", 'red')
+
+    def stats(self):
+        """
+        Snapshot of discovery counters. 'rate' (reports per second) and the max queue wait cover
+        the last DISCOVERY_STATS_WINDOW seconds; the average queue wait covers all reports. Queue
+        wait is the time reports spent in the pending queue before processing. Reading the stats
+        changes nothing, so the GUI and the daemon's /stats can both poll them.
+        """
+        now = time.monotonic()
+        since = now - DISCOVERY_STATS_WINDOW
+        # list() copies the deque in one step; the GUI calls this from the Tk thread
+        recent = [(count, wait) for processed_at, count, wait in list(self._recent) if processed_at >= since]
+        elapsed = min(DISCOVERY_STATS_WINDOW, now - self._started)
+
+        snapshot = dict(self._counters)
+        snapshot.update(
+            rate=sum(count for count, _wait in recent) / elapsed if elapsed > 0 else 0.0,
+            pending=len(self._pending),
+            queue_wait_avg_ms=(self._wait_total / self._processed * 1000) if self._processed else 0.0,
+            queue_wait_max_ms=max((wait for _count, wait in recent), default=0.0) * 1000,
+        )
+        return snapshot
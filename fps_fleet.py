@@ -0,0 +1,282 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Configuration
+TCP_PORT = 5000                    # Device is a server on this port for commands/logs
+CONTINUOUS_CONNECT_TIMEOUT = 1.0   # Seconds allowed for one connection attempt
+CONTINUOUS_BACKOFF_INITIAL = 0.5   # First reconnect delay after a failed attempt or a drop
+CONTINUOUS_BACKOFF_MAX = 30.0      # Reconnect delay ceiling for devices that stay unreachable
+DEVICE_STALE_AFTER = 60.0          # Seconds without a STATUS| report before a device is marked stale
+DEVICE_EVICT_AFTER = 600.0         # Seconds without a STATUS| report before a device is removed
+DEVICE_CACHE_FILE = "device_registry.json"  # Registry saved between runs for instant startup
+PROBE_TIMEOUT = 2.0                # Seconds allowed for the startup probe of a cached device
+
+# Device states kept by DeviceRegistry
+DEVICE_ONLINE = "online"
+DEVICE_STALE = "stale"
+DEVICE_UNVERIFIED = "unverified"   # Loaded from the cache, not confirmed since launch
+
+
+class DeviceRegistry:
+    """
+    Thread-safe table of known devices, keyed by IP.
+
+    Every STATUS| report refreshes a device's last-seen timestamp. sweep() marks
+    devices that stopped reporting as stale and evicts them after a TTL, so dead
+    sensors no longer stay in the list (and in the reader set) forever.
+    Entries: {'mac', 'battery', 'last_seen', 'state', 'template_count'}.
+
+    The table can be saved to a small JSON cache and loaded on the next launch;
+    loaded devices start as unverified until they report or answer a probe.
+    """
+
+    def __init__(self, stale_after=DEVICE_STALE_AFTER, evict_after=DEVICE_EVICT_AFTER):
+        self.stale_after = stale_after
+        self.evict_after = evict_after
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def __contains__(self, ip):
+        with self._lock:
+            return ip in self._devices
+
+    def __len__(self):
+        with self._lock:
+            return len(self._devices)
+
+    def keys(self):
+        with self._lock:
+            return list(self._devices)
+
+    def get(self, ip, default=None):
+        """Returns a copy of the device entry, or default."""
+        with self._lock:
+            info = self._devices.get(ip)
+            return dict(info) if info is not None else default
+
+    def snapshot(self):
+        with self._lock:
+            return {ip: dict(info) for ip, info in self._devices.items()}
+
+    def report(self, ip, mac, battery, now=None):
+        """
+        Records a STATUS| report (or a UDP broadcast, which has battery None and keeps the
+        last known level). Returns 'new', 'verified' (was loaded from the cache), 'revived'
+        (was stale), 'changed' (MAC or battery differs) or None when nothing visible changed.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            info = self._devices.get(ip)
+            if info is None:
+                self._devices[ip] = {'mac': mac, 'battery': battery, 'last_seen': now, 'state': DEVICE_ONLINE,
+                                     'template_count': None}
+                return 'new'
+
+            if battery is None:
+                battery = info['battery']
+            change = None
+            if info['state'] == DEVICE_UNVERIFIED:
+                change = 'verified'
+            elif info['state'] != DEVICE_ONLINE:
+                change = 'revived'
+            elif info['mac'] != mac or info['battery'] != battery:
+                change = 'changed'
+            info.update(mac=mac, battery=battery, last_seen=now, state=DEVICE_ONLINE)
+            info.pop('loaded_at', None)
+            return change
+
+    def confirm(self, ip, now=None):
+        """Marks a device as reachable (e.g. after a successful probe). Returns True if its state changed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            info = self._devices.get(ip)
+            if info is None:
+                return False
+            changed = info['state'] != DEVICE_ONLINE
+            info.update(last_seen=now, state=DEVICE_ONLINE)
+            info.pop('loaded_at', None)
+            return changed
+
+    def set_template_count(self, ip, count):
+        with self._lock:
+            if ip in self._devices:
+                self._devices[ip]['template_count'] = count
+
+    def remove(self, ip):
+        with self._lock:
+            return self._devices.pop(ip, None)
+
+    def sweep(self, now=None, keep=()):
+        """
+        Ages the table. Returns (newly stale IPs, evicted IPs).
+        Devices in keep (e.g. the one in Manage Mode) are never evicted.
+        """
+        now = time.time() if now is None else now
+        newly_stale = []
+        evicted = []
+        with self._lock:
+            for ip, info in list(self._devices.items()):
+                # Cached devices get a full TTL from the moment they were loaded
+                silent_for = now - info.get('loaded_at', info['last_seen'])
+                if silent_for >= self.evict_after and ip not in keep:
+                    del self._devices[ip]
+                    evicted.append(ip)
+                elif silent_for >= self.stale_after and info['state'] == DEVICE_ONLINE:
+                    info['state'] = DEVICE_STALE
+                    newly_stale.append(ip)
+        return newly_stale, evicted
+
+    def save(self, path=DEVICE_CACHE_FILE):
+        """Writes the registry to a JSON cache atomically (temp file + rename)."""
+        with self._lock:
+            records = [{'ip': ip, 'mac': info['mac'], 'battery': info['battery'],
+                        'last_seen': info['last_seen'], 'template_count': info.get('template_count')}
+                       for ip, info in self._devices.items()]
+
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".device_registry.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'devices': records}, f, indent=1)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def load(self, path=DEVICE_CACHE_FILE, now=None):
+        """
+        Loads cached devices as unverified (devices already known are left untouched).
+        Returns the list of IPs added. A missing or unreadable cache loads nothing.
+        """
+        now = time.time() if now is None else now
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f).get('devices', [])
+        except (OSError, ValueError, AttributeError):
+            return []
+
+        added = []
+        with self._lock:
+            for record in records:
+                try:
+                    ip = record['ip']
+                    battery = record['battery']
+                    entry = {'mac': record['mac'], 'battery': int(battery) if battery is not None else None,
+                             'last_seen': float(record['last_seen']), 'state': DEVICE_UNVERIFIED,
+                             'template_count': record.get('template_count'), 'loaded_at': now}
+                except (KeyError, TypeError, ValueError):
+                    continue  # Skip malformed records
+                if ip not in self._devices:
+                    self._devices[ip] = entry
+                    added.append(ip)
+        return added
+
+
+async def probe_device(ip, port=TCP_PORT, timeout=PROBE_TIMEOUT):
+    """Returns True if the device accepts a connection on its command port."""
+    try:
+        _reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+async def probe_devices(ips, port=TCP_PORT, timeout=PROBE_TIMEOUT):
+    """Probes all devices in parallel. Returns {ip: reachable}."""
+    ips = list(ips)
+    results = await asyncio.gather(*(probe_device(ip, port, timeout) for ip in ips))
+    return dict(zip(ips, results))
+
+
+class ContinuousReaders:
+    """
+    Keeps one reader task per unmanaged device on the shared event loop.
+
+    Each task owns its connection to TCP_PORT, waits on readline() without
+    polling and reconnects with exponential backoff, so log delivery latency does
+    not depend on how many devices are in the fleet. The task of a device that is
+    put into MANAGE mode is cancelled, which closes its connection.
+    """
+
+    def __init__(self, loop, on_log, port=TCP_PORT):
+        self.loop = loop
+        self.on_log = on_log
+        self.port = port
+        self.tasks = {}  # {ip: asyncio.Task}, only touched on the loop thread
+
+    def sync(self, ips, managed_ip=None):
+        """Starts readers for new devices and cancels the managed/removed ones. Runs on the loop."""
+        wanted = set(ips)
+        wanted.discard(managed_ip)
+
+        for ip in list(self.tasks):
+            if ip not in wanted:
+                self.tasks.pop(ip).cancel()
+                if ip == managed_ip:
+                    self.on_log(f"[{ip}] Disconnected (Selected for Manage Mode).", "gray")
+
+        for ip in wanted:
+            if ip not in self.tasks:
+                self.tasks[ip] = self.loop.create_task(self._reader(ip))
+
+    def sync_threadsafe(self, ips, managed_ip=None):
+        """Thread-safe variant of sync(), used from the Tk thread."""
+        self.loop.call_soon_threadsafe(self.sync, set(ips), managed_ip)
+
+    def stop_all(self):
+        self.sync((), None)
+
+    async def _reader(self, ip):
+        backoff = CONTINUOUS_BACKOFF_INITIAL
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(ip, self.port), timeout=CONTINUOUS_CONNECT_TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError):
+                # Failed to connect, try again later
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, CONTINUOUS_BACKOFF_MAX)
+                continue
+
+            backoff = CONTINUOUS_BACKOFF_INITIAL
+            self.on_log(f"[{ip}] Connected for Default Mode logs.", "green")
+            try:
+                await self._read_lines(ip, reader)
+            except ConnectionResetError:
+                self.on_log(f"[{ip}] Connection Reset. Retrying...", "red")
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                # ValueError: a line over the StreamReader limit
+                self.on_log(f"[{ip}] Log connection error: {str(e) or e.__class__.__name__}. Retrying...", "red")
+            except Exception as e:
+                # Anything else must not end the reader for good either
+                self.on_log(f"[{ip}] Log reader error: {e!r}. Retrying...", "red")
+            finally:
+                # Also runs on cancellation, so a device entering MANAGE mode is released at once
+                if not writer.is_closing():
+                    writer.close()
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, CONTINUOUS_BACKOFF_MAX)
+
+    async def _read_lines(self, ip, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                # Connection closed by the device
+                self.on_log(f"[{ip}] Disconnected (Server closed). Retrying...", "orange")
+                return
+
+            response = line.decode('utf-8', errors='ignore').strip()
+            if response.startswith("CONTINUOUS"):
+                # NOTE: Continuous results on PORT 5000 (the command port) come from older
+                # firmware. Current devices send them on PORT 5002 (fps_discovery.StatusServer).
+                self.on_log(f"[{ip}] (Legacy 5000 Log) {response}", "blue")
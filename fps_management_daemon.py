@@ -0,0 +1,471 @@
+"""
+Headless management daemon: the fleet logic of the management console without the GUI.
+
+It keeps discovery (TCP status reports + UDP broadcasts), the device registry and the
+continuous log readers running, and serves a small JSON API on localhost so scripts
+can list devices and run enroll, sync, backup and restore jobs.
+
+    python fps_management_daemon.py --port 8750
+
+    curl http://127.0.0.1:8750/devices
+    curl -X POST http://127.0.0.1:8750/devices/192.168.1.20/backup
+    curl -X POST -d '{"model_id": 12}' http://127.0.0.1:8750/devices/192.168.1.20/enroll
+    curl -X POST -d '{"devices": "all"}' http://127.0.0.1:8750/sync
+    curl http://127.0.0.1:8750/jobs/3
+
+    python fps_management_daemon.py --watch --autosync 192.168.1.20
+    curl -X POST -d '{"enabled": true}' http://127.0.0.1:8750/devices/192.168.1.21/autosync
+
+POST requests return 202 with the queued job(s); poll GET /jobs/<id> for the result.
+Jobs on the same device run one after another, each inside MANAGE/NORMAL mode; jobs on
+different devices run concurrently. With --watch, changed templates in the templates
+folder are pushed to the devices that opted in to auto-sync (only the changed IDs).
+The API has no authentication, so it only binds to 127.0.0.1 unless --host says otherwise.
+"""
+import argparse
+import asyncio
+import collections
+import http.server
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from fps_device_client import enroll_template, managed
+from fps_discovery import DiscoveryService
+from fps_fleet import DEVICE_CACHE_FILE, DEVICE_ONLINE, ContinuousReaders, DeviceRegistry, probe_devices
+from fps_templates import TEMPLATES_FOLDER, push_folder
+from fps_template_watcher import TemplateWatcher
+from fps_metrics import METRICS_FILE, command_metrics
+from fps_template_archive import ARCHIVE_EXTENSION, backup_device, fetch_template_list, parse_template_ids, restore_device
+
+# Configuration
+API_PORT = 8750
+BACKUP_FOLDER = "backups"
+REGISTRY_SWEEP_INTERVAL = 5.0   # Seconds between liveness sweeps of the device registry
+REGISTRY_SAVE_INTERVAL = 60.0   # Seconds between saves of the registry cache and the command metrics
+API_CALL_TIMEOUT = 10           # Seconds an API request may wait for the event loop
+JOB_HISTORY = 1000              # Finished jobs kept for GET /jobs
+AUTOSYNC_RETRY_INTERVAL = 10.0  # Seconds before a failed auto-sync is retried on the device's next report
+AUTOSYNC_RETRY_MAX = 300.0      # Upper bound of the retry delay, which doubles with every failure in a row
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+DEVICE_ACTIONS = ('enroll', 'sync', 'backup', 'restore', 'templates')
+FLEET_ACTIONS = ('sync', 'backup', 'templates')  # Actions that can be sent to several devices at once
+
+log = logging.getLogger("fps.daemon")
+LOG_LEVELS = {'red': logging.ERROR, 'orange': logging.WARNING}
+
+
+def log_message(message, color=None):
+    """on_log callback for the fps_* services (their GUI colours map to log levels)."""
+    log.log(LOG_LEVELS.get(color, logging.INFO), message)
+
+
+class ApiError(Exception):
+    """Raised by request handlers; carries the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ManagementDaemon:
+    """
+    Owns the registry, discovery, log readers and job queue. Everything runs on one
+    asyncio loop; the HTTP thread only hands requests to handle_request() on that loop.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.registry = DeviceRegistry()
+        self.discovery = DiscoveryService(self.on_device, log_message, on_moved=self.on_device_moved,
+                                          udp=not args.no_udp)
+        self.readers = None
+        self.jobs = collections.OrderedDict()  # {job id: job dict}, oldest first
+        self.job_ids = itertools.count(1)
+        self.device_locks = {}  # {ip: asyncio.Lock}; one job per device at a time
+        self.busy = set()       # IPs currently in MANAGE mode for a job
+        self.autosync = {ip: set() for ip in args.autosync}  # {ip: model IDs waiting to be pushed}
+        self.autosync_queued = {}  # {ip: id of its autosync job not started yet}
+        self.autosync_retry = {}  # {ip: (failures in a row, monotonic time of the next retry)}
+        self.watcher = TemplateWatcher(self.on_templates_changed, log_message, args.templates) if args.watch else None
+        self.tasks = []
+
+    # --- Fleet machinery ---
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.readers = ContinuousReaders(loop, log_message)
+
+        cached_ips = self.registry.load(DEVICE_CACHE_FILE)
+        if cached_ips:
+            log.info(f"Loaded {len(cached_ips)} cached devices from {DEVICE_CACHE_FILE}. Verifying...")
+            for ip, reachable in (await probe_devices(cached_ips)).items():
+                if reachable:
+                    self.registry.confirm(ip)
+
+        await self.discovery.start()
+        self.refresh_readers()
+        self.tasks.append(loop.create_task(self.housekeeping()))
+        if self.watcher:
+            await self.watcher.start()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.watcher:
+            self.watcher.close()
+        if self.readers:
+            self.readers.stop_all()
+        await self.discovery.close()
+        self.save_registry()
+        self.dump_metrics()
+
+    def on_device(self, ip, mac, battery, transport):
+        change = self.registry.report(ip, mac, battery)
+        if change == 'new':
+            log.info(f"DEVICE DISCOVERED ({transport.upper()}): {ip} ({mac})")
+            self.refresh_readers()
+        elif change in ('verified', 'revived'):
+            log.info(f"DEVICE ONLINE: {ip} ({mac})")
+        if change in ('new', 'verified', 'revived'):
+            self.queue_autosync(ip)  # Changes seen while the device was away
+        elif self.autosync.get(ip) and time.monotonic() >= self.autosync_retry.get(ip, (0, 0))[1]:
+            self.queue_autosync(ip)  # IDs left pending by a failed push
+
+    def on_device_moved(self, mac, old_ip, new_ip):
+        self.registry.remove(old_ip)
+        log.info(f"DEVICE MOVED: {mac} {old_ip} -> {new_ip}")
+        self.refresh_readers()
+
+    def refresh_readers(self):
+        """Log readers run for every known device that is not busy with a job."""
+        if self.readers:
+            self.readers.sync(set(self.registry.keys()) - self.busy)
+
+    def save_registry(self):
+        try:
+            self.registry.save(DEVICE_CACHE_FILE)
+        except OSError as e:
+            log.error(f"Could not save {DEVICE_CACHE_FILE}: {e}")
+
+    def dump_metrics(self):
+        try:
+            command_metrics.dump(self.args.metrics)
+        except OSError as e:
+            log.error(f"Could not write {self.args.metrics}: {e}")
+
+    async def housekeeping(self):
+        """Marks silent devices stale, evicts expired ones, and periodically saves the registry and metrics."""
+        last_save = time.monotonic()
+        while True:
+            await asyncio.sleep(REGISTRY_SWEEP_INTERVAL)
+            _newly_stale, evicted = self.registry.sweep(keep=self.busy)
+            for ip in evicted:
+                log.info(f"DEVICE REMOVED: {ip} - no status report for {int(self.registry.evict_after)}s.")
+            if evicted:
+                self.refresh_readers()
+            if time.monotonic() - last_save >= REGISTRY_SAVE_INTERVAL:
+                await asyncio.get_running_loop().run_in_executor(None, self.save_registry)
+                await asyncio.get_running_loop().run_in_executor(None, self.dump_metrics)
+                last_save = time.monotonic()
+
+    # --- Jobs ---
+
+    def submit(self, action, ip, params):
+        """Validates and queues an API job and returns its record. Runs on the loop."""
+        if ip not in self.registry:
+            raise ApiError(404, f"Unknown device {ip}.")
+        return self.queue(action, ip, self.prepare(action, ip, params))
+
+    def queue(self, action, ip, operation, on_finish=None):
+        """Queues operation as a job on ip. on_finish(job) is called once the job ended, whether or not MANAGE worked."""
+        job = {'id': next(self.job_ids), 'action': action, 'ip': ip, 'state': JOB_QUEUED,
+               'submitted': time.time(), 'started': None, 'finished': None, 'result': None, 'error': None}
+        self.jobs[job['id']] = job
+        while len(self.jobs) > JOB_HISTORY:
+            oldest = next(iter(self.jobs.values()))
+            if oldest['state'] in (JOB_QUEUED, JOB_RUNNING):
+                break
+            self.jobs.popitem(last=False)
+
+        asyncio.get_running_loop().create_task(self.run_job(job, operation, on_finish))
+        return job
+
+    def prepare(self, action, ip, params):
+        """Validates the parameters of a job and returns the coroutine function that performs it."""
+        if action == 'enroll':
+            try:
+                model_id = int(params['model_id'])
+            except (KeyError, TypeError, ValueError):
+                raise ApiError(400, "enroll needs a numeric 'model_id'.")
+            return lambda: self.enroll(ip, model_id)
+
+        if action == 'sync':
+            folder = params.get('folder', self.args.templates)
+            if not os.path.isdir(folder):
+                raise ApiError(400, f"Templates folder '{folder}' not found.")
+            return lambda: self.sync(ip, folder, params.get('model_ids'))
+
+        if action == 'backup':
+            info = self.registry.get(ip, {})
+            mac = info.get('mac', ip).replace(':', '')
+            path = params.get('path') or os.path.join(
+                self.args.backups, f"backup_{mac}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ARCHIVE_EXTENSION}")
+            return lambda: self.backup(ip, path, info.get('mac', ip))
+
+        if action == 'restore':
+            path = params.get('path')
+            if not path or not os.path.isfile(path):
+                raise ApiError(400, "restore needs the 'path' of an existing archive.")
+            return lambda: self.restore(ip, path, params.get('model_ids'))
+
+        if action == 'templates':
+            return lambda: self.list_templates(ip)
+
+        raise ApiError(404, f"Unknown action '{action}'.")
+
+    async def run_job(self, job, operation, on_finish=None):
+        ip = job['ip']
+        lock = self.device_locks.setdefault(ip, asyncio.Lock())
+        async with lock:
+            job.update(state=JOB_RUNNING, started=time.time())
+            self.busy.add(ip)
+            self.refresh_readers()  # Release the device's log connection before MANAGE
+            log.info(f"Job {job['id']}: {job['action']} on {ip} started.")
+            try:
+                async with managed(ip):
+                    job['result'] = await operation()
+                job['state'] = JOB_DONE
+            except Exception as e:
+                job.update(state=JOB_FAILED, error=str(e) or e.__class__.__name__)
+            finally:
+                job['finished'] = time.time()
+                self.busy.discard(ip)
+                self.refresh_readers()
+                if on_finish:
+                    on_finish(job)
+            log.info(f"Job {job['id']}: {job['action']} on {ip} {job['state']}"
+                     + (f" ({job['error']})" if job['error'] else "."))
+
+    async def enroll(self, ip, model_id):
+        responses, filename = await enroll_template(ip, model_id, self.args.templates)
+        return {'responses': responses, 'file': filename}
+
+    async def sync(self, ip, folder, model_ids=None):
+        sent, errors = await push_folder(ip, folder, model_ids)
+        return {'sent': sent, 'errors': errors}
+
+    # --- Auto-sync ---
+
+    def on_templates_changed(self, changed, removed):
+        """Watcher batch: queues the changed IDs for every device that opted in."""
+        if removed:
+            log.info(f"Templates removed from '{self.args.templates}': {removed} (not deleted on devices).")
+        if not changed:
+            return
+        for ip, pending in self.autosync.items():
+            pending.update(changed)
+            self.queue_autosync(ip)
+
+    def queue_autosync(self, ip):
+        if ip in self.registry and ip not in self.autosync_queued and self.autosync.get(ip):
+            job = self.queue('autosync', ip, lambda: self.push_pending(ip), on_finish=self.autosync_finished)
+            self.autosync_queued[ip] = job['id']
+
+    async def push_pending(self, ip):
+        """Pushes the IDs pending for ip; if that fails they stay pending for the next attempt."""
+        # Changes seen from here on queue another job
+        self.autosync_queued.pop(ip, None)
+        pending = self.autosync.get(ip, set())
+        model_ids = sorted(pending)
+        pending.difference_update(model_ids)
+        try:
+            # Files deleted since the change was seen are skipped by push_folder (reported as errors)
+            return await self.sync(ip, self.args.templates, model_ids)
+        except Exception:
+            if ip in self.autosync:
+                self.autosync[ip].update(model_ids)
+            raise
+
+    def autosync_finished(self, job):
+        """
+        Ends an autosync job, including one that failed before push_pending ran (MANAGE refused or
+        the device unreachable). After a failure the pending IDs are retried on a later report of
+        the device, after a delay that doubles with every failure in a row.
+        """
+        ip = job['ip']
+        if self.autosync_queued.get(ip) == job['id']:
+            del self.autosync_queued[ip]
+        if job['state'] == JOB_DONE:
+            self.autosync_retry.pop(ip, None)
+            return
+        if ip not in self.autosync:
+            return
+        failures = self.autosync_retry.get(ip, (0, 0))[0] + 1
+        delay = min(AUTOSYNC_RETRY_MAX, AUTOSYNC_RETRY_INTERVAL * 2 ** (failures - 1))
+        self.autosync_retry[ip] = (failures, time.monotonic() + delay)
+        log.warning(f"Auto-sync to {ip} failed ({failures} in a row); retrying in {delay:.0f}s.")
+
+    def set_autosync(self, ip, enabled):
+        if ip not in self.registry:
+            raise ApiError(404, f"Unknown device {ip}.")
+        if not self.watcher:
+            raise ApiError(400, "The daemon was started without --watch.")
+        if enabled:
+            self.autosync.setdefault(ip, set())
+        else:
+            self.autosync.pop(ip, None)
+            self.autosync_retry.pop(ip, None)
+        return {'ip': ip, 'autosync': enabled}
+
+    async def backup(self, ip, path, source):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        saved, errors = await backup_device(ip, path, source=source)
+        self.registry.set_template_count(ip, saved + len(errors))
+        return {'path': path, 'saved': saved, 'errors': errors}
+
+    async def restore(self, ip, path, model_ids=None):
+        restored, errors = await restore_device(ip, path, model_ids)
+        return {'restored': restored, 'errors': errors}
+
+    async def list_templates(self, ip):
+        model_ids = parse_template_ids(await fetch_template_list(ip))
+        self.registry.set_template_count(ip, len(model_ids))
+        return {'model_ids': model_ids}
+
+    # --- API ---
+
+    async def handle_request(self, method, path, body):
+        """Routes one API request. Runs on the loop; returns (status, JSON-serialisable payload)."""
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            raise ApiError(400, "Request body is not valid JSON.")
+        if not isinstance(params, dict):
+            raise ApiError(400, "Request body must be a JSON object.")
+
+        if method == 'GET':
+            if parts == ['devices']:
+                return 200, {'devices': [dict(info, ip=ip) for ip, info in sorted(self.registry.snapshot().items())]}
+            if parts == ['jobs']:
+                return 200, {'jobs': list(self.jobs.values())}
+            if len(parts) == 2 and parts[0] == 'jobs':
+                job = self.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+                if job is None:
+                    raise ApiError(404, f"Unknown job {parts[1]}.")
+                return 200, job
+            if parts == ['stats']:
+                states = collections.Counter(job['state'] for job in self.jobs.values())
+                return 200, {'discovery': self.discovery.stats(), 'jobs': dict(states), 'busy': sorted(self.busy)}
+            if parts == ['metrics']:
+                return 200, command_metrics.snapshot()
+            if parts == ['autosync']:
+                return 200, {'watching': bool(self.watcher),
+                             'devices': {ip: sorted(pending) for ip, pending in self.autosync.items()}}
+
+        if method == 'POST':
+            if len(parts) == 3 and parts[0] == 'devices' and parts[2] == 'autosync':
+                enabled = params.get('enabled', True)
+                if not isinstance(enabled, bool):
+                    raise ApiError(400, "'enabled' must be true or false.")
+                return 200, self.set_autosync(parts[1], enabled)
+            if len(parts) == 3 and parts[0] == 'devices' and parts[2] in DEVICE_ACTIONS:
+                return 202, self.submit(parts[2], parts[1], params)
+            if len(parts) == 1 and parts[0] in FLEET_ACTIONS:
+                ips = params.get('devices', 'all')
+                if ips != 'all' and not (isinstance(ips, list) and all(isinstance(ip, str) for ip in ips)):
+                    raise ApiError(400, "'devices' must be \"all\" or a list of device IPs.")
+                if ips == 'all':
+                    ips = sorted(ip for ip, info in self.registry.snapshot().items() if info['state'] == DEVICE_ONLINE)
+                # Validate every device before queueing anything
+                for ip in ips:
+                    if ip not in self.registry:
+                        raise ApiError(404, f"Unknown device {ip}.")
+                return 202, {'jobs': [self.submit(parts[0], ip, params) for ip in ips]}
+
+        raise ApiError(404, f"No route for {method} {path}.")
+
+
+class ApiHandler(http.server.BaseHTTPRequestHandler):
+    """Thin HTTP front end; the daemon and loop are attached to the server."""
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', errors='ignore') if length else ""
+        future = asyncio.run_coroutine_threadsafe(
+            self.server.daemon.handle_request(method, self.path, body), self.server.loop
+        )
+        try:
+            status, payload = future.result(timeout=API_CALL_TIMEOUT)
+        except ApiError as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': str(e) or e.__class__.__name__}
+
+        data = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug("API %s", format % args)
+
+
+async def run_daemon(args):
+    daemon = ManagementDaemon(args)
+    await daemon.start()
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    server.daemon = daemon
+    server.loop = asyncio.get_running_loop()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Management API listening on http://{args.host}:{args.port}")
+
+    try:
+        await asyncio.Event().wait()  # Run until interrupted
+    finally:
+        server.shutdown()
+        await daemon.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless FPS fleet management daemon with a local JSON API.")
+    parser.add_argument('--host', default="127.0.0.1", help="Address of the API (keep it local).")
+    parser.add_argument('--port', type=int, default=API_PORT, help="Port of the API.")
+    parser.add_argument('--templates', default=TEMPLATES_FOLDER, help="Folder for enrolled and synced templates.")
+    parser.add_argument('--backups', default=BACKUP_FOLDER, help="Folder for backup archives.")
+    parser.add_argument('--metrics', default=METRICS_FILE, help="JSON file for the periodic command metrics dump.")
+    parser.add_argument('--watch', action='store_true', help="Watch the templates folder for changed templates.")
+    parser.add_argument('--autosync', action='append', default=[], metavar='IP',
+                        help="Push changed templates to this device (with --watch; repeatable).")
+    parser.add_argument('--no-udp', action='store_true', help="Only discover devices through TCP status reports.")
+    parser.add_argument('--verbose', action='store_true', help="Also log every API request.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(run_daemon(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,249 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from fps_fleet import TCP_PORT
+
+METRICS_FILE = "fps_command_metrics.json"
+CONNECT_TIMEOUT = 5
+# Upper bounds of the latency buckets in milliseconds; the last bucket is open ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"        # The device refused or the response was invalid
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_REFUSED = "refused"    # Connection refused: device offline or port closed
+OUTCOME_FAILED = "failed"      # Any other network error
+OUTCOME_CANCELLED = "cancelled"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (milliseconds). Percentiles are bucket upper bounds."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        if not self.count:
+            return {'count': 0}
+        percentiles = {name: round(self.percentile(fraction), 3)
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))}
+        buckets = {}
+        for index, count in enumerate(self.counts):
+            if count:
+                label = f"<={self.bounds[index]}" if index < len(self.bounds) else f">{self.bounds[-1]}"
+                buckets[label] = count
+        return dict(count=self.count, mean=round(self.total / self.count, 3), min=round(self.min, 3),
+                    max=round(self.max, 3), buckets=buckets, **percentiles)
+
+
+class CommandStats:
+    """Everything recorded for one (device, command) pair."""
+
+    def __init__(self):
+        self.outcomes = collections.Counter()
+        self.connect_ms = Histogram()
+        self.first_response_ms = Histogram()
+        self.total_ms = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.last_outcome = None
+        self.last_error = None
+
+    def snapshot(self):
+        return {'count': sum(self.outcomes.values()), 'outcomes': dict(self.outcomes),
+                'last_outcome': self.last_outcome, 'last_error': self.last_error,
+                'bytes_sent': self.bytes_sent, 'bytes_received': self.bytes_received,
+                'connect_ms': self.connect_ms.snapshot(), 'first_response_ms': self.first_response_ms.snapshot(),
+                'total_ms': self.total_ms.snapshot()}
+
+
+class _Meter:
+    """Timing and byte counts of one session."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.connected = None
+        self.first_response = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class _MeteredReader:
+    """StreamReader proxy that notes the first response byte and counts received bytes."""
+
+    def __init__(self, reader, meter):
+        self._reader = reader
+        self._meter = meter
+
+    def _count(self, data):
+        if data:
+            if self._meter.first_response is None:
+                self._meter.first_response = time.monotonic()
+            self._meter.bytes_received += len(data)
+        return data
+
+    async def read(self, n=-1):
+        return self._count(await self._reader.read(n))
+
+    async def readline(self):
+        return self._count(await self._reader.readline())
+
+    async def readuntil(self, separator=b'\n'):
+        return self._count(await self._reader.readuntil(separator))
+
+    async def readexactly(self, n):
+        return self._count(await self._reader.readexactly(n))
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+
+class _MeteredWriter:
+    """StreamWriter proxy that counts sent bytes."""
+
+    def __init__(self, writer, meter):
+        self._writer = writer
+        self._meter = meter
+
+    def write(self, data):
+        self._meter.bytes_sent += len(data)
+        self._writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._writer, name)
+
+
+class CommandMetrics:
+    """
+    In-memory latency/throughput statistics of device commands, per device and command.
+    Thread-safe: sessions record on the event loop, the GUI and the daemon read snapshots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # {(ip, command): CommandStats}
+
+    def record(self, ip, command, outcome, connect_s=None, first_response_s=None, total_s=None,
+               bytes_sent=0, bytes_received=0, error=None):
+        with self._lock:
+            stats = self._stats.get((ip, command))
+            if stats is None:
+                stats = self._stats[(ip, command)] = CommandStats()
+            stats.outcomes[outcome] += 1
+            stats.last_outcome = outcome
+            stats.last_error = error
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            if connect_s is not None:
+                stats.connect_ms.add(connect_s * 1000)
+            if first_response_s is not None:
+                stats.first_response_ms.add(first_response_s * 1000)
+            if total_s is not None:
+                stats.total_ms.add(total_s * 1000)
+
+    @contextlib.asynccontextmanager
+    async def session(self, ip, command, port=TCP_PORT, timeout=CONNECT_TIMEOUT):
+        """
+        Opens a command session and yields metered (reader, writer); the connection is closed on exit.
+        Records connect time, time to the first response byte, total duration, bytes and outcome
+        under (ip, command). Exceptions are classified into an outcome and re-raised.
+        """
+        meter = _Meter()
+        outcome = OUTCOME_OK
+        error = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+            meter.connected = time.monotonic()
+            try:
+                yield _MeteredReader(reader, meter), _MeteredWriter(writer, meter)
+            finally:
+                writer.close()
+        except asyncio.TimeoutError:
+            outcome, error = OUTCOME_TIMEOUT, "Timeout"
+            raise
+        except ConnectionRefusedError as e:
+            outcome, error = OUTCOME_REFUSED, str(e)
+            raise
+        except OSError as e:
+            outcome, error = OUTCOME_FAILED, str(e)
+            raise
+        except asyncio.CancelledError:
+            outcome = OUTCOME_CANCELLED
+            raise
+        except Exception as e:
+            outcome, error = OUTCOME_ERROR, str(e)
+            raise
+        finally:
+            ended = time.monotonic()
+            self.record(
+                ip, command, outcome,
+                connect_s=meter.connected - meter.started if meter.connected else None,
+                first_response_s=meter.first_response - meter.connected if meter.first_response else None,
+                total_s=ended - meter.started,
+                bytes_sent=meter.bytes_sent, bytes_received=meter.bytes_received, error=error,
+            )
+
+    def snapshot(self):
+        """JSON-serialisable view: {'generated': unix time, 'devices': {ip: {command: stats}}}."""
+        with self._lock:
+            devices = {}
+            for (ip, command), stats in sorted(self._stats.items()):
+                devices.setdefault(ip, {})[command] = stats.snapshot()
+        return {'generated': time.time(), 'devices': devices}
+
+    def slowest(self, count=5, command=None):
+        """(ip, command, p90 total ms) of the slowest device commands, slowest first."""
+        with self._lock:
+            rows = [(ip, cmd, stats.total_ms.percentile(0.9)) for (ip, cmd), stats in self._stats.items()
+                    if stats.total_ms.count and (command is None or cmd == command)]
+        return sorted(rows, key=lambda row: row[2], reverse=True)[:count]
+
+    def dump(self, path=METRICS_FILE):
+        """Writes snapshot() as JSON atomically (temp file + rename)."""
+        snapshot = self.snapshot()
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".command_metrics.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=1)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+
+# Shared by every command helper of the process (GUI or daemon)
+command_metrics = CommandMetrics()
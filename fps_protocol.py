@@ -0,0 +1,133 @@
+import asyncio
+import collections
+
+RESPONSE_TIMEOUT = 5      # Seconds to wait for each response line
+READ_CHUNK = 4096         # Bytes requested from the socket per read
+MAX_LINE = 4096           # A response line longer than this is a framing error
+
+LIST_COMPLETE = "OK: List templates command complete."
+
+# Kinds of response lines
+LINE_SUCCESS = "success"  # SUCCESS: ... (command finished)
+LINE_ERROR = "error"      # ERROR: ... (command failed)
+LINE_OK = "ok"            # OK: ... (acknowledgement, e.g. before a template transfer)
+LINE_INFO = "info"        # INFO: ... (progress, e.g. enrollment steps)
+LINE_TEXT = "text"        # Anything else (e.g. 'Template ID: 5' in a LIST response)
+
+Line = collections.namedtuple('Line', 'kind text')
+
+
+class ProtocolError(Exception):
+    """Raised when the device sends something that cannot be framed (e.g. an endless line)."""
+
+
+def classify(text):
+    """Returns the Line for one decoded response line."""
+    for prefix, kind in (("SUCCESS", LINE_SUCCESS), ("ERROR", LINE_ERROR), ("OK", LINE_OK), ("INFO", LINE_INFO)):
+        if text.startswith(prefix):
+            return Line(kind, text)
+    return Line(LINE_TEXT, text)
+
+
+def ends_on_result(line):
+    """Most commands finish with one SUCCESS or ERROR line, after any number of INFO lines."""
+    return line.kind in (LINE_SUCCESS, LINE_ERROR)
+
+
+def ends_on_ack(line):
+    """Template transfers are acknowledged with one line before the binary part (OK) or instead of it."""
+    return line.kind in (LINE_OK, LINE_SUCCESS, LINE_ERROR)
+
+
+def ends_list(line):
+    return line.kind == LINE_ERROR or line.text.startswith(LIST_COMPLETE)
+
+
+# When the response to each command is complete. Commands not listed end on SUCCESS/ERROR.
+RESPONSE_RULES = {
+    "LIST": ends_list,
+    "UPLOAD_TEMPLATE": ends_on_ack,     # Followed by the template bytes after OK
+    "DOWNLOAD_TEMPLATE": ends_on_ack,   # The template is sent after OK; the device then answers SUCCESS/ERROR
+}
+
+
+class ResponseStream:
+    """
+    Frames the responses of one command session.
+
+    Reads the socket in chunks and cuts lines out of its own buffer, so a response
+    that arrives in one segment is framed without another read per line. Binary
+    payloads (templates) are taken from the same buffer with readexactly(), so a
+    session must use one ResponseStream for all of its reads (see of()).
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self._buffer = bytearray()
+        self._eof = False
+
+    @classmethod
+    def of(cls, reader):
+        """Returns reader itself if it already is a ResponseStream, otherwise wraps it."""
+        return reader if isinstance(reader, cls) else cls(reader)
+
+    async def _fill(self, size=READ_CHUNK):
+        data = await self.reader.read(size)
+        if data:
+            self._buffer += data
+        else:
+            self._eof = True
+
+    async def readline(self):
+        """StreamReader-compatible: one line including its newline, the rest at EOF, or b''."""
+        while True:
+            end = self._buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self._buffer[:end + 1])
+                del self._buffer[:end + 1]
+                return line
+            if self._eof:
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                return line
+            if len(self._buffer) > MAX_LINE:
+                raise ProtocolError(f"Response line exceeds {MAX_LINE} bytes.")
+            await self._fill()
+
+    async def readexactly(self, n):
+        """StreamReader-compatible: exactly n bytes (buffered bytes first), IncompleteReadError at EOF."""
+        while len(self._buffer) < n:
+            if self._eof:
+                partial = bytes(self._buffer)
+                self._buffer.clear()
+                raise asyncio.IncompleteReadError(partial, n)
+            await self._fill(max(READ_CHUNK, n - len(self._buffer)))
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def read_line(self, timeout=RESPONSE_TIMEOUT):
+        """Returns the next non-empty Line, or None once the device closed the session."""
+        while True:
+            raw = await asyncio.wait_for(self.readline(), timeout=timeout)
+            if not raw:
+                return None
+            text = raw.decode('utf-8', errors='ignore').strip()
+            if text:
+                return classify(text)
+
+    async def read_response(self, command, timeout=RESPONSE_TIMEOUT, until=None):
+        """
+        Reads the response to command until its terminator rule (RESPONSE_RULES, or until) is met
+        or the device closes the session. Returns the Lines; timeout applies to each line.
+        """
+        ends = until or RESPONSE_RULES.get(command, ends_on_result)
+        lines = []
+        while True:
+            line = await self.read_line(timeout)
+            if line is None:
+                break
+            lines.append(line)
+            if ends(line):
+                break
+        return lines
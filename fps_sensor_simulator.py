@@ -0,0 +1,308 @@
+"""
+Local simulator for FPS sensors, used to exercise and load-test the management utility.
+
+Every virtual device binds the command port (TCP_PORT, 5000) on its own address and
+pushes STATUS|ip|mac|battery, CONTINUOUS_* and TIME_REQUEST traffic to the status
+port (5002) of the management PC.
+
+    python fps_sensor_simulator.py --devices 20 --server 127.0.0.1
+    python fps_sensor_simulator.py --benchmark --fleet-sizes 1,10,50,200
+
+On Linux every 127.x.y.z address reaches the loopback interface, so fleets can use
+127.0.0.2, 127.0.0.3, ... without configuration. On other systems add alias IPs to
+an interface first and pass the first one with --base-ip.
+"""
+import argparse
+import asyncio
+import ipaddress
+import os
+import random
+import statistics
+import time
+
+from fps_discovery import STATUS_REPORT_PORT, StatusServer
+from fps_fleet import TCP_PORT
+from fps_protocol import LIST_COMPLETE
+from fps_templates import TEMPLATE_SIZE, TemplateError, build_template, request_template, validate_template
+from fps_template_archive import list_template_ids
+
+ENROLL_STEPS = ("INFO: Place finger on sensor.", "INFO: Remove finger.", "INFO: Place same finger again.")
+
+
+class VirtualSensor:
+    """One simulated sensor: command server on (ip, TCP_PORT) plus periodic pushes to the status port."""
+
+    def __init__(self, index, ip, args):
+        self.index = index
+        self.ip = ip
+        self.mac = f"02:46:50:53:{(index >> 8) & 0xFF:02X}:{index & 0xFF:02X}"
+        self.args = args
+        self.mode = "NORMAL"
+        self.battery = random.randint(20, 100)
+        self.templates = {model_id: build_template(os.urandom(random.randint(400, 700)))
+                          for model_id in range(1, args.templates + 1)}
+        self.server = None
+        self.tasks = []
+        self.stats = {'commands': 0, 'status_sent': 0, 'continuous_sent': 0, 'push_errors': 0}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_session, self.ip, self.args.command_port)
+        if self.args.server:
+            self.tasks.append(asyncio.create_task(self.status_loop()))
+            if self.args.continuous_rate > 0:
+                self.tasks.append(asyncio.create_task(self.continuous_loop()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def respond(self, writer, *lines):
+        """Writes response lines after the configured device latency."""
+        delay = self.args.latency + random.uniform(0, self.args.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        writer.write("".join(f"{line}\n" for line in lines).encode('utf-8'))
+        await writer.drain()
+
+    # --- Command port (5000) ---
+
+    async def handle_session(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode('utf-8', errors='ignore').strip().partition(',')
+                self.stats['commands'] += 1
+                await self.handle_command(command, argument, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_command(self, command, argument, reader, writer):
+        model_id = int(argument) if argument.isdigit() else None
+
+        if command == "MANAGE":
+            self.mode = "MANAGE"
+            await self.respond(writer, "SUCCESS: Manage mode enabled.")
+        elif command == "NORMAL":
+            self.mode = "NORMAL"
+            await self.respond(writer, "SUCCESS: Normal mode enabled.")
+        elif command == "ENROLL" and model_id is not None:
+            for step in ENROLL_STEPS:
+                await self.respond(writer, step)
+            self.templates[model_id] = build_template(os.urandom(random.randint(400, 700)))
+            await self.respond(writer, f"SUCCESS: Enrolled ModelID {model_id}.")
+        elif command == "SEARCH":
+            if self.templates:
+                await self.respond(writer, f"SUCCESS: Match found at ID {random.choice(list(self.templates))}.")
+            else:
+                await self.respond(writer, "ERROR: No match found.")
+        elif command == "LIST":
+            lines = [f"INFO: {len(self.templates)} templates stored."]
+            lines += [f"Template ID: {stored_id}" for stored_id in sorted(self.templates)]
+            await self.respond(writer, *lines, LIST_COMPLETE)
+        elif command == "DELETE" and model_id is not None:
+            if self.templates.pop(model_id, None) is not None:
+                await self.respond(writer, f"SUCCESS: Deleted ModelID {model_id}.")
+            else:
+                await self.respond(writer, f"ERROR: ModelID {model_id} not found.")
+        elif command == "EMPTY":
+            self.templates.clear()
+            await self.respond(writer, "SUCCESS: Device emptied.")
+        elif command == "UPLOAD_TEMPLATE" and model_id is not None:
+            if model_id in self.templates:
+                await self.respond(writer, "OK: File transfer commencing.")
+                writer.write(self.templates[model_id])
+                await writer.drain()
+            else:
+                await self.respond(writer, f"ERROR: Template {model_id} not found.")
+        elif command == "DOWNLOAD_TEMPLATE" and model_id is not None:
+            await self.respond(writer, "OK: Ready to receive template.")
+            data = await asyncio.wait_for(reader.readexactly(TEMPLATE_SIZE), timeout=15)
+            try:
+                validate_template(data)
+            except TemplateError as e:
+                await self.respond(writer, f"ERROR: {e}")
+                return
+            self.templates[model_id] = data
+            await self.respond(writer, f"SUCCESS: Template {model_id} stored.")
+        else:
+            await self.respond(writer, f"ERROR: Unknown command '{command}'.")
+
+    # --- Status port (5002) ---
+
+    async def push(self, message, expect_reply=False):
+        """Sends one report the way the firmware does: a short-lived connection per message."""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.args.server, self.args.status_port, local_addr=(self.ip, 0)),
+                timeout=5
+            )
+            try:
+                writer.write(f"{message}\n".encode('utf-8'))
+                await writer.drain()
+                if expect_reply:
+                    await asyncio.wait_for(reader.readline(), timeout=5)
+            finally:
+                writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            self.stats['push_errors'] += 1
+            return False
+
+    async def status_loop(self):
+        await self.push("TIME_REQUEST", expect_reply=True)
+        # Spread the fleet over one interval so reports do not arrive in lock step
+        await asyncio.sleep(random.uniform(0, self.args.status_interval))
+        while True:
+            if random.random() < 0.1:
+                self.battery = max(0, self.battery - 1)
+            if await self.push(f"STATUS|{self.ip}|{self.mac}|{self.battery}"):
+                self.stats['status_sent'] += 1
+            await asyncio.sleep(self.args.status_interval)
+
+    async def continuous_loop(self):
+        while True:
+            await asyncio.sleep(random.expovariate(self.args.continuous_rate))
+            if self.mode != "NORMAL":
+                continue
+            if self.templates and random.random() < 0.8:
+                message = f"CONTINUOUS_SUCCESS:{random.choice(list(self.templates))}"
+            else:
+                message = "CONTINUOUS_ERROR:No match"
+            if await self.push(message, expect_reply=True):
+                self.stats['continuous_sent'] += 1
+
+
+def fleet_addresses(base_ip, count):
+    base = ipaddress.ip_address(base_ip)
+    return [str(base + offset) for offset in range(count)]
+
+
+async def start_fleet(args, count):
+    sensors = [VirtualSensor(index, ip, args) for index, ip in enumerate(fleet_addresses(args.base_ip, count))]
+    await asyncio.gather(*(sensor.start() for sensor in sensors))
+    return sensors
+
+
+async def stop_fleet(sensors):
+    await asyncio.gather(*(sensor.stop() for sensor in sensors))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def timed_command(ip, port, operation):
+    """Runs one command on a fresh connection (as the GUI does) and returns its latency in ms."""
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=5)
+    try:
+        await operation(reader, writer)
+    finally:
+        writer.close()
+    return (time.perf_counter() - started) * 1000
+
+
+async def measure_commands(sensors, port):
+    """LIST + UPLOAD_TEMPLATE against every device concurrently. Returns {command: [latency ms]}."""
+    latencies = {'LIST': [], 'UPLOAD_TEMPLATE': []}
+
+    async def exercise(sensor):
+        latencies['LIST'].append(await timed_command(sensor.ip, port, list_template_ids))
+        model_id = next(iter(sensor.templates), None)
+        if model_id is not None:
+            buffer = bytearray(TEMPLATE_SIZE)
+            latencies['UPLOAD_TEMPLATE'].append(await timed_command(
+                sensor.ip, port, lambda reader, writer: request_template(reader, writer, model_id, buffer)))
+
+    await asyncio.gather(*(exercise(sensor) for sensor in sensors))
+    return latencies
+
+
+async def run_benchmark(args):
+    """Measures status throughput and command latency of the management utility's own server/client code."""
+    reports = []
+    status_server = StatusServer(lambda ip, mac, battery: reports.append(time.perf_counter()),
+                                 lambda message, color: None, host=args.server, port=args.status_port)
+    await status_server.start()
+
+    print(f"{'devices':>8} {'reports/s':>10} {'shed':>6} {'push err':>9} "
+          f"{'LIST p50':>9} {'LIST p95':>9} {'UPLOAD p50':>11} {'UPLOAD p95':>11}  (ms)")
+    try:
+        for count in args.fleet_sizes:
+            reports.clear()
+            shed_before = status_server.stats['shed']
+            sensors = await start_fleet(args, count)
+            try:
+                await asyncio.sleep(args.status_interval)  # let the staggered fleet ramp up
+                window_start = time.perf_counter()
+                first = len(reports)
+                await asyncio.sleep(args.duration)
+                throughput = (len(reports) - first) / (time.perf_counter() - window_start)
+                latencies = await measure_commands(sensors, args.command_port)
+            finally:
+                await stop_fleet(sensors)
+
+            push_errors = sum(sensor.stats['push_errors'] for sensor in sensors)
+            cells = []
+            for command in ('LIST', 'UPLOAD_TEMPLATE'):
+                samples = latencies[command] or [float('nan')]
+                cells.append(f"{statistics.median(samples):>{9 if command == 'LIST' else 11}.1f}")
+                cells.append(f"{percentile(samples, 0.95):>{9 if command == 'LIST' else 11}.1f}")
+            print(f"{count:>8} {throughput:>10.1f} {status_server.stats['shed'] - shed_before:>6} "
+                  f"{push_errors:>9} " + " ".join(cells))
+    finally:
+        await status_server.close()
+
+
+async def run_fleet(args):
+    sensors = await start_fleet(args, args.devices)
+    print(f"{len(sensors)} virtual sensors listening on {sensors[0].ip}..{sensors[-1].ip}:{args.command_port}"
+          + (f", reporting to {args.server}:{args.status_port}" if args.server else ""))
+    try:
+        while True:
+            await asyncio.sleep(10)
+            totals = {key: sum(sensor.stats[key] for sensor in sensors) for key in sensors[0].stats}
+            print(f"[{time.strftime('%H:%M:%S')}] {totals}")
+    finally:
+        await stop_fleet(sensors)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulated FPS sensors for the management utility.")
+    parser.add_argument('--devices', type=int, default=10, help="Number of virtual sensors (fleet mode).")
+    parser.add_argument('--base-ip', default="127.0.0.2", help="Address of the first sensor; the rest follow.")
+    parser.add_argument('--server', default=None,
+                        help="Management PC address for status traffic (benchmark default: 127.0.0.1).")
+    parser.add_argument('--command-port', type=int, default=TCP_PORT)
+    parser.add_argument('--status-port', type=int, default=STATUS_REPORT_PORT)
+    parser.add_argument('--status-interval', type=float, default=1.0, help="Seconds between STATUS reports.")
+    parser.add_argument('--continuous-rate', type=float, default=0.2,
+                        help="CONTINUOUS_* results per second per sensor (0 disables).")
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds before each response line.")
+    parser.add_argument('--jitter', type=float, default=0.005, help="Extra random latency, in seconds.")
+    parser.add_argument('--templates', type=int, default=5, help="Templates stored per sensor at start.")
+    parser.add_argument('--benchmark', action='store_true', help="Measure throughput/latency as the fleet grows.")
+    parser.add_argument('--fleet-sizes', default="1,10,50,100",
+                        help="Comma separated fleet sizes for --benchmark.")
+    parser.add_argument('--duration', type=float, default=5.0, help="Measurement window per fleet size.")
+    args = parser.parse_args()
+    args.fleet_sizes = [int(size) for size in args.fleet_sizes.split(',') if size]
+    if args.benchmark and not args.server:
+        args.server = "127.0.0.1"
+    return args
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    try:
+        asyncio.run(run_benchmark(arguments) if arguments.benchmark else run_fleet(arguments))
+    except KeyboardInterrupt:
+        pass
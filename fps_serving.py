@@ -0,0 +1,92 @@
+"""
+Serving modes for the Flask servers (ByteByByte_Matching_With_Battery.py, FP_Server_6.py).
+
+    development  Flask's built-in server (app.run), as before
+    waitress     production WSGI server, one process with a pool of worker threads; runs on Windows
+    gunicorn     production WSGI server with worker processes (Linux/macOS only)
+
+Every option can also be set through the environment, <PREFIX>_<OPTION> (e.g. MATCHER_SERVER=gunicorn,
+MATCHER_WORKERS=4); command line arguments win. waitress and gunicorn are optional dependencies
+(pip install waitress / pip install gunicorn) and only imported when selected.
+"""
+import os
+
+SERVERS = ('development', 'waitress', 'gunicorn')
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_WORKERS = 2      # gunicorn worker processes
+DEFAULT_THREADS = 8      # Threads per process (waitress, gunicorn gthread workers)
+DEFAULT_TIMEOUT = 30     # Seconds a request may take (gunicorn) / a connection may stay silent mid-request (waitress)
+DEFAULT_KEEPALIVE = 5    # Seconds an idle keep-alive connection is kept open
+
+
+def add_arguments(parser, port, env_prefix, servers=SERVERS):
+    """Adds --server/--host/--port/--workers/--threads/--timeout/--keepalive with <env_prefix>_* defaults."""
+    def env(name, default):
+        return os.environ.get(f"{env_prefix}_{name}", default)
+
+    group = parser.add_argument_group("serving")
+    group.add_argument('--server', choices=servers, default=env('SERVER', 'development'),
+                       help=f"WSGI server (env {env_prefix}_SERVER).")
+    group.add_argument('--host', default=env('HOST', DEFAULT_HOST))
+    group.add_argument('--port', type=int, default=env('PORT', port))
+    if 'gunicorn' in servers:
+        group.add_argument('--workers', type=int, default=env('WORKERS', DEFAULT_WORKERS),
+                           help="Worker processes (gunicorn).")
+    group.add_argument('--threads', type=int, default=env('THREADS', DEFAULT_THREADS),
+                       help="Worker threads per process (waitress, gunicorn).")
+    group.add_argument('--timeout', type=int, default=env('TIMEOUT', DEFAULT_TIMEOUT),
+                       help="Request timeout in seconds.")
+    group.add_argument('--keepalive', type=int, default=env('KEEPALIVE', DEFAULT_KEEPALIVE),
+                       help="Idle keep-alive timeout in seconds (gunicorn).")
+
+
+def describe(args):
+    if args.server == 'gunicorn':
+        return f"gunicorn, {args.workers} workers x {args.threads} threads on {args.host}:{args.port}"
+    if args.server == 'waitress':
+        return f"waitress, {args.threads} threads on {args.host}:{args.port}"
+    return f"development server on {args.host}:{args.port}"
+
+
+def serve(app, args):
+    """Runs app with the server chosen in args (see add_arguments); blocks until it stops."""
+    if args.server == 'waitress':
+        try:
+            import waitress
+        except ImportError:
+            raise SystemExit("waitress is not installed (pip install waitress).")
+        # HTTP/1.1 keep-alive is always on; channel_timeout closes connections silent for longer
+        waitress.serve(app, host=args.host, port=args.port, threads=args.threads,
+                       channel_timeout=args.timeout)
+    elif args.server == 'gunicorn':
+        _serve_gunicorn(app, args)
+    else:
+        app.run(host=args.host, port=args.port)
+
+
+def _serve_gunicorn(app, args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("gunicorn is not installed (pip install gunicorn); it does not run on Windows, use waitress there.")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f"{args.host}:{args.port}",
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread' if args.threads > 1 else 'sync',
+                'timeout': args.timeout,
+                'keepalive': args.keepalive,
+                # The app is imported once in the master and forked, so memory-mapped data
+                # loaded at startup is shared by all workers
+                'preload_app': True,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
@@ -0,0 +1,197 @@
+import asyncio
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import zlib
+
+from fps_fleet import TCP_PORT
+from fps_metrics import command_metrics
+from fps_protocol import LINE_ERROR, ResponseStream
+from fps_templates import TemplateError, request_templates, send_templates
+
+# Archive layout (little endian):
+#   header  : magic, version, reserved, template count, created (unix time), source (device MAC/IP)
+#   index   : one entry per template -> model id, absolute offset, length, CRC32
+#   data    : the raw 1668-byte templates, back to back, in index order
+ARCHIVE_MAGIC = b'FPSTARC1'
+ARCHIVE_VERSION = 1
+ARCHIVE_EXTENSION = ".fpsarc"
+HEADER_STRUCT = struct.Struct('<8sHHIQ32s')
+INDEX_ENTRY_STRUCT = struct.Struct('<IQII')
+
+LIST_TIMEOUT = 5
+LIST_ID_RE = re.compile(r"\bID\s*[:#=]?\s*#?\s*(\d+)", re.IGNORECASE)
+
+
+class ArchiveError(Exception):
+    """Raised for unreadable archives and for templates failing their checksum."""
+
+
+def write_archive(path, templates, source=""):
+    """
+    Writes {model_id: template bytes} as one indexed archive, atomically (temp file + rename).
+    Returns the number of templates written.
+    """
+    model_ids = sorted(templates)
+    data_offset = HEADER_STRUCT.size + len(model_ids) * INDEX_ENTRY_STRUCT.size
+
+    index = bytearray()
+    offset = data_offset
+    for model_id in model_ids:
+        data = templates[model_id]
+        index += INDEX_ENTRY_STRUCT.pack(model_id, offset, len(data), zlib.crc32(data))
+        offset += len(data)
+
+    header = HEADER_STRUCT.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, len(model_ids), int(time.time()),
+                                source.encode('utf-8')[:32])
+
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=".backup.", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(index)
+            for model_id in model_ids:
+                f.write(templates[model_id])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return len(model_ids)
+
+
+class TemplateArchive:
+    """
+    Read-only, memory-mapped view of a template archive.
+    get() returns memoryview slices of the mapping, so restores stream straight from the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ArchiveError(f"{path}: empty file.")
+        self._view = memoryview(self._map)
+
+        try:
+            magic, version, _reserved, count, created, source = HEADER_STRUCT.unpack_from(self._map, 0)
+        except struct.error:
+            self.close()
+            raise ArchiveError(f"{path}: truncated header.")
+        if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+            self.close()
+            raise ArchiveError(f"{path}: not a template archive (version {version}).")
+
+        self.created = created
+        self.source = source.rstrip(b'\x00').decode('utf-8', errors='ignore')
+        self.index = {}  # {model_id: (offset, length, crc32)}
+        for position in range(count):
+            entry_offset = HEADER_STRUCT.size + position * INDEX_ENTRY_STRUCT.size
+            model_id, offset, length, crc = INDEX_ENTRY_STRUCT.unpack_from(self._map, entry_offset)
+            if offset + length > len(self._map):
+                self.close()
+                raise ArchiveError(f"{path}: template {model_id} lies outside the file.")
+            self.index[model_id] = (offset, length, crc)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def ids(self):
+        return sorted(self.index)
+
+    def get(self, model_id, verify=True):
+        offset, length, crc = self.index[model_id]
+        data = self._view[offset:offset + length]
+        if verify and zlib.crc32(data) != crc:
+            raise ArchiveError(f"Template {model_id}: checksum mismatch.")
+        return data
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # A slice is still referenced (e.g. by a transport); the mapping goes with it
+        self._file.close()
+
+
+def parse_template_ids(lines):
+    """Extracts model IDs from the LIST response lines (e.g. 'Template ID: 5')."""
+    model_ids = []
+    for line in lines:
+        if line.startswith("OK") or line.startswith("ERROR"):
+            continue
+        for match in LIST_ID_RE.finditer(line):
+            model_ids.append(int(match.group(1)))
+    return sorted(set(model_ids))
+
+
+async def read_template_list(reader, writer):
+    """Sends LIST on an open session and returns the response lines up to the completion line."""
+    writer.write(b"LIST\n")
+    await writer.drain()
+
+    lines = await ResponseStream.of(reader).read_response("LIST", LIST_TIMEOUT)
+    if lines and lines[-1].kind == LINE_ERROR:
+        raise TemplateError(lines[-1].text)
+    return [line.text for line in lines]
+
+
+async def list_template_ids(reader, writer):
+    """Sends LIST on an open session and returns the model IDs stored on the sensor."""
+    return parse_template_ids(await read_template_list(reader, writer))
+
+
+async def fetch_template_list(ip, port=TCP_PORT):
+    """LIST over a session of its own. Returns the response lines."""
+    async with command_metrics.session(ip, "LIST", port) as (reader, writer):
+        return await read_template_list(reader, writer)
+
+
+async def backup_device(ip, path, source="", port=TCP_PORT):
+    """
+    Pulls every template of a device over one session and writes them to a single archive.
+    Returns (number of templates saved, {model_id: error message}).
+    """
+    async with command_metrics.session(ip, "BACKUP", port) as (reader, writer):
+        stream = ResponseStream(reader)
+        model_ids = await list_template_ids(stream, writer)
+        _buffer, templates, errors = await request_templates(stream, writer, model_ids)
+
+    saved = await asyncio.get_running_loop().run_in_executor(
+        None, write_archive, path, templates, source or ip
+    )
+    return saved, errors
+
+
+async def restore_device(ip, path, model_ids=None, port=TCP_PORT):
+    """
+    Streams templates from a memory-mapped archive to a device with DOWNLOAD_TEMPLATE, see send_templates().
+    Returns (number of templates restored, {model_id: error message}).
+    """
+    with TemplateArchive(path) as archive:
+        def load(model_id):
+            try:
+                # Zero-copy: the memoryview into the mapping is handed straight to the transport
+                return archive.get(model_id)
+            except (KeyError, ArchiveError) as e:
+                raise TemplateError(f"Not restorable from archive: {e}")
+
+        return await send_templates(ip, "RESTORE", model_ids if model_ids is not None else archive.ids(), load, port)
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from fps_templates import TEMPLATES_FOLDER, TEMPLATE_NAME_RE
+
+WATCH_POLL_INTERVAL = 1.0   # Seconds between scans of the templates folder
+WATCH_DEBOUNCE = 2.0        # Quiet period after the last change before a batch is released
+WATCH_MAX_DELAY = 10.0      # A batch is released at the latest this long after its first change
+WATCH_BATCH_SIZE = 200      # Model IDs per batch; the rest follow in the next one
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_templates(folder=TEMPLATES_FOLDER, previous=None):
+    """
+    Builds the index {model_id: (mtime_ns, size, sha256)} of the template_<id>.mb files in folder.
+    Files whose mtime and size match the previous index keep their hash, so a scan of an
+    unchanged folder only costs one stat() per file.
+    """
+    previous = previous or {}
+    index = {}
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return index
+
+    for entry in entries:
+        match = TEMPLATE_NAME_RE.fullmatch(entry.name)
+        if not match:
+            continue
+        model_id = int(match.group(1))
+        try:
+            stat = entry.stat()
+            known = previous.get(model_id)
+            if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+                index[model_id] = known
+            else:
+                index[model_id] = (stat.st_mtime_ns, stat.st_size, file_digest(entry.path))
+        except OSError:
+            continue  # Removed or replaced while scanning; the next scan picks it up
+    return index
+
+
+def diff_index(old, new):
+    """Returns (changed, removed) model IDs between two index snapshots. A touch without new content is no change."""
+    changed = {model_id for model_id, entry in new.items()
+               if model_id not in old or old[model_id][2] != entry[2]}
+    removed = set(old) - set(new)
+    return changed, removed
+
+
+class TemplateWatcher:
+    """
+    Polls the templates folder on the event loop and reports changed model IDs in batches.
+
+    Changes are collected until the folder has been quiet for `debounce` seconds (or
+    `max_delay` passed since the first one), then on_batch(changed_ids, removed_ids) is
+    called on the loop with at most `batch_size` IDs. Scans run in the default executor.
+    """
+
+    def __init__(self, on_batch, on_log, folder=TEMPLATES_FOLDER, poll_interval=WATCH_POLL_INTERVAL,
+                 debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY, batch_size=WATCH_BATCH_SIZE):
+        self.on_batch = on_batch
+        self.on_log = on_log
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.index = {}
+        self.changed = set()
+        self.removed = set()
+        self._first_change = None
+        self._last_change = None
+        self._task = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.index = await loop.run_in_executor(None, scan_templates, self.folder)
+        self._task = loop.create_task(self._run())
+        self.on_log(f"Watching '{self.folder}' ({len(self.index)} templates) for changes.", 'purple')
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                index = await loop.run_in_executor(None, scan_templates, self.folder, self.index)
+            except OSError as e:
+                self.on_log(f"Template watcher scan failed: {e}", 'red')
+                continue
+
+            changed, removed = diff_index(self.index, index)
+            self.index = index
+            now = time.monotonic()
+            if changed or removed:
+                self.changed = (self.changed | changed) - removed
+                self.removed = (self.removed | removed) - changed
+                self._last_change = now
+                if self._first_change is None:
+                    self._first_change = now
+
+            if self._first_change is not None and (now - self._last_change >= self.debounce
+                                                   or now - self._first_change >= self.max_delay):
+                self._release()
+
+    def _release(self):
+        changed = sorted(self.changed)[:self.batch_size]
+        removed = sorted(self.removed)
+        self.changed.difference_update(changed)
+        self.removed.clear()
+        # Leftovers go out with the next poll
+        self._first_change = self._last_change = (time.monotonic() - self.max_delay) if self.changed else None
+        try:
+            self.on_batch(changed, removed)
+        except Exception as e:
+            self.on_log(f"Template watcher callback error: {e}", 'red')
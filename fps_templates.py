@@ -0,0 +1,256 @@
+import asyncio
+import os
+import re
+import struct
+import tempfile
+
+from fps_fleet import TCP_PORT
+from fps_metrics import command_metrics
+from fps_protocol import LINE_OK, LINE_SUCCESS, ProtocolError, ResponseStream, ends_on_result
+
+# Configuration
+TEMPLATES_FOLDER = "templates"  # Define the templates folder name
+TEMPLATE_ACK_TIMEOUT = 15       # Seconds to wait for "OK: File transfer commencing."
+TEMPLATE_TRANSFER_TIMEOUT = 60  # Seconds allowed for the binary part of one template
+DOWNLOAD_ACK_TIMEOUT = 15       # Seconds to wait for each reply while sending a template to a device
+
+# A template travels as the sensor's own data packets:
+# 12 x [EF 01 | address (4) | package id (1) | length (2) | payload (128) | checksum (2)]
+TEMPLATE_PACKET_COUNT = 12
+TEMPLATE_PAYLOAD_SIZE = 128
+TEMPLATE_PACKET_SIZE = 9 + TEMPLATE_PAYLOAD_SIZE + 2
+TEMPLATE_SIZE = TEMPLATE_PACKET_COUNT * TEMPLATE_PACKET_SIZE  # 1668 bytes
+PACKET_START_CODE = b'\xef\x01'
+PACKET_ID_DATA = 0x02
+PACKET_ID_END = 0x08
+
+TEMPLATE_NAME_RE = re.compile(r"template_(\d+)\.mb")
+
+# Failures that leave a session unusable (timeout, reset, broken framing), as opposed to a refused template
+SESSION_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ProtocolError)
+
+
+class TemplateError(Exception):
+    """Raised when a template transfer is refused, truncated or malformed."""
+
+
+def template_path(model_id, folder=TEMPLATES_FOLDER):
+    return os.path.join(folder, f"template_{model_id}.mb")
+
+
+def validate_template(data):
+    """Checks size and packet framing (start code, package id, length, checksum) of a template."""
+    if len(data) != TEMPLATE_SIZE:
+        raise TemplateError(f"Invalid template size ({len(data)} bytes, expected {TEMPLATE_SIZE}).")
+
+    view = memoryview(data)
+    for index in range(TEMPLATE_PACKET_COUNT):
+        packet = view[index * TEMPLATE_PACKET_SIZE:(index + 1) * TEMPLATE_PACKET_SIZE]
+        package_id = packet[6]
+        length, = struct.unpack(">H", packet[7:9])
+        checksum, = struct.unpack(">H", packet[-2:])
+        expected_id = PACKET_ID_END if index == TEMPLATE_PACKET_COUNT - 1 else PACKET_ID_DATA
+
+        if packet[:2] != PACKET_START_CODE:
+            raise TemplateError(f"Packet {index}: missing start code.")
+        if package_id != expected_id:
+            raise TemplateError(f"Packet {index}: unexpected package id 0x{package_id:02X}.")
+        if length != TEMPLATE_PAYLOAD_SIZE + 2:
+            raise TemplateError(f"Packet {index}: unexpected length {length}.")
+        if (sum(packet[6:-2]) & 0xFFFF) != checksum:
+            raise TemplateError(f"Packet {index}: checksum mismatch.")
+
+
+def build_template(payload):
+    """Frames up to 1536 payload bytes as the sensor's 12 data packets (zero padded). Inverse of validate_template."""
+    payload = bytes(payload).ljust(TEMPLATE_PACKET_COUNT * TEMPLATE_PAYLOAD_SIZE, b'\x00')
+    packets = []
+    for index in range(TEMPLATE_PACKET_COUNT):
+        package_id = PACKET_ID_END if index == TEMPLATE_PACKET_COUNT - 1 else PACKET_ID_DATA
+        body = bytes([package_id]) + struct.pack(">H", TEMPLATE_PAYLOAD_SIZE + 2) + \
+            payload[index * TEMPLATE_PAYLOAD_SIZE:(index + 1) * TEMPLATE_PAYLOAD_SIZE]
+        packets.append(PACKET_START_CODE + b'\xff\xff\xff\xff' + body + struct.pack(">H", sum(body) & 0xFFFF))
+    return b''.join(packets)
+
+
+def save_template(model_id, data, folder=TEMPLATES_FOLDER):
+    """Writes a template atomically (temp file in the same folder + rename). Returns the file name."""
+    os.makedirs(folder, exist_ok=True)
+    filename = template_path(model_id, folder)
+
+    fd, temp_path = tempfile.mkstemp(prefix=f".template_{model_id}.", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, filename)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return filename
+
+
+async def receive_template_into(reader, buffer, timeout=TEMPLATE_TRANSFER_TIMEOUT):
+    """
+    Reads exactly one template into a preallocated buffer (bytearray or memoryview slice).
+    The whole template is taken from the stream in one readexactly() on the loop.
+    """
+    try:
+        buffer[:] = await asyncio.wait_for(reader.readexactly(len(buffer)), timeout=timeout)
+    except asyncio.IncompleteReadError as e:
+        raise TemplateError(f"Connection closed after {len(e.partial)} of {len(buffer)} bytes.")
+
+
+async def request_template(reader, writer, model_id, buffer):
+    """
+    Sends UPLOAD_TEMPLATE on an open session and receives the template into buffer.
+    Returns the device's acknowledgement line.
+    """
+    stream = ResponseStream.of(reader)
+    writer.write(f"UPLOAD_TEMPLATE,{model_id}\n".encode('utf-8'))
+    await writer.drain()
+
+    # Wait for the "OK: File transfer commencing." message
+    lines = await stream.read_response("UPLOAD_TEMPLATE", TEMPLATE_ACK_TIMEOUT)
+    if not lines or lines[-1].kind != LINE_OK:
+        raise TemplateError(lines[-1].text if lines else f"No acknowledgement for template ID {model_id}.")
+
+    await receive_template_into(stream, buffer)
+    validate_template(buffer)
+    return lines[-1].text
+
+
+async def request_templates(reader, writer, model_ids):
+    """
+    Bulk pull over one session: fills one preallocated buffer with every template in model_ids.
+    Returns (buffer, {model_id: memoryview slot}, {model_id: error message}).
+    """
+    stream = ResponseStream.of(reader)
+    buffer = bytearray(len(model_ids) * TEMPLATE_SIZE)
+    view = memoryview(buffer)
+    templates = {}
+    errors = {}
+
+    for index, model_id in enumerate(model_ids):
+        slot = view[index * TEMPLATE_SIZE:(index + 1) * TEMPLATE_SIZE]
+        try:
+            await request_template(stream, writer, model_id, slot)
+            templates[model_id] = slot
+        except TemplateError as e:
+            errors[model_id] = str(e)
+
+    return buffer, templates, errors
+
+
+async def send_template(reader, writer, model_id, data):
+    """
+    Sends one template to the device with DOWNLOAD_TEMPLATE on an open session.
+    data may be any bytes-like object (e.g. a memoryview into an archive). Raises TemplateError when refused.
+    """
+    if len(data) != TEMPLATE_SIZE:
+        raise TemplateError(f"Invalid template size ({len(data)} bytes).")
+
+    stream = ResponseStream.of(reader)
+    writer.write(f"DOWNLOAD_TEMPLATE,{model_id}\n".encode('utf-8'))
+    await writer.drain()
+
+    lines = await stream.read_response("DOWNLOAD_TEMPLATE", DOWNLOAD_ACK_TIMEOUT)
+    if not lines or lines[-1].kind != LINE_OK:
+        raise TemplateError(lines[-1].text if lines else "No acknowledgement.")
+
+    writer.write(data)
+    await writer.drain()
+
+    # After the data the device answers with the result of the transfer
+    lines = await stream.read_response("DOWNLOAD_TEMPLATE", DOWNLOAD_ACK_TIMEOUT, until=ends_on_result)
+    if not lines:
+        raise ConnectionResetError("Device closed the session.")
+    if lines[-1].kind != LINE_SUCCESS:
+        raise TemplateError(lines[-1].text)
+    return lines[-1].text
+
+
+def folder_template_ids(folder=TEMPLATES_FOLDER):
+    """Returns {model_id: file path} for the template_<id>.mb files in folder."""
+    templates = {}
+    for filename in os.listdir(folder):
+        match = TEMPLATE_NAME_RE.fullmatch(filename)
+        if match:
+            templates[int(match.group(1))] = os.path.join(folder, filename)
+    return templates
+
+
+async def send_templates(ip, command, model_ids, load, port=TCP_PORT):
+    """
+    Sends the templates of model_ids to a device with DOWNLOAD_TEMPLATE over one session (metered as
+    command). load(model_id) returns the data of a template or raises TemplateError to skip it.
+    A transfer that breaks the session (timeout, reset) is recorded as that template's error and the
+    rest are sent over a new session, so one bad template does not stop the others. Raises if the
+    first connection fails. Returns (number of templates sent, {model_id: error message}).
+    """
+    remaining = list(model_ids)
+    sent = 0
+    errors = {}
+    connected = False
+
+    while remaining:
+        try:
+            async with command_metrics.session(ip, command, port) as (reader, writer):
+                connected = True
+                stream = ResponseStream(reader)
+                while remaining:
+                    model_id = remaining.pop(0)
+                    try:
+                        await send_template(stream, writer, model_id, load(model_id))
+                        sent += 1
+                    except TemplateError as e:
+                        errors[model_id] = str(e)
+                    except SESSION_ERRORS as e:
+                        errors[model_id] = f"Transfer failed: {str(e) or e.__class__.__name__}"
+                        break  # Reconnect for the rest
+        except SESSION_ERRORS as e:
+            if not connected:
+                raise
+            # The device went away mid-push; the remaining templates were not attempted
+            for model_id in remaining:
+                errors[model_id] = f"Not sent, reconnect failed: {str(e) or e.__class__.__name__}"
+            break
+
+    return sent, errors
+
+
+async def push_folder(ip, folder=TEMPLATES_FOLDER, model_ids=None, port=TCP_PORT):
+    """
+    Sends the templates of a folder (all, or only model_ids) to a device, see send_templates().
+    Returns (number of templates sent, {model_id: error message}).
+    """
+    files = folder_template_ids(folder)
+
+    def load(model_id):
+        try:
+            with open(files[model_id], 'rb') as f:
+                return f.read()
+        except (KeyError, OSError) as e:
+            raise TemplateError(f"Not readable: {e}")
+
+    return await send_templates(ip, "SYNC", sorted(files if model_ids is None else model_ids), load, port)
+
+
+async def push_template(ip, model_id, data, port=TCP_PORT):
+    """Sends one template to a device over its own session. Returns the device's SUCCESS line."""
+    async with command_metrics.session(ip, "DOWNLOAD_TEMPLATE", port) as (reader, writer):
+        return await send_template(reader, writer, model_id, data)
+
+
+async def pull_template(ip, model_id, folder=TEMPLATES_FOLDER, port=TCP_PORT):
+    """Receives one template from a device and saves it atomically. Returns the saved file name."""
+    async with command_metrics.session(ip, "UPLOAD_TEMPLATE", port) as (reader, writer):
+        buffer = bytearray(TEMPLATE_SIZE)
+        await request_template(reader, writer, model_id, buffer)
+
+    # Keep the fsync off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, save_template, model_id, buffer, folder)
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# The modules are scripts in the repository root, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def sensor_packets(template, payload_size=128):
+    """Wraps template in sensor data packets (header, package id, length, payload, checksum) like a device upload."""
+    packets = b''
+    for start in range(0, len(template), payload_size):
+        payload = template[start:start + payload_size]
+        packets += b'\xef\x01\xff\xff\xff\xff\x02' + (len(payload) + 2).to_bytes(2, 'big') + payload + b'\x00\x00'
+    return packets
+
+
+@pytest.fixture
+def matcher(tmp_path, monkeypatch):
+    """The matcher app with an empty database and gallery snapshot in tmp_path."""
+    pytest.importorskip('flask')
+    pytest.importorskip('numpy')
+    monkeypatch.chdir(tmp_path)
+    import ByteByByte_Matching_With_Battery as matcher
+
+    monkeypatch.setattr(matcher, 'gallery', None)
+    monkeypatch.setattr('builtins.input', lambda prompt='': 'alice')
+    matcher.detect_cache.size = 0
+    matcher.init_db()
+    return matcher
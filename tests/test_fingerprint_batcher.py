@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from fingerprint_batcher import DetectBatcher
+
+
+class Scorer:
+    """score_batch stand-in: doubles each probe, returns a ValueError for 'bad' and records the batch sizes."""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.sizes = []
+        self.threads = set()
+
+    def __call__(self, probes):
+        self.sizes.append(len(probes))
+        self.threads.add(threading.current_thread().name)
+        if self.fail:
+            raise self.fail
+        return [ValueError(f"cannot score {probe}") if probe == 'bad' else probe * 2 for probe in probes]
+
+
+def submit_together(batcher, probes):
+    """Submits every probe from its own thread at the same moment. Returns the results or raised exceptions."""
+    results = [None] * len(probes)
+    barrier = threading.Barrier(len(probes))
+
+    def worker(index):
+        barrier.wait()
+        try:
+            results[index] = batcher.submit(probes[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(len(probes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_results_reach_their_callers():
+    scorer = Scorer()
+    batcher = DetectBatcher(scorer, window=0.2, batch_size=32)
+    probes = [f"p{index}" for index in range(8)]
+    assert submit_together(batcher, probes) == [probe * 2 for probe in probes]
+    assert sum(scorer.sizes) == 8 and len(scorer.sizes) < 8
+    assert batcher.stats()['probes'] == 8
+
+
+def test_a_failed_probe_does_not_fail_the_batch():
+    batcher = DetectBatcher(Scorer(), window=0.2, batch_size=32)
+    results = submit_together(batcher, ['a', 'bad', 'c'])
+    assert results[0] == 'aa' and results[2] == 'cc'
+    assert isinstance(results[1], ValueError) and str(results[1]) == "cannot score bad"
+
+
+def test_a_failed_batch_raises_a_copy_in_every_caller():
+    error = RuntimeError("gallery unreadable")
+    batcher = DetectBatcher(Scorer(fail=error), window=0.2, batch_size=32)
+    results = submit_together(batcher, ['a', 'b', 'c'])
+    assert all(isinstance(result, RuntimeError) and str(result) == "gallery unreadable" for result in results)
+    assert len({id(result) for result in results} | {id(error)}) == 4
+    assert all(result.__cause__ is error for result in results)
+    # Each copy carries the traceback of its own caller
+    assert len({id(result.__traceback__) for result in results}) == 3
+
+
+def test_full_batch_is_scored_without_waiting_for_the_window():
+    scorer = Scorer()
+    batcher = DetectBatcher(scorer, window=2.0, batch_size=3)
+    started = time.monotonic()
+    assert submit_together(batcher, [f"p{index}" for index in range(6)]) == [f"p{index}" * 2 for index in range(6)]
+    assert time.monotonic() - started < 1.0
+    assert scorer.sizes == [3, 3]
+    assert batcher.stats()['largest'] == 3
+
+
+def test_lone_probe_waits_for_the_window():
+    scorer = Scorer()
+    batcher = DetectBatcher(scorer, window=0.05, batch_size=32)
+    started = time.monotonic()
+    assert batcher.submit('a') == 'aa'
+    assert 0.04 <= time.monotonic() - started < 1.0
+    assert scorer.sizes == [1] and scorer.threads == {'detect-batcher'}
+
+
+def test_window_zero_scores_in_the_caller():
+    scorer = Scorer()
+    batcher = DetectBatcher(scorer, window=0)
+    assert batcher.submit('a') == 'aa'
+    with pytest.raises(ValueError):
+        batcher.submit('bad')
+    assert scorer.threads == {threading.current_thread().name}
@@ -0,0 +1,74 @@
+import sqlite3
+import zipfile
+
+import pytest
+
+from fingerprint_bulk_import import import_templates, load_names
+from fingerprint_store import extract_template
+from fps_template_archive import write_archive
+from fps_templates import build_template
+
+
+def device_template(seed):
+    return build_template(bytes((seed * 7 + index) % 251 + 1 for index in range(1536)))
+
+
+def rows(database):
+    with sqlite3.connect(database) as conn:
+        return conn.execute('SELECT username, template FROM fingerprints ORDER BY id').fetchall()
+
+
+def test_folder_import_with_names_and_duplicates(tmp_path):
+    folder = tmp_path / 'templates'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'template_1.mb').write_bytes(device_template(1))
+    (folder / 'template_2.mb').write_bytes(device_template(2))
+    (folder / 'sub' / 'template_3.mb').write_bytes(device_template(1))  # Same content as template_1
+    (folder / 'notes.txt').write_bytes(device_template(4))
+    names = tmp_path / 'users.csv'
+    names.write_text('model_id,username\n1, alice\nx,nobody\n')
+    database = str(tmp_path / 'fingerprints.db')
+
+    stats = import_templates([str(folder)], database, load_names(str(names)))
+    assert stats == {'read': 3, 'imported': 2, 'duplicates': 1, 'invalid': 0}
+    assert rows(database) == [('alice', extract_template(device_template(1))),
+                              ('template_2', extract_template(device_template(2)))]
+
+    # A second run finds everything in the database already
+    assert import_templates([str(folder)], database)['duplicates'] == 3
+    assert len(rows(database)) == 2
+
+
+def test_archive_and_zip_sources(tmp_path):
+    archive = str(tmp_path / 'device.fpsarc')
+    write_archive(archive, {5: device_template(5), 6: device_template(6)})
+    bundle = str(tmp_path / 'templates.zip')
+    with zipfile.ZipFile(bundle, 'w') as f:
+        f.writestr('export/template_7.mb', device_template(7))
+        f.writestr('export/template_8.mb', device_template(5))  # Also in the archive
+        f.writestr('export/readme.txt', b'not a template')
+    database = str(tmp_path / 'fingerprints.db')
+
+    stats = import_templates([archive, bundle], database, {7: 'bob'}, batch_size=1)
+    assert stats == {'read': 4, 'imported': 3, 'duplicates': 1, 'invalid': 0}
+    assert [username for username, _template in rows(database)] == ['template_5', 'template_6', 'bob']
+
+
+def test_invalid_templates_are_not_stored(tmp_path):
+    folder = tmp_path / 'templates'
+    folder.mkdir()
+    (folder / 'template_1.mb').write_bytes(b'')
+    (folder / 'template_2.mb').write_bytes(b'no sensor packets in here')
+    (folder / 'template_3.mb').write_bytes(build_template(b''))  # Only zero padding
+    (folder / 'template_4.mb').write_bytes(device_template(4))
+    database = str(tmp_path / 'fingerprints.db')
+
+    assert import_templates([str(folder)], database) == {'read': 4, 'imported': 1, 'duplicates': 0, 'invalid': 3}
+    assert [username for username, _template in rows(database)] == ['template_4']
+
+
+def test_unknown_source_is_rejected(tmp_path):
+    source = tmp_path / 'templates.tar'
+    source.write_bytes(b'not an archive')
+    with pytest.raises(ValueError):
+        import_templates([str(source)], str(tmp_path / 'fingerprints.db'))
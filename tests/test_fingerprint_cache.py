@@ -0,0 +1,58 @@
+from fingerprint_cache import DetectCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_and_miss():
+    cache = DetectCache(size=4)
+    key = cache.key(b'payload')
+    assert cache.get(key, 1) is None
+    cache.put(key, 1, ('alice', 97.5, 0))
+    assert cache.get(key, 1) == ('alice', 97.5, 0)
+    assert cache.get(cache.key(b'other payload'), 1) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['hit_rate']) == (1, 2, 1, 0.333)
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('fingerprint_cache.time.monotonic', clock)
+    cache = DetectCache(size=4, ttl=30)
+    cache.put(b'key', 1, ('alice', 90.0, 0))
+    clock.now += 29
+    assert cache.get(b'key', 1) == ('alice', 90.0, 0)
+    clock.now += 2
+    assert cache.get(b'key', 1) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_new_generation_drops_all_entries():
+    cache = DetectCache(size=4)
+    cache.put(b'a', 1, ('alice', 90.0, 0))
+    cache.put(b'b', 1, ('bob', 80.0, 0))
+    assert cache.get(b'a', 2) is None
+    assert cache.stats()['entries'] == 0
+    assert cache.get(b'b', 1) is None  # Not brought back by the old generation
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = DetectCache(size=2)
+    cache.put(b'a', 1, 'A')
+    cache.put(b'b', 1, 'B')
+    assert cache.get(b'a', 1) == 'A'
+    cache.put(b'c', 1, 'C')
+    assert cache.get(b'b', 1) is None
+    assert (cache.get(b'a', 1), cache.get(b'c', 1)) == ('A', 'C')
+
+
+def test_size_zero_disables_the_cache():
+    cache = DetectCache(size=0)
+    cache.put(b'a', 1, 'A')
+    assert cache.get(b'a', 1) is None
+    assert cache.stats()['misses'] == 0
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import fingerprint_calibrate
+from fingerprint_calibrate import block_tasks, gallery_labels, rates, recommend, thresholds
+from fingerprint_gallery import sync_gallery
+from fingerprint_store import init_db, template_digest
+
+
+def calculate_similarity(payload1, payload2):
+    """The matcher's baseline score."""
+    shorter, longer = (payload1, payload2) if len(payload1) <= len(payload2) else (payload2, payload1)
+    return sum(1 for i in range(len(shorter)) if shorter[i] == longer[i]) / len(shorter) * 100
+
+
+def make_gallery(tmp_path, rows):
+    database, folder = str(tmp_path / 'fingerprints.db'), str(tmp_path / 'gallery')
+    init_db(database)
+    with sqlite3.connect(database) as conn:
+        conn.executemany('INSERT INTO fingerprints (username, template, template_hash) VALUES (?, ?, ?)',
+                         [(username, template, template_digest(template)) for username, template in rows])
+    return sync_gallery(database, folder)[0]
+
+
+def synthetic_rows(fingers=4, samples=3, length=100, seed=5):
+    """Noisy samples of a few fingers. With 100-byte templates every score is a whole percent, so many
+    pairs land exactly on a threshold."""
+    rng = np.random.RandomState(seed)
+    rows = []
+    for finger in range(fingers):
+        base = rng.randint(1, 256, length).astype(np.uint8)
+        for sample in range(samples):
+            template = base.copy()
+            changed = rng.choice(length, rng.randint(1, 60), replace=False)
+            template[changed] = rng.randint(1, 256, len(changed))
+            rows.append((f"finger{finger}_{sample}", template.tobytes()))
+    # Impostor pairs sharing bytes with the fingers above, and a legacy empty row
+    rows.append(("other_0", rows[0][1][:50] + bytes(50)))
+    rows.append(("legacy_0", b''))
+    return rows
+
+
+def brute_force(gallery, labels):
+    genuine, impostor = [], []
+    for i in range(len(gallery)):
+        for j in range(i + 1, len(gallery)):
+            if labels[i] >= 0 and labels[j] >= 0:
+                score = calculate_similarity(gallery.template(i), gallery.template(j))
+                (genuine if labels[i] == labels[j] else impostor).append(score)
+    return np.array(genuine), np.array(impostor)
+
+
+def test_blocks_and_rates_match_a_brute_force_recount(tmp_path):
+    gallery = make_gallery(tmp_path, synthetic_rows())
+    labels = gallery_labels(gallery, r"(.*)_\d+")
+    assert labels[-1] == -1  # The empty row is left out
+
+    matrix_path = str(tmp_path / 'scores.npy')
+    np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(len(gallery), len(gallery))).flush()
+    fingerprint_calibrate._open_worker(gallery.folder, gallery.meta, matrix_path, labels, 5)
+    bins = len(thresholds()) + 1
+    genuine_histogram, impostor_histogram = np.zeros(bins, dtype=np.int64), np.zeros(bins, dtype=np.int64)
+    for task in block_tasks(len(gallery), 5):
+        genuine, impostor = fingerprint_calibrate._score_block(task)
+        genuine_histogram += genuine
+        impostor_histogram += impostor
+    del fingerprint_calibrate._worker['matrix']
+
+    genuine_scores, impostor_scores = brute_force(gallery, labels)
+    assert (genuine_histogram.sum(), impostor_histogram.sum()) == (len(genuine_scores), len(impostor_scores)) == (12, 66)
+    far, frr = rates(genuine_histogram, impostor_histogram)
+    levels = thresholds()
+    # The matcher accepts a score strictly above the threshold
+    expected_far = np.array([(impostor_scores > level).mean() for level in levels])
+    expected_frr = np.array([1 - (genuine_scores > level).mean() for level in levels])
+    np.testing.assert_allclose(far, expected_far, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(frr, expected_frr, rtol=0, atol=1e-12)
+
+    matrix = np.load(matrix_path)
+    expected = [[calculate_similarity(gallery.template(i), gallery.template(j)) if gallery.lengths[i] and gallery.lengths[j]
+                 else 0 for j in range(len(gallery))] for i in range(len(gallery))]
+    np.testing.assert_allclose(matrix, np.array(expected, dtype=np.float32), rtol=0, atol=0)
+
+
+def test_score_on_the_threshold_is_rejected():
+    levels = thresholds()
+    # One genuine pair scoring exactly 50 and one impostor pair scoring exactly 20
+    genuine = np.bincount([np.searchsorted(levels, 50.0, side='left')], minlength=len(levels) + 1)
+    impostor = np.bincount([np.searchsorted(levels, 20.0, side='left')], minlength=len(levels) + 1)
+    far, frr = rates(genuine, impostor)
+    at = {level: index for index, level in enumerate(levels)}
+    assert (far[at[19.9]], far[at[20.0]]) == (1, 0)
+    assert (frr[at[49.9]], frr[at[50.0]]) == (0, 1)
+
+    recommended, eer_threshold, eer = recommend(levels, far, frr, target_far=0)
+    assert recommended == 20.0
+    assert 20.0 <= eer_threshold < 50.0 and eer == 0
+
+
+def test_calibrate_skips_empty_templates(tmp_path):
+    gallery = make_gallery(tmp_path, synthetic_rows())
+    output = str(tmp_path / 'calibration')
+    summary = fingerprint_calibrate.calibrate(gallery.folder, output, r"(.*)_\d+", target_far=0.01, workers=1, block_rows=4)
+    assert (summary['templates'], summary['labelled'], summary['identities']) == (14, 13, 5)
+    assert (summary['genuine_pairs'], summary['impostor_pairs']) == (12, 66)
+    with open(os.path.join(output, 'calibration.json'), encoding='utf-8') as f:
+        assert json.load(f) == summary
+    matrix = np.load(os.path.join(output, 'scores.npy'))
+    assert (matrix == matrix.T).all() and not matrix[-1].any()
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from fingerprint_gallery import (aligned_similarity_scores, batch_similarity_scores, pack_templates, similarity_scores,
+                                 sync_gallery)
+from fingerprint_store import init_db
+
+
+def random_templates(rng, lengths, zeros=0.3):
+    """Random templates with many zero bytes, so the zero-padding correction is exercised."""
+    templates = []
+    for length in lengths:
+        data = rng.randint(1, 256, length).astype(np.uint8)
+        data[rng.random_sample(length) < zeros] = 0
+        templates.append(data.tobytes())
+    return templates
+
+
+def test_scores_match_calculate_similarity(matcher):
+    rng = np.random.RandomState(1)
+    stored = random_templates(rng, [1, 7, 128, 500, 1024, 1536, 1536, 1536])
+    stored.append(bytes(1536))
+    matrix, lengths = pack_templates(stored)
+    # Probes shorter than, equal to and longer than the stride, and stored templates themselves
+    probes = random_templates(rng, [1, 3, 128, 777, 1536, 2000]) + [stored[4], bytes(900)]
+
+    for probe in probes:
+        expected = [matcher.calculate_similarity(probe, template) for template in stored]
+        assert similarity_scores(matrix, lengths, probe).tolist() == expected
+    batch = batch_similarity_scores(matrix, lengths, probes)
+    assert [scores.tolist() for scores in batch] == \
+        [[matcher.calculate_similarity(probe, template) for template in stored] for probe in probes]
+
+
+def test_empty_probe_raises_like_calculate_similarity(matcher):
+    matrix, lengths = pack_templates([b'\x01\x02'])
+    with pytest.raises(ZeroDivisionError):
+        matcher.calculate_similarity(b'', b'\x01\x02')
+    with pytest.raises(ZeroDivisionError):
+        similarity_scores(matrix, lengths, b'')
+
+
+def test_empty_stored_templates_score_zero():
+    matrix, lengths = pack_templates([b'\x01\x02', b'', b'\x01\x03'])
+    assert similarity_scores(matrix, lengths, b'\x01\x02').tolist() == [100.0, 0.0, 50.0]
+    assert aligned_similarity_scores(matrix, lengths, b'\x01\x02', 1, sample_step=1)[0].tolist() == [100.0, 0.0, 50.0]
+    assert aligned_similarity_scores(matrix, lengths, b'\x01\x02' * 20, 3)[0][1] == 0
+
+
+def test_empty_gallery():
+    matrix, lengths = pack_templates([])
+    assert len(similarity_scores(matrix, lengths, b'\x01')) == 0
+
+
+def reference_offset_score(template, probe, offset):
+    """Byte i of template against byte i + offset of probe, over the shorter of the two lengths."""
+    matches = sum(1 for i in range(len(template)) if 0 <= i + offset < len(probe) and template[i] == probe[i + offset])
+    return matches / min(len(template), len(probe)) * 100
+
+
+def test_aligned_scores_match_an_exhaustive_search():
+    rng = np.random.RandomState(2)
+    stored = random_templates(rng, [40, 64, 100, 150])
+    matrix, lengths = pack_templates(stored)
+    # A stored template with bytes added in front and one with bytes missing, plus an unrelated probe
+    probes = [b'\x07\x08\x09' + stored[2], stored[3][2:], random_templates(rng, [90])[0]]
+    max_offset = 4
+    for probe in probes:
+        scores, offsets = aligned_similarity_scores(matrix, lengths, probe, max_offset, sample_step=1)
+        for row, template in enumerate(stored):
+            # Offsets in the order the search prefers them on ties: 0, -1, 1, -2, 2, ...
+            candidates = sorted(range(-max_offset, max_offset + 1), key=abs)
+            expected = [reference_offset_score(template, probe, offset) for offset in candidates]
+            best = int(np.argmax(expected))
+            assert scores[row] == pytest.approx(expected[best])
+            assert offsets[row] == candidates[best]
+    assert aligned_similarity_scores(matrix, lengths, probes[0], max_offset, sample_step=1)[1][2] == 3
+    assert aligned_similarity_scores(matrix, lengths, probes[1], max_offset, sample_step=1)[1][3] == -2
+
+
+def test_aligned_scores_at_offset_zero_equal_similarity_scores():
+    rng = np.random.RandomState(3)
+    stored = random_templates(rng, [128, 700, 1536])
+    matrix, lengths = pack_templates(stored)
+    probe = random_templates(rng, [1000])[0]
+    scores, offsets = aligned_similarity_scores(matrix, lengths, probe, 0)
+    assert scores.tolist() == similarity_scores(matrix, lengths, probe).tolist()
+    assert not offsets.any()
+    # The sampled search never scores a row below offset 0
+    sampled, _offsets = aligned_similarity_scores(matrix, lengths, probe, 8)
+    assert (sampled >= scores).all()
+
+
+def test_sync_gallery_follows_the_database(tmp_path):
+    database, folder = str(tmp_path / 'fingerprints.db'), str(tmp_path / 'gallery')
+    init_db(database)
+
+    def execute(sql, *params):
+        with sqlite3.connect(database) as conn:
+            conn.execute(sql, params)
+
+    execute('INSERT INTO fingerprints (username, template) VALUES (?, ?), (?, ?)',
+            'alice', b'\x01' * 300, 'bob', b'\x02' * 400)
+    gallery, action = sync_gallery(database, folder)
+    assert action == 'rebuilt'
+    assert list(gallery.rows()) == [('alice', b'\x01' * 300), ('bob', b'\x02' * 400)]
+    assert sync_gallery(database, folder)[1] == 'loaded'
+
+    # New rows and renames are appended to the same build
+    execute('INSERT INTO fingerprints (username, template) VALUES (?, ?)', 'carol', b'\x03' * 500)
+    execute("UPDATE fingerprints SET username = 'alicia' WHERE username = 'alice'")
+    gallery, action = sync_gallery(database, folder)
+    assert (action, gallery.meta['build']) == ('appended', 1)
+    assert gallery.usernames == ['alicia', 'bob', 'carol']
+    assert gallery.best_match(b'\x02' * 400) == ('bob', 100.0)
+
+    # A template longer than the stride and a deletion each need a new build
+    execute('INSERT INTO fingerprints (username, template) VALUES (?, ?)', 'dave', b'\x04' * 2000)
+    gallery, action = sync_gallery(database, folder)
+    assert (action, gallery.stride, gallery.template(3)) == ('rebuilt', 2000, b'\x04' * 2000)
+    execute("DELETE FROM fingerprints WHERE username = 'bob'")
+    gallery, action = sync_gallery(database, folder)
+    assert (action, gallery.meta['build']) == ('rebuilt', 3)
+    assert [username for username, _template in gallery.rows()] == ['alicia', 'carol', 'dave']
+    assert not [name for name in os.listdir(folder) if '-1.' in name or '-2.' in name]  # Older builds removed
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import fingerprint_lsh
+from fingerprint_gallery import pack_templates, sync_gallery
+from fingerprint_store import init_db, template_digest
+
+
+def enroll(database, templates, first=0):
+    with sqlite3.connect(database) as conn:
+        conn.executemany('INSERT INTO fingerprints (username, template, template_hash) VALUES (?, ?, ?)',
+                         [(f'user{first + i}', t, template_digest(t)) for i, t in enumerate(templates)])
+
+
+def test_genuine_probes_are_candidates():
+    templates = fingerprint_lsh.synthetic_gallery(2000)
+    matrix, lengths = pack_templates(templates)
+    index = fingerprint_lsh.LshIndex(matrix, lengths)
+    rng = np.random.RandomState(0)
+    for row in rng.choice(len(templates), 50, replace=False):
+        probe = fingerprint_lsh.perturb(templates[row], 0.9, rng)
+        assert fingerprint_lsh.best_candidate(matrix, lengths, index, probe)[0] == row
+
+
+def test_index_survives_appends_and_renames(tmp_path):
+    database, folder = str(tmp_path / 'fingerprints.db'), str(tmp_path / 'gallery')
+    init_db(database)
+    templates = fingerprint_lsh.synthetic_gallery(600)
+    enroll(database, templates[:500])
+    gallery, _action = sync_gallery(database, folder)
+    index = fingerprint_lsh.gallery_index(gallery)
+
+    enroll(database, templates[500:], first=500)
+    gallery, action = sync_gallery(database, folder)
+    assert action == 'appended'
+    extended = fingerprint_lsh.gallery_index(gallery)
+    assert extended is not index and extended.count == 600
+    assert extended.positions is index.positions
+
+    # The merged bands are what a full build with the same positions would have sorted
+    keys = extended._row_keys(gallery.templates, 0, 600)
+    order = np.argsort(keys, axis=0, kind='stable').T
+    assert np.array_equal(extended.order, order)
+    assert np.array_equal(extended.sorted_keys, np.take_along_axis(keys, order.T, axis=0).T)
+
+    rng = np.random.RandomState(1)
+    probe = fingerprint_lsh.perturb(templates[550], 0.9, rng)
+    assert 550 in extended.candidates(probe)
+    assert gallery.best_matches([probe], extended.candidates)[0][0] == 'user550'
+
+    with sqlite3.connect(database) as conn:
+        conn.execute("UPDATE fingerprints SET username = 'renamed' WHERE username = 'user3'")
+    gallery, action = sync_gallery(database, folder)
+    assert action == 'appended' and 'renamed' in gallery.usernames
+    assert fingerprint_lsh.gallery_index(gallery) is extended
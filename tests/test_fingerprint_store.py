@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from fingerprint_store import gallery_state, init_db, template_digest
+
+
+def connect(tmp_path):
+    database = str(tmp_path / 'fingerprints.db')
+    init_db(database)
+    return sqlite3.connect(database)
+
+
+def enroll(conn, username, template):
+    with conn:
+        return conn.execute('INSERT INTO fingerprints (username, template, template_hash) VALUES (?, ?, ?)',
+                            (username, template, template_digest(template))).lastrowid
+
+
+def test_triggers_count_generations_and_rewrites(tmp_path):
+    conn = connect(tmp_path)
+    assert gallery_state(conn) == (0, 0)
+    first = enroll(conn, 'alice', b'\x01\x02')
+    enroll(conn, 'bob', b'\x03\x04')
+    assert gallery_state(conn) == (2, 0)
+
+    with conn:
+        conn.execute('UPDATE fingerprints SET username = ? WHERE id = ?', ('carol', first))
+    assert gallery_state(conn) == (3, 0)  # A rename can be followed by an append-only refresh
+
+    with conn:
+        conn.execute('UPDATE fingerprints SET template = ? WHERE id = ?', (b'\x05', first))
+    assert gallery_state(conn) == (4, 1)
+    with conn:
+        conn.execute('DELETE FROM fingerprints WHERE id = ?', (first,))
+    assert gallery_state(conn) == (5, 2)
+    conn.close()
+
+
+def test_init_db_keeps_the_counters(tmp_path):
+    conn = connect(tmp_path)
+    enroll(conn, 'alice', b'\x01')
+    conn.close()
+    init_db(str(tmp_path / 'fingerprints.db'))
+    with sqlite3.connect(str(tmp_path / 'fingerprints.db')) as conn:
+        assert gallery_state(conn) == (1, 0)
+
+
+def test_migrate_upgrades_an_old_table(tmp_path):
+    database = str(tmp_path / 'old.db')
+    with sqlite3.connect(database) as conn:
+        # The table as the first matcher version created it
+        conn.execute('CREATE TABLE fingerprints (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL, '
+                     'template BLOB NOT NULL)')
+        conn.executemany('INSERT INTO fingerprints (username, template) VALUES (?, ?)',
+                         [('', b'\x01'), ('alice', b'\x02'), ('bob', b'\x01'), ('carol', b'\x01'), ('alice', b'\x02')])
+
+    assert init_db(database) == {'hashed': 5, 'removed': 3}
+    with sqlite3.connect(database) as conn:
+        rows = conn.execute('SELECT id, username, template_hash FROM fingerprints ORDER BY id').fetchall()
+        # The earliest row of each template is kept; it takes the first username if it had none
+        assert rows == [(1, 'bob', template_digest(b'\x01')), (2, 'alice', template_digest(b'\x02'))]
+        with pytest.raises(sqlite3.IntegrityError):
+            enroll(conn, 'dave', b'\x02')
+    assert init_db(database) == {'hashed': 0, 'removed': 0}
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from fps_device_client import CommandError, managed
+
+
+async def start_device(replies):
+    """A device stub on localhost: answers each command line with replies[command] (None: hang up)."""
+    received = []
+
+    async def session(reader, writer):
+        command = (await reader.readline()).decode().strip()
+        received.append(command)
+        reply = replies.get(command)
+        if reply is not None:
+            writer.write(reply.encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(session, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1], received
+
+
+def run_managed(replies, body_error=None):
+    async def run():
+        server, port, received = await start_device(replies)
+        try:
+            async with managed('127.0.0.1', port=port):
+                received.append('body')
+                if body_error:
+                    raise body_error
+        finally:
+            server.close()
+            received.append('closed')
+        return received
+
+    return asyncio.run(run())
+
+
+def test_managed_switches_modes():
+    assert run_managed({'MANAGE': "SUCCESS: Manage", 'NORMAL': "SUCCESS: Normal"}) == \
+        ['MANAGE', 'body', 'NORMAL', 'closed']
+
+
+def test_block_error_wins_over_a_failing_normal(caplog):
+    error = ValueError("restore failed")
+    with pytest.raises(ValueError) as raised:
+        run_managed({'MANAGE': "SUCCESS: Manage", 'NORMAL': "ERROR: Busy"}, error)
+    assert raised.value is error
+    assert "NORMAL after a failed command failed too: ERROR: Busy" in caplog.text
+
+
+def test_failing_normal_is_raised_after_a_successful_block():
+    with pytest.raises(CommandError, match="Busy"):
+        run_managed({'MANAGE': "SUCCESS: Manage", 'NORMAL': "ERROR: Busy"})
+
+
+def test_refused_manage_skips_the_block():
+    with pytest.raises(CommandError):
+        run_managed({'MANAGE': "ERROR: Device busy"})
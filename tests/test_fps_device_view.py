@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip('tkinter')
+
+from fps_device_view import DeviceListView, ListboxDeviceView, TreeviewDeviceView
+
+
+class FakeListbox:
+    """The Listbox calls ListboxDeviceView makes, on a plain list."""
+
+    def __init__(self):
+        self.items = []
+        self.selected = ()
+
+    def insert(self, index, text):
+        self.items.insert(len(self.items) if index == 'end' else index, text)
+
+    def delete(self, index):
+        del self.items[index]
+
+    def curselection(self):
+        return self.selected
+
+    def selection_set(self, index):
+        self.selected = (index,)
+
+
+class FakeTreeview:
+    def __init__(self):
+        self.rows = {}
+        self.selected = ()
+
+    def exists(self, item):
+        return item in self.rows
+
+    def insert(self, parent, index, item, text, values, tags):
+        self.rows[item] = values
+
+    def item(self, item, values, tags):
+        self.rows[item] = values
+
+    def delete(self, item):
+        del self.rows[item]
+
+    def selection(self):
+        return self.selected
+
+
+def test_views_must_implement_the_widget_hooks():
+    class Incomplete(DeviceListView):
+        def _upsert(self, ip, values, tags):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete(FakeListbox())
+
+
+def test_listbox_view_applies_coalesced_changes():
+    widget = FakeListbox()
+    view = ListboxDeviceView(widget, lambda ip, mac: f"{ip} {mac}")
+    view.upsert('10.0.0.5', ('10.0.0.5', 'AA'))
+    view.upsert('10.0.0.6', ('10.0.0.6', 'BB'))
+    view.upsert('10.0.0.7', ('10.0.0.7', 'CC'))
+    view.remove('10.0.0.7')  # Never shown
+    view.flush()
+    assert widget.items == ['10.0.0.5 AA', '10.0.0.6 BB']
+
+    widget.selected = (1,)
+    assert view.selected_ip() == '10.0.0.6'
+    view.upsert('10.0.0.6', ('10.0.0.6', 'DD'))
+    view.remove('10.0.0.5')
+    view.flush()
+    assert widget.items == ['10.0.0.6 DD']
+    assert view.index == {'10.0.0.6': 0}
+
+
+def test_treeview_view_uses_the_ip_as_item_id():
+    widget = FakeTreeview()
+    view = TreeviewDeviceView(widget)
+    assert view.selected_ip() is None
+    view.upsert('10.0.0.5', ('10.0.0.5', 'AA', 80))
+    view.flush()
+    view.upsert('10.0.0.5', ('10.0.0.5', 'AA', 75))
+    view.flush()
+    assert widget.rows == {'10.0.0.5': ('10.0.0.5', 'AA', 75)}
+    widget.selected = ('10.0.0.5',)
+    assert view.selected_ip() == '10.0.0.5'
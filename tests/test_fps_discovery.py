@@ -0,0 +1,106 @@
+import asyncio
+
+import fps_discovery
+from fps_discovery import DiscoveryService, StatusServer
+
+
+class Recorder:
+    def __init__(self):
+        self.devices = []
+        self.moves = []
+        self.logs = []
+
+    def on_device(self, ip, mac, battery, transport):
+        self.devices.append((ip, mac, battery, transport))
+
+    def on_moved(self, mac, old_ip, new_ip):
+        self.moves.append((mac, old_ip, new_ip))
+
+    def on_log(self, message, color=None):
+        self.logs.append(message)
+
+
+def service(recorder):
+    return DiscoveryService(recorder.on_device, recorder.on_log, on_moved=recorder.on_moved, tcp=False, udp=False)
+
+
+def test_batch_keeps_the_latest_report_per_mac():
+    recorder = Recorder()
+    discovery = service(recorder)
+    discovery._process([
+        (0, 'tcp', ('10.0.0.5', 'aa:bb', '80'), '10.0.0.5'),
+        (0, 'udp', b'10.0.0.5,AA:BB', '10.0.0.5'),   # Same device: keeps the battery of the TCP report
+        (0, 'udp', b'10.0.0.6,CC:DD', '10.0.0.6'),
+        (0, 'udp', b'garbage', '10.0.0.7'),
+        (0, 'tcp', ('10.0.0.8', 'EE:FF', 'x'), '10.0.0.8'),
+    ])
+    assert recorder.devices == [('10.0.0.5', 'AA:BB', 80, 'udp'), ('10.0.0.6', 'CC:DD', None, 'udp'),
+                                ('10.0.0.8', 'EE:FF', 0, 'tcp')]
+    stats = discovery.stats()
+    assert (stats['tcp'], stats['udp'], stats['duplicates'], stats['malformed'], stats['devices']) == (2, 3, 1, 1, 3)
+
+    discovery._process([(0, 'tcp', ('10.0.0.9', 'CC:DD', '70'), '10.0.0.9')])
+    assert recorder.moves == [('CC:DD', '10.0.0.6', '10.0.0.9')]
+    assert discovery.stats()['devices'] == 3
+
+
+def test_full_queue_drops_the_oldest_reports(monkeypatch):
+    monkeypatch.setattr(fps_discovery, 'DISCOVERY_MAX_PENDING', 3)
+    recorder = Recorder()
+
+    async def run():
+        discovery = service(recorder)
+        await discovery.start()
+        for index in range(5):
+            discovery.enqueue('udp', f'10.0.0.{index},MAC{index}'.encode(), f'10.0.0.{index}')
+        assert discovery.stats()['dropped'] == 2
+        await asyncio.sleep(0.01)
+        await discovery.close()
+        return discovery.stats()
+
+    stats = asyncio.run(run())
+    assert [ip for ip, _mac, _battery, _transport in recorder.devices] == ['10.0.0.2', '10.0.0.3', '10.0.0.4']
+    assert (stats['dropped'], stats['pending']) == (2, 0)
+    assert len([message for message in recorder.logs if 'queue full' in message]) == 1
+
+
+def test_reading_stats_changes_nothing(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(fps_discovery.time, 'monotonic', lambda: clock[0])
+    discovery = service(Recorder())
+    clock[0] = 120.0
+    discovery._process([(119.5, 'udp', f'10.0.0.{index},MAC{index}'.encode(), '') for index in range(30)])
+    clock[0] = 121.0
+    first, second = discovery.stats(), discovery.stats()
+    assert first == second
+    assert first['rate'] == 3.0  # 30 reports in the 10 s window
+    assert first['queue_wait_max_ms'] == 500.0
+
+    clock[0] = 131.0
+    assert (discovery.stats()['rate'], discovery.stats()['queue_wait_max_ms']) == (0.0, 0.0)
+    assert discovery.stats()['queue_wait_avg_ms'] == 500.0
+
+
+def test_status_server_sheds_connections_over_its_budget():
+    reports = []
+
+    async def run():
+        server = StatusServer(lambda ip, mac, battery: reports.append((ip, mac, battery)), lambda *args: None,
+                              host='127.0.0.1', port=0, max_connections=1, read_timeout=2)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        _first_reader, first = await asyncio.open_connection('127.0.0.1', port)
+        await asyncio.sleep(0.05)  # The first connection is now waiting for its report
+        second_reader, second = await asyncio.open_connection('127.0.0.1', port)
+        assert await asyncio.wait_for(second_reader.read(), 2) == b''  # Closed without being served
+        first.write(b"STATUS|10.0.0.5|AA:BB|80\n")
+        await first.drain()
+        await asyncio.sleep(0.05)
+        first.close()
+        second.close()
+        await server.close()
+        return server.stats
+
+    stats = asyncio.run(run())
+    assert reports == [('10.0.0.5', 'AA:BB', '80')]
+    assert (stats['connections'], stats['shed'], stats['messages']) == (2, 1, 1)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+
+import fps_fleet
+from fps_fleet import DEVICE_ONLINE, DEVICE_STALE, DEVICE_UNVERIFIED, ContinuousReaders, DeviceRegistry
+
+
+def test_reports_and_sweeps():
+    registry = DeviceRegistry(stale_after=60, evict_after=600)
+    assert registry.report('10.0.0.5', 'AA:BB', 80, now=0) == 'new'
+    assert registry.report('10.0.0.5', 'AA:BB', 80, now=10) is None
+    assert registry.report('10.0.0.5', 'AA:BB', 75, now=20) == 'changed'
+    # A UDP broadcast carries no battery level and keeps the last one
+    assert registry.report('10.0.0.5', 'AA:BB', None, now=30) is None
+    assert registry.get('10.0.0.5')['battery'] == 75
+
+    assert registry.sweep(now=89) == ([], [])
+    assert registry.sweep(now=90) == (['10.0.0.5'], [])
+    assert registry.get('10.0.0.5')['state'] == DEVICE_STALE
+    assert registry.sweep(now=100) == ([], [])  # Reported as stale once
+    assert registry.report('10.0.0.5', 'AA:BB', 75, now=110) == 'revived'
+    assert registry.get('10.0.0.5')['state'] == DEVICE_ONLINE
+
+    assert registry.sweep(now=710) == ([], ['10.0.0.5'])
+    assert '10.0.0.5' not in registry and len(registry) == 0
+
+
+def test_kept_devices_are_not_evicted():
+    registry = DeviceRegistry(stale_after=60, evict_after=600)
+    registry.report('10.0.0.5', 'AA:BB', 80, now=0)
+    registry.report('10.0.0.6', 'CC:DD', 80, now=0)
+    assert registry.sweep(now=1000, keep=('10.0.0.5',)) == (['10.0.0.5'], ['10.0.0.6'])
+    assert registry.keys() == ['10.0.0.5']
+    assert registry.confirm('10.0.0.5', now=1001) is True
+    assert registry.confirm('10.0.0.5', now=1002) is False
+    assert registry.confirm('10.0.0.9') is False
+
+
+def test_get_returns_a_copy():
+    registry = DeviceRegistry()
+    registry.report('10.0.0.5', 'AA:BB', 80, now=0)
+    registry.get('10.0.0.5')['battery'] = 1
+    registry.snapshot()['10.0.0.5']['battery'] = 1
+    assert registry.get('10.0.0.5')['battery'] == 80
+    assert registry.get('10.0.0.9', 'missing') == 'missing'
+
+
+def test_saved_devices_load_as_unverified(tmp_path):
+    path = str(tmp_path / 'device_registry.json')
+    registry = DeviceRegistry(stale_after=60, evict_after=600)
+    registry.report('10.0.0.5', 'AA:BB', 80, now=0)
+    registry.report('10.0.0.6', 'CC:DD', 60, now=0)
+    registry.set_template_count('10.0.0.5', 12)
+    registry.save(path)
+    assert os.listdir(str(tmp_path)) == ['device_registry.json']
+
+    loaded = DeviceRegistry(stale_after=60, evict_after=600)
+    loaded.report('10.0.0.6', 'CC:DD', 55, now=5000)
+    assert loaded.load(path, now=5000) == ['10.0.0.5']  # Devices already known are left untouched
+    device = loaded.get('10.0.0.5')
+    assert (device['state'], device['battery'], device['template_count']) == (DEVICE_UNVERIFIED, 80, 12)
+    assert loaded.get('10.0.0.6')['battery'] == 55
+
+    # A loaded device gets a full TTL from the load, not from its last report
+    assert loaded.sweep(now=5050) == ([], [])
+    assert loaded.report('10.0.0.5', 'AA:BB', 80, now=5200) == 'verified'
+    assert loaded.get('10.0.0.5')['state'] == DEVICE_ONLINE
+
+
+def test_unreadable_cache_loads_nothing(tmp_path):
+    registry = DeviceRegistry()
+    assert registry.load(str(tmp_path / 'missing.json')) == []
+    broken = tmp_path / 'broken.json'
+    broken.write_text('{"devices": [{"ip": "10.0.0.5"}, ')
+    assert registry.load(str(broken)) == []
+    malformed = tmp_path / 'malformed.json'
+    malformed.write_text('{"devices": [{"ip": "10.0.0.5"}, {"ip": "10.0.0.6", "mac": "CC:DD", "battery": null, '
+                         '"last_seen": 0}]}')
+    assert registry.load(str(malformed)) == ['10.0.0.6']
+
+
+def test_reader_reconnects_after_an_overlong_line(monkeypatch):
+    monkeypatch.setattr(fps_fleet, 'CONTINUOUS_BACKOFF_INITIAL', 0.01)
+    logs = []
+
+    async def run():
+        connections = []
+        reconnected = asyncio.Event()
+
+        async def device(reader, writer):
+            connections.append(writer)
+            if len(connections) == 1:
+                writer.write(b"x" * (2 ** 17) + b"\n")  # Over the StreamReader limit of 64 KiB
+            else:
+                writer.write(b"CONTINUOUS|match\n")
+                reconnected.set()
+            await writer.drain()
+
+        server = await asyncio.start_server(device, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        readers = ContinuousReaders(asyncio.get_running_loop(), lambda message, color=None: logs.append(message), port)
+        readers.sync(['127.0.0.1'])
+        await asyncio.wait_for(reconnected.wait(), 5)
+        for _attempt in range(100):
+            if any('Legacy 5000 Log' in message for message in logs):
+                break
+            await asyncio.sleep(0.01)
+        task = readers.tasks['127.0.0.1']
+        readers.stop_all()
+        server.close()
+        for writer in connections:
+            writer.close()
+        return task
+
+    task = asyncio.run(run())
+    assert any('Log connection error' in message for message in logs)
+    assert logs[-1] == "[127.0.0.1] (Legacy 5000 Log) CONTINUOUS|match"
+    assert task.cancelled()
@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import contextlib
+import json
+
+import pytest
+
+import fps_management_daemon
+from fps_device_client import CommandError
+from fps_management_daemon import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, ApiError, ManagementDaemon
+
+IP = '10.0.0.5'
+
+
+class StubDevice:
+    """Stands in for the device side of managed() and push_folder()."""
+
+    def __init__(self):
+        self.refuse_manage = False
+        self.commands = []
+        self.pushed = []
+        self.template_ids = [1, 2]
+        self.gate = None  # asyncio.Event that LIST waits for, to hold a job in the running state
+
+    @contextlib.asynccontextmanager
+    async def managed(self, ip, port=None):
+        self.commands.append(('MANAGE', ip))
+        if self.refuse_manage:
+            raise CommandError("ERROR: Device busy")
+        try:
+            yield
+        finally:
+            self.commands.append(('NORMAL', ip))
+
+    async def push_folder(self, ip, folder, model_ids=None, port=None):
+        self.pushed.append((ip, list(model_ids)))
+        return len(model_ids), []
+
+    async def fetch_template_list(self, ip, port=None):
+        self.commands.append(('LIST', ip))
+        if self.gate:
+            await self.gate.wait()
+        if self.template_ids is None:
+            raise ConnectionRefusedError("Connection refused")
+        return [f"Template ID: {model_id}" for model_id in self.template_ids] + ["OK: List templates command complete."]
+
+
+@pytest.fixture
+def device(monkeypatch):
+    device = StubDevice()
+    monkeypatch.setattr(fps_management_daemon, 'managed', device.managed)
+    monkeypatch.setattr(fps_management_daemon, 'push_folder', device.push_folder)
+    monkeypatch.setattr(fps_management_daemon, 'fetch_template_list', device.fetch_template_list)
+    return device
+
+
+@pytest.fixture
+def daemon(tmp_path, device):
+    (tmp_path / 'templates').mkdir()
+    args = argparse.Namespace(templates=str(tmp_path / 'templates'), backups=str(tmp_path / 'backups'),
+                              metrics=str(tmp_path / 'metrics.json'), watch=True, autosync=[IP], no_udp=True)
+    daemon = ManagementDaemon(args)
+    daemon.registry.report(IP, 'AA:BB', 80)
+    return daemon
+
+
+def request(daemon, method, path, body=None):
+    """
+    handle_request() on a fresh loop, waiting for the jobs it queued. body is sent as JSON unless it
+    is a str already. Returns (status, payload); an ApiError as (status, message).
+    """
+    async def run():
+        try:
+            return await daemon.handle_request(method, path, body if isinstance(body, str) or body is None
+                                               else json.dumps(body))
+        except ApiError as e:
+            return e.status, str(e)
+        finally:
+            await jobs_finished(daemon)
+
+    return asyncio.run(run())
+
+
+async def jobs_finished(daemon):
+    while any(job['state'] in (JOB_QUEUED, JOB_RUNNING) for job in daemon.jobs.values()):
+        await asyncio.sleep(0.001)
+
+
+def test_autosync_is_retried_after_manage_is_refused(daemon, device):
+    async def run():
+        device.refuse_manage = True
+        daemon.on_templates_changed({3, 5}, set())
+        await jobs_finished(daemon)
+        assert [job['state'] for job in daemon.jobs.values()] == [JOB_FAILED]
+        assert daemon.autosync[IP] == {3, 5}
+        assert IP not in daemon.autosync_queued
+        assert daemon.autosync_retry[IP][0] == 1
+
+        # Reports during the backoff do not queue another attempt
+        daemon.on_device(IP, 'AA:BB', 80, 'tcp')
+        assert len(daemon.jobs) == 1
+
+        device.refuse_manage = False
+        daemon.autosync_retry[IP] = (1, 0)  # Backoff over
+        daemon.on_device(IP, 'AA:BB', 80, 'tcp')
+        await jobs_finished(daemon)
+        assert [job['state'] for job in daemon.jobs.values()] == [JOB_FAILED, JOB_DONE]
+        assert device.pushed == [(IP, [3, 5])]
+        assert daemon.autosync[IP] == set()
+        assert IP not in daemon.autosync_retry
+
+    asyncio.run(run())
+
+
+def test_autosync_backoff_doubles(daemon, device):
+    async def run():
+        device.refuse_manage = True
+        daemon.on_templates_changed({1}, set())
+        delays = []
+        for _attempt in range(3):
+            started = fps_management_daemon.time.monotonic()
+            await jobs_finished(daemon)
+            failures, retry_at = daemon.autosync_retry[IP]
+            delays.append(round(retry_at - started))
+            daemon.autosync_retry[IP] = (failures, 0)  # Backoff over
+            daemon.on_device(IP, 'AA:BB', 80, 'tcp')
+        await jobs_finished(daemon)
+        assert delays == [10, 20, 40]
+        assert device.commands == [('MANAGE', IP)] * 4
+
+    asyncio.run(run())
+
+
+
+def test_routes_and_errors(daemon):
+    status, payload = request(daemon, 'GET', '/devices')
+    assert status == 200 and [device['ip'] for device in payload['devices']] == [IP]
+    assert request(daemon, 'GET', '/jobs/7')[0] == 404
+    assert request(daemon, 'GET', '/jobs/abc')[0] == 404
+    assert request(daemon, 'GET', '/nothing')[0] == 404
+    assert request(daemon, 'POST', '/devices/10.0.0.99/templates')[0] == 404
+    assert request(daemon, 'POST', f'/devices/{IP}/format')[0] == 404
+    assert request(daemon, 'POST', f'/devices/{IP}/enroll', {'model_id': 'one'})[0] == 400
+    assert request(daemon, 'POST', f'/devices/{IP}/restore', {'path': 'missing.fpsarc'})[0] == 400
+    assert request(daemon, 'POST', f'/devices/{IP}/templates', [1])[0] == 400
+    assert request(daemon, 'POST', f'/devices/{IP}/templates', "{not json")[0] == 400
+    assert daemon.jobs == {}
+
+
+def test_job_states(daemon, device):
+    async def run():
+        device.gate = asyncio.Event()
+        job = daemon.submit('templates', IP, {})
+        assert job['state'] == JOB_QUEUED
+        while job['state'] == JOB_QUEUED:
+            await asyncio.sleep(0.001)
+        assert job['state'] == JOB_RUNNING and IP in daemon.busy
+        # A second job on the same device waits for the first one
+        second = daemon.submit('templates', IP, {})
+        await asyncio.sleep(0.01)
+        assert second['state'] == JOB_QUEUED
+        device.template_ids = None
+        device.gate.set()
+        await jobs_finished(daemon)
+        return job, second
+
+    job, second = asyncio.run(run())
+    assert (job['state'], second['state']) == (JOB_FAILED, JOB_FAILED)
+    assert job['error'] == "Connection refused"
+    assert device.commands == [('MANAGE', IP), ('LIST', IP), ('NORMAL', IP)] * 2
+    assert not daemon.busy
+
+    device.template_ids = [4, 9]
+    status, job = request(daemon, 'POST', f'/devices/{IP}/templates')
+    assert status == 202
+    status, job = request(daemon, 'GET', f"/jobs/{job['id']}")
+    assert (status, job['state'], job['result']) == (200, JOB_DONE, {'model_ids': [4, 9]})
+    assert daemon.registry.get(IP)['template_count'] == 2
+
+
+def test_fleet_requests(daemon):
+    daemon.registry.report('10.0.0.6', 'CC:DD', 70)
+    daemon.registry.report('10.0.0.7', 'EE:FF', 70, now=0)
+    daemon.registry.sweep()  # 10.0.0.7 turns stale
+    status, payload = request(daemon, 'POST', '/templates')
+    assert status == 202
+    assert [job['ip'] for job in payload['jobs']] == [IP, '10.0.0.6']
+
+    for devices in ('some', [IP, 5], {'ip': IP}):
+        assert request(daemon, 'POST', '/templates', {'devices': devices})[0] == 400
+    # Nothing is queued if one of the devices is unknown
+    assert request(daemon, 'POST', '/templates', {'devices': [IP, '10.0.0.99']})[0] == 404
+    assert len(daemon.jobs) == 2
+
+
+def test_autosync_switch(daemon):
+    daemon.registry.report('10.0.0.6', 'CC:DD', 70)
+    for enabled in ("false", 0, None):
+        assert request(daemon, 'POST', '/devices/10.0.0.6/autosync', {'enabled': enabled})[0] == 400
+    assert '10.0.0.6' not in daemon.autosync
+    assert request(daemon, 'POST', '/devices/10.0.0.6/autosync', {'enabled': True}) == \
+        (200, {'ip': '10.0.0.6', 'autosync': True})
+    assert request(daemon, 'POST', f'/devices/{IP}/autosync', {'enabled': False})[0] == 200
+    assert request(daemon, 'GET', '/autosync') == (200, {'watching': True, 'devices': {'10.0.0.6': []}})
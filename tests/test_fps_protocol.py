@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from fps_protocol import (LINE_ERROR, LINE_INFO, LINE_OK, LINE_SUCCESS, LINE_TEXT, LIST_COMPLETE, MAX_LINE, Line,
+                          ProtocolError, ResponseStream, classify)
+
+
+def stream(data, eof=True):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    if eof:
+        reader.feed_eof()
+    return ResponseStream(reader)
+
+
+def test_classify():
+    assert classify("SUCCESS: Enrolled") == Line(LINE_SUCCESS, "SUCCESS: Enrolled")
+    assert classify("ERROR: No finger").kind == LINE_ERROR
+    assert classify("OK: File transfer commencing.").kind == LINE_OK
+    assert classify("INFO: Place finger").kind == LINE_INFO
+    assert classify("Template ID: 5").kind == LINE_TEXT
+
+
+def test_responses_end_on_their_rule():
+    async def run():
+        responses = stream(b"INFO: Place finger\r\nINFO: Remove finger\nSUCCESS: Enrolled ID 3\n"
+                           b"Template ID: 1\n\nTemplate ID: 2\n" + LIST_COMPLETE.encode() + b"\n"
+                           b"OK: File transfer commencing.\n")
+        enroll = await responses.read_response("ENROLL")
+        listing = await responses.read_response("LIST")
+        ack = await responses.read_response("UPLOAD_TEMPLATE")
+        rest = await responses.read_response("DELETE")
+        return enroll, listing, ack, rest
+
+    enroll, listing, ack, rest = asyncio.run(run())
+    assert [line.kind for line in enroll] == [LINE_INFO, LINE_INFO, LINE_SUCCESS]
+    assert [line.text for line in listing] == ["Template ID: 1", "Template ID: 2", LIST_COMPLETE]
+    assert ack == [Line(LINE_OK, "OK: File transfer commencing.")]
+    assert rest == []  # The device closed the session
+
+
+def test_list_ends_on_error():
+    async def run():
+        return await stream(b"ERROR: Sensor busy\nTemplate ID: 1\n").read_response("LIST")
+
+    assert asyncio.run(run()) == [Line(LINE_ERROR, "ERROR: Sensor busy")]
+
+
+def test_binary_payload_follows_a_line_in_the_same_buffer():
+    payload = bytes(range(256)) * 8
+
+    async def run():
+        responses = stream(b"OK: File transfer commencing.\n" + payload + b"SUCCESS: Saved\n")
+        ack = await responses.read_line()
+        data = await responses.readexactly(len(payload))
+        result = await responses.read_line()
+        with pytest.raises(asyncio.IncompleteReadError):
+            await responses.readexactly(1)
+        return ack, data, result
+
+    ack, data, result = asyncio.run(run())
+    assert ack.kind == LINE_OK
+    assert data == payload
+    assert result == Line(LINE_SUCCESS, "SUCCESS: Saved")
+
+
+def test_endless_line_is_a_protocol_error():
+    async def run():
+        await stream(b"x" * (2 * MAX_LINE), eof=False).readline()
+
+    with pytest.raises(ProtocolError):
+        asyncio.run(run())
+
+
+def test_read_line_times_out():
+    async def run():
+        await stream(b"INFO: partial", eof=False).read_line(timeout=0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from fps_template_archive import HEADER_STRUCT, INDEX_ENTRY_STRUCT, ArchiveError, TemplateArchive, write_archive
+from fps_templates import TEMPLATE_SIZE, build_template, validate_template
+
+
+def device_templates():
+    return {model_id: build_template(bytes([model_id]) * (100 * model_id)) for model_id in (1, 2, 7, 15)}
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'device.fpsarc')
+    templates = device_templates()
+    assert write_archive(path, templates, source="192.168.1.50") == len(templates)
+    assert os.listdir(str(tmp_path)) == ['device.fpsarc']  # No temp file left behind
+    assert os.path.getsize(path) == HEADER_STRUCT.size + len(templates) * (INDEX_ENTRY_STRUCT.size + TEMPLATE_SIZE)
+
+    with TemplateArchive(path) as archive:
+        assert len(archive) == len(templates)
+        assert archive.ids() == [1, 2, 7, 15]
+        assert archive.source == "192.168.1.50"
+        for model_id, data in templates.items():
+            restored = bytes(archive.get(model_id))
+            assert restored == data
+            validate_template(restored)
+
+
+def test_corrupted_template_fails_its_checksum(tmp_path):
+    path = str(tmp_path / 'device.fpsarc')
+    templates = device_templates()
+    write_archive(path, templates)
+    with open(path, 'r+b') as f:
+        # Last byte of the last template (the archive stores them in ID order)
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    with TemplateArchive(path) as archive:
+        assert bytes(archive.get(1)) == templates[1]
+        with pytest.raises(ArchiveError):
+            archive.get(15)
+        assert len(archive.get(15, verify=False)) == TEMPLATE_SIZE
+
+
+@pytest.mark.parametrize('content', [b'', b'FPSTARC1', b'NOTANARC' + bytes(HEADER_STRUCT.size)])
+def test_unreadable_archives(tmp_path, content):
+    path = tmp_path / 'broken.fpsarc'
+    path.write_bytes(content)
+    with pytest.raises(ArchiveError):
+        TemplateArchive(str(path))
+
+
+def test_truncated_archive(tmp_path):
+    path = str(tmp_path / 'device.fpsarc')
+    write_archive(path, device_templates())
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 10)
+    with pytest.raises(ArchiveError):
+        TemplateArchive(path)
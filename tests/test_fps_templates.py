@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+import pytest
+
+import fps_templates
+from fps_templates import (TEMPLATE_PACKET_SIZE, TEMPLATE_SIZE, TemplateError, build_template, folder_template_ids,
+                           push_folder, receive_template_into, save_template, template_path, validate_template)
+
+
+def test_build_template_is_valid():
+    data = build_template(bytes(range(256)) * 6)
+    assert len(data) == TEMPLATE_SIZE
+    validate_template(data)
+
+
+@pytest.mark.parametrize('offset, value', [
+    (0, 0x00),                              # Start code
+    (TEMPLATE_PACKET_SIZE + 6, 0x08),       # Package id of a data packet
+    (2 * TEMPLATE_PACKET_SIZE + 8, 0x00),   # Length
+    (3 * TEMPLATE_PACKET_SIZE + 20, None),  # Payload byte, so the checksum no longer matches
+])
+def test_validate_template_rejects_broken_packets(offset, value):
+    data = bytearray(build_template(b'\x11' * 1536))
+    data[offset] = data[offset] ^ 0xFF if value is None else value
+    with pytest.raises(TemplateError):
+        validate_template(bytes(data))
+
+
+def test_validate_template_rejects_wrong_size():
+    with pytest.raises(TemplateError):
+        validate_template(build_template(b'') + b'\x00')
+
+
+def test_save_template_replaces_atomically(tmp_path):
+    folder = str(tmp_path / 'templates')
+    first, second = build_template(b'\x01'), build_template(b'\x02')
+    assert save_template(7, first, folder) == template_path(7, folder)
+    assert save_template(7, second, folder) == template_path(7, folder)
+    with open(template_path(7, folder), 'rb') as f:
+        assert f.read() == second
+    assert os.listdir(folder) == ['template_7.mb']
+    assert folder_template_ids(folder) == {7: template_path(7, folder)}
+
+
+def test_receive_template_into():
+    data = build_template(b'\x05' * 1536)
+
+    async def receive(stream_bytes):
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream_bytes)
+        reader.feed_eof()
+        buffer = bytearray(TEMPLATE_SIZE)
+        await receive_template_into(reader, buffer, timeout=1)
+        return bytes(buffer)
+
+    assert asyncio.run(receive(data + b'OK: done\n')) == data
+    with pytest.raises(TemplateError):
+        asyncio.run(receive(data[:100]))
+
+
+async def start_device(stalls):
+    """
+    A device stub on localhost that accepts DOWNLOAD_TEMPLATE sessions. It never answers for the
+    model IDs in stalls (the first time each is sent) and refuses ID 4.
+    """
+    received = []
+    sessions = []
+
+    async def session(reader, writer):
+        sessions.append(writer)
+        try:
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                model_id = int(line.split(',')[1])
+                if model_id in stalls:
+                    stalls.discard(model_id)
+                    await asyncio.sleep(10)
+                if model_id == 4:
+                    writer.write(b"ERROR: Slot locked\n")
+                    continue
+                writer.write(b"OK: File transfer commencing.\n")
+                data = await reader.readexactly(TEMPLATE_SIZE)
+                received.append((model_id, data))
+                writer.write(b"SUCCESS: Template stored.\n")
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(session, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1], received, sessions
+
+
+def test_push_folder_continues_after_a_broken_transfer(tmp_path, monkeypatch):
+    monkeypatch.setattr(fps_templates, 'DOWNLOAD_ACK_TIMEOUT', 0.2)
+    folder = str(tmp_path / 'templates')
+    for model_id in (1, 2, 3, 4):
+        save_template(model_id, build_template(bytes([model_id]) * 1536), folder)
+
+    async def run():
+        server, port, received, sessions = await start_device({2})
+        try:
+            result = await push_folder('127.0.0.1', folder, [1, 2, 3, 4, 9], port=port)
+        finally:
+            server.close()
+        return result, received, len(sessions)
+
+    (sent, errors), received, session_count = asyncio.run(run())
+    assert sent == 2
+    assert [model_id for model_id, _data in received] == [1, 3]
+    assert received[1][1] == build_template(b'\x03' * 1536)
+    assert sorted(errors) == [2, 4, 9]
+    assert errors[2].startswith("Transfer failed")
+    assert errors[4] == "ERROR: Slot locked"
+    assert errors[9].startswith("Not readable")
+    assert session_count == 2  # Reconnected once, after the stalled template
+
+
+def test_push_folder_raises_when_the_device_is_unreachable(tmp_path):
+    folder = str(tmp_path / 'templates')
+    save_template(1, build_template(b'\x01'), folder)
+
+    async def run():
+        server = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        await push_folder('127.0.0.1', folder, port=port)
+
+    with pytest.raises(OSError):
+        asyncio.run(run())
@@ -0,0 +1,27 @@
+import sqlite3
+
+import pytest
+
+from conftest import sensor_packets
+from fingerprint_store import template_digest
+
+OCTET_STREAM = {'Content-Type': 'application/octet-stream'}
+
+
+@pytest.mark.parametrize('search, max_offset', [('exhaustive', 0), ('exhaustive', 4), ('lsh', 0)])
+def test_detect_ignores_empty_stored_templates(matcher, monkeypatch, search, max_offset):
+    monkeypatch.setattr(matcher, 'DETECT_SEARCH', search)
+    monkeypatch.setattr(matcher, 'DETECT_MAX_OFFSET', max_offset)
+    template = bytes(range(256)) * 4
+    # The empty row was stored by an older /upload that still accepted templates without packets
+    with sqlite3.connect(matcher.DATABASE) as conn:
+        conn.executemany('INSERT INTO fingerprints (username, template, template_hash) VALUES (?, ?, ?)',
+                         [('old', b'', template_digest(b'')), ('alice', template, template_digest(template))])
+
+    client = matcher.app.test_client()
+    response = client.post('/detect', data=sensor_packets(template), headers=OCTET_STREAM)
+    assert response.status_code == 200
+    assert 'alice' in response.get_json()['message']
+
+    response = client.post('/detect', data=sensor_packets(bytes(reversed(template))), headers=OCTET_STREAM)
+    assert response.status_code == 404
@@ -0,0 +1,38 @@
+import sqlite3
+
+from conftest import sensor_packets
+
+OCTET_STREAM = {'Content-Type': 'application/octet-stream'}
+
+
+def rows(matcher):
+    with sqlite3.connect(matcher.DATABASE) as conn:
+        return conn.execute('SELECT username, template FROM fingerprints ORDER BY id').fetchall()
+
+
+def test_upload_without_template_is_rejected(matcher):
+    client = matcher.app.test_client()
+    response = client.post('/upload', data=b'no sensor packets here', headers=OCTET_STREAM)
+    assert response.status_code == 400
+    assert rows(matcher) == []
+
+
+def test_upload_skips_empty_stored_templates(matcher):
+    # A row stored by an older /upload that still accepted templates without packets
+    with sqlite3.connect(matcher.DATABASE) as conn:
+        conn.execute("INSERT INTO fingerprints (username, template, template_hash) VALUES ('old', ?, 'empty')", (b'',))
+
+    client = matcher.app.test_client()
+    template = bytes(range(256)) * 2
+    response = client.post('/upload', data=sensor_packets(template), headers=OCTET_STREAM)
+    assert response.status_code == 200
+
+    retry = client.post('/upload', data=sensor_packets(template), headers=OCTET_STREAM)
+    assert retry.status_code == 200
+    assert 'duplicate_of' in retry.get_json()
+
+    close = template[:-4] + b'\x01\x02\x03\x04'
+    response = client.post('/upload', data=sensor_packets(close), headers=OCTET_STREAM)
+    assert response.status_code == 200
+    assert response.get_json()['near_duplicate_of']['username'] == 'alice'
+    assert [username for username, _template in rows(matcher)] == ['old', 'alice', 'alice']